@@ -0,0 +1,133 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+from search_cache import normalize_key
+
+# --- 配置 ---
+# 是否启用回答缓存（默认关闭）
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "0") == "1"
+# 缓存数据库文件路径
+ANSWER_CACHE_PATH = os.getenv("ANSWER_CACHE_PATH", "answer_cache.db")
+# 缓存有效期（秒）
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "86400"))
+# 最多缓存的回答数量，超过后淘汰最久未使用的条目
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "1000"))
+
+
+def answer_key(model, question, context="", history=()):
+    """
+    生成回答缓存的键
+
+    由模型名称、规范化后的问题、整理后的搜索结果摘要和回放的历史消息共同决定，
+    只有发送给模型的内容完全一致时才会命中。
+    """
+    context_digest = hashlib.sha256((context or "").encode("utf-8")).hexdigest()
+    data = json.dumps([model, normalize_key(question), context_digest, list(history)], ensure_ascii=False)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+class AnswerCache:
+    """
+    基于 SQLite 的模型回答缓存，带过期时间和 LRU 容量限制
+
+    未启用时 get() 总是返回 None，put() 不做任何事。
+    """
+
+    def __init__(self, path=ANSWER_CACHE_PATH, ttl=ANSWER_CACHE_TTL, max_entries=ANSWER_CACHE_MAX_ENTRIES,
+                 enabled=ANSWER_CACHE_ENABLED):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max(1, max_entries)
+        self.enabled = enabled
+        self.stats = {"hits": 0, "misses": 0, "expired": 0, "evictions": 0}
+        self._lock = threading.Lock()
+        self._conn = None
+        if not enabled:
+            return
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS answer_cache (
+                key TEXT PRIMARY KEY,
+                answer TEXT NOT NULL,
+                created REAL NOT NULL,
+                accessed REAL NOT NULL
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_answer_cache_accessed ON answer_cache (accessed)")
+        self._conn.commit()
+
+    def get(self, key):
+        """
+        读取缓存
+
+        Returns:
+            str: 缓存的回答；未启用、未命中或已过期时返回 None
+        """
+        if not self.enabled:
+            return None
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT answer, created FROM answer_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.stats["misses"] += 1
+                return None
+
+            answer, created = row
+            if now - created > self.ttl:
+                self._conn.execute("DELETE FROM answer_cache WHERE key = ?", (key,))
+                self._conn.commit()
+                self.stats["expired"] += 1
+                self.stats["misses"] += 1
+                return None
+
+            self._conn.execute("UPDATE answer_cache SET accessed = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.stats["hits"] += 1
+        return answer
+
+    def put(self, key, answer):
+        """写入缓存，超过容量时淘汰最久未使用的条目"""
+        if not self.enabled or not answer:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO answer_cache (key, answer, created, accessed) VALUES (?, ?, ?, ?)",
+                (key, answer, now, now),
+            )
+            count = self._conn.execute("SELECT COUNT(*) FROM answer_cache").fetchone()[0]
+            overflow = count - self.max_entries
+            if overflow > 0:
+                self._conn.execute(
+                    "DELETE FROM answer_cache WHERE key IN "
+                    "(SELECT key FROM answer_cache ORDER BY accessed ASC LIMIT ?)",
+                    (overflow,),
+                )
+                self.stats["evictions"] += overflow
+            self._conn.commit()
+
+    def clear(self):
+        """清空缓存"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._conn.execute("DELETE FROM answer_cache")
+            self._conn.commit()
+
+    def snapshot(self):
+        """返回命中、未命中、淘汰等计数"""
+        with self._lock:
+            data = dict(self.stats)
+            data["enabled"] = self.enabled
+            data["entries"] = (self._conn.execute("SELECT COUNT(*) FROM answer_cache").fetchone()[0]
+                               if self.enabled else 0)
+        lookups = data["hits"] + data["misses"]
+        data["hit_rate"] = data["hits"] / lookups if lookups else 0.0
+        return data
+
+
+answer_cache = AnswerCache()
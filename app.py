@@ -1,56 +1,74 @@
 import os
 import json
-import re
 import time
+import hashlib
 from datetime import datetime
-from flask import Flask, render_template, request, jsonify, session, Response, stream_with_context
-import ollama
-from key_words_abstract import get_key_words
-from web_crawler_server import search, get_search_title
+from flask import Flask, render_template, request, jsonify, session, Response
+from chat_model import MODEL_NAME, METRIC_FIELDS, HISTORY_MAX_TURNS, stream_chat, join_parts, build_messages, history_window, model_monitor
+from model_health import CircuitOpenError
+from key_words_abstract import get_key_words, keyword_cache, keyword_flight
+from web_crawler_server import driver_pool, get_fetch_stats, TimeBudget
+from crawl_profile import crawl_profiles
+from search_cache import cached_search_events, search_cache, search_flight
+from context_builder import build_context, build_prompt
+from answer_cache import answer_cache, answer_key
+from qa_index import qa_index
+from telemetry import telemetry, span, start_trace, end_trace
+from history_store import history_store
+from conversation_index import conversation_index, PAGE_SIZE
+from chat_jobs import job_manager, QueueFullError, FINISHED_STATES
+from cancellation import Cancelled, check_cancelled
+
+# 在后台建立历史问答索引
+qa_index.start()
 
 # 创建Flask应用
 app = Flask(__name__)
 app.secret_key = os.urandom(24)  # 用于session加密
 
-# 存储聊天历史的目录
-HISTORY_DIR = "chat_history"
-os.makedirs(HISTORY_DIR, exist_ok=True)
+# 流式响应没有新事件时发送心跳的间隔（秒），也是发现客户端断开的最长延迟
+DISCONNECT_CHECK_INTERVAL = float(os.getenv("DISCONNECT_CHECK_INTERVAL", "5"))
+# 是否默认使用流水线搜索：到达回答截止时间时用已经拿到的摘要和正文生成回答，丢弃迟到的正文
+# 请求中的 pipeline 字段可以按次覆盖
+SEARCH_PIPELINE_ENABLED = os.getenv("SEARCH_PIPELINE_ENABLED", "0") == "1"
+# 流水线搜索时，从收到问题到开始生成回答的最长时间（秒），包括关键词提取和搜索
+SEARCH_ANSWER_DEADLINE = float(os.getenv("SEARCH_ANSWER_DEADLINE", "8"))
 
-# 清理模型响应的函数
-def clean_model_response(response_text):
-    """
-    清理模型响应，去除元数据但保留思考过程
+def answer_budget(started, pipeline):
     """
-    # 提取消息内容部分
-    content_match = re.search(r"content='(.*?)', images=", response_text, re.DOTALL)
-    if content_match:
-        # 提取content字段内容并返回，保留思考过程
-        content = content_match.group(1)
-        return content.strip()
-    else:
-        # 如果无法匹配标准格式，尝试直接清理元数据
-        result = re.sub(r'^model=.*?\n', '', response_text, flags=re.MULTILINE)
-        result = re.sub(r'^created_at=.*?\n', '', result, flags=re.MULTILINE)
-        result = re.sub(r'^done=.*?\n', '', result, flags=re.MULTILINE)
-        result = re.sub(r'^done_reason=.*?\n', '', result, flags=re.MULTILINE)
-        result = re.sub(r'^total_duration=.*?\n', '', result, flags=re.MULTILINE)
-        result = re.sub(r'^load_duration=.*?\n', '', result, flags=re.MULTILINE)
-        result = re.sub(r'^prompt_eval.*?\n', '', result, flags=re.MULTILINE)
-        result = re.sub(r'^eval_.*?\n', '', result, flags=re.MULTILINE)
-        result = re.sub(r'^message=.*?\n', '', result, flags=re.MULTILINE)
-        
-        # 保留思考过程
-        return result.strip()
+    流水线搜索时本轮搜索剩余的时间预算，否则返回 None（使用搜索默认的预算）
 
-def search_online(question):
-    """在线搜索相关信息"""
-    try:
-        key_words = get_key_words(question)
-        search_results = search(key_words)
-        return search_results
-    except Exception as e:
-        print(f"联网搜索出错: {e}")
+    Args:
+        started: 本轮开始的时间（time.monotonic()）
+    """
+    if not pipeline:
         return None
+    return TimeBudget(max(0.0, SEARCH_ANSWER_DEADLINE - (time.monotonic() - started)))
+
+def source_report(search_results, sources=None, selected=()):
+    """
+    报告哪些搜索结果进入了提示词
+
+    Args:
+        sources: 搜索 done 事件中的 sources（各条结果正文的获取情况）；
+                 结果来自缓存时为 None，按是否有正文推断
+        selected: build_context() 选中的段落
+
+    Returns:
+        list: [{"index", "title", "body", "passages"}, ...]，passages 为放入提示词的正文段落数
+    """
+    if not isinstance(search_results, list):
+        return []
+    body = {source["index"]: source["body"] for source in sources or ()}
+    passages = {}
+    for passage in selected:
+        passages[passage["result"]] = passages.get(passage["result"], 0) + 1
+    return [{
+        "index": i,
+        "title": item.get("title", ""),
+        "body": body.get(i, "fetched" if item.get("content") else "none"),
+        "passages": passages.get(i, 0),
+    } for i, item in enumerate(search_results)]
 
 def get_conversation_id():
     """获取当前会话ID，如果没有则创建一个新的"""
@@ -58,18 +76,12 @@ def get_conversation_id():
         session['conversation_id'] = f"chat_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
     return session['conversation_id']
 
-def save_chat_history(conversation_id, user_message, bot_message, search_results=None):
-    """保存聊天历史到本地文件"""
-    history_file = os.path.join(HISTORY_DIR, f"{conversation_id}.json")
-    
-    # 获取现有历史记录
-    if os.path.exists(history_file):
-        with open(history_file, 'r', encoding='utf-8') as f:
-            history = json.load(f)
-    else:
-        history = []
-    
-    # 添加新消息
+def save_chat_history(conversation_id, user_message, bot_message, search_results=None, cached=False, metrics=None):
+    """
+    保存聊天历史到本地文件（追加一行记录，不重写整个文件）
+
+    metrics 为本轮生成的 token 数和耗时，随记录一起保存便于分析。
+    """
     timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
     new_entry = {
         "timestamp": timestamp,
@@ -79,48 +91,26 @@ def save_chat_history(conversation_id, user_message, bot_message, search_results
     
     if search_results:
         new_entry["search_results"] = search_results
+    if cached:
+        new_entry["cached"] = True
+    if metrics:
+        new_entry["metrics"] = metrics
         
-    history.append(new_entry)
-    
-    # 保存更新后的历史记录
-    with open(history_file, 'w', encoding='utf-8') as f:
-        json.dump(history, f, ensure_ascii=False, indent=2)
-
-def get_all_conversations():
-    """获取所有会话列表"""
-    conversations = []
-    for filename in os.listdir(HISTORY_DIR):
-        if filename.endswith('.json'):
-            conv_id = filename.replace('.json', '')
-            # 读取第一条消息作为会话标题
-            try:
-                with open(os.path.join(HISTORY_DIR, filename), 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    if data:
-                        title = data[0]["user"][:20] + "..." if len(data[0]["user"]) > 20 else data[0]["user"]
-                        timestamp = data[0]["timestamp"]
-                    else:
-                        title = "空会话"
-                        timestamp = ""
-                conversations.append({
-                    "id": conv_id,
-                    "title": title,
-                    "timestamp": timestamp
-                })
-            except:
-                continue
-    
-    # 按时间戳排序，最新的在前面
-    conversations.sort(key=lambda x: x["timestamp"] if x["timestamp"] else "", reverse=True)
-    return conversations
+    history_store.append(conversation_id, new_entry)
+
+def get_all_conversations(offset=0, limit=PAGE_SIZE, sort="first"):
+    """获取会话列表（从会话目录读取，最新的在前面）"""
+    return conversation_index.list(offset=offset, limit=limit, sort=sort)
 
 def get_chat_history(conversation_id):
     """获取特定会话的历史记录"""
-    history_file = os.path.join(HISTORY_DIR, f"{conversation_id}.json")
-    if os.path.exists(history_file):
-        with open(history_file, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    return []
+    return history_store.read(conversation_id)
+
+def get_recent_history(conversation_id):
+    """读取本轮请求需要回放给模型的最近几轮历史记录"""
+    page, total = history_store.read_page(conversation_id, limit=HISTORY_MAX_TURNS)
+    start = history_window(total)
+    return [entry for index, entry in page if index >= start]
 
 @app.route('/')
 def index():
@@ -135,192 +125,369 @@ def send_message():
     message = data.get('message', '')
     enable_web_search = data.get('enable_web_search', True)
     return_search_progress = data.get('return_search_progress', False)
+    # 是否逐个 token 流式返回模型输出
+    stream = data.get('stream', return_search_progress)
+    # 为 True 时跳过回答缓存，总是重新生成
+    no_cache = data.get('no_cache', False)
+    # 为 True 时在流式响应中返回本轮各阶段的耗时
+    trace = data.get('trace', False)
+    # 为 True 时使用流水线搜索，到达回答截止时间即开始生成
+    pipeline = data.get('pipeline', SEARCH_PIPELINE_ENABLED)
     conversation_id = get_conversation_id()
     
     if not message.strip():
         return jsonify({"error": "消息不能为空"}), 400
     
-    # 如果客户端需要实时搜索进度，使用流式响应
-    if return_search_progress and enable_web_search:
-        return Response(
-            stream_with_context(stream_search_and_response(message, conversation_id)),
-            content_type='application/json'
-        )
-    
-    # 否则使用传统响应方式
-    # 联网搜索
-    search_results = None
-    formatted_results = None
-    
-    if enable_web_search:
-        search_results = search_online(message)
-        
-        if isinstance(search_results, list):
-            formatted_results = ""
-            for i, item in enumerate(search_results):
-                formatted_results += f"\n结果 {i+1}:\n"
-                if 'title' in item:
-                    formatted_results += f"标题: {item['title']}\n"
-                if 'snippet' in item:
-                    formatted_results += f"摘要: {item['snippet']}\n"
-                if 'content' in item:
-                    # 限制正文长度
-                    content = item['content']
-                    if len(content) > 1000:
-                        content = content[:1000] + "...(内容已截断)"
-                    formatted_results += f"正文: {content}\n"
-                formatted_results += "\n"
-        elif search_results:
-            formatted_results = str(search_results)
+    # 实际处理都在后台任务中执行，受任务队列的并发上限约束
+    try:
+        job = submit_chat_job(message, conversation_id, enable_web_search, no_cache, trace, pipeline)
+    except QueueFullError as e:
+        return jsonify({"error": str(e)}), 503
     
-    # 构建模型提示
-    if formatted_results:
-        augmented_message = message + "\t" + "以下是联网搜索的结果，请你结合联网搜索的结果和你自身的记忆回答用户的问题，如果记忆和联网搜索有出入，请以联网搜索的结果为准，搜索结果为：" + formatted_results
-    else:
-        augmented_message = message
+    # 客户端可以用响应头中的任务ID调用 /api/jobs/<job_id>/cancel 主动取消
+    # 如果客户端需要实时搜索进度或流式输出，使用流式响应
+    if stream or (return_search_progress and enable_web_search):
+        return Response(stream_job_events(job), content_type='application/x-ndjson',
+                        headers={'X-Job-Id': job.id})
     
+    # 否则等待任务结束后一次性返回完整回答
+    response, status = wait_job_response(job)
+    return jsonify(response), status, {'X-Job-Id': job.id}
+
+def wait_job_response(job):
+    """
+    等待任务结束，把 final_response 事件转换为非流式接口的响应
+
+    Returns:
+        tuple: (响应内容, HTTP 状态码)；出错时返回错误事件中的状态码（模型熔断时为 503）
+    """
+    final, error = None, None
+    for line in job.iter_events(timeout=DISCONNECT_CHECK_INTERVAL):
+        if not line.strip():
+            continue
+        event = json.loads(line)
+        if event.get("type") == "final_response":
+            final = event
+        elif event.get("type") == "error":
+            error = event
+    if final is not None:
+        final.pop("type")
+        return final, 200
+    if error is not None:
+        return {"error": error["error"]}, error.get("status", 500)
+    return {"error": "对话已取消"}, 409
+
+def stream_job_events(job):
+    """
+    转发任务事件；客户端在任务结束前断开连接时取消任务
+
+    连接断开在下一次写入时才能发现，长时间没有事件时靠心跳空行及时发现。
+    与 /api/jobs/<job_id>/events 不同，这里的连接不支持断线重连，断开即视为放弃本轮对话。
+    """
+    finished = False
     try:
-        # 调用模型
-        response = ollama.chat(model="deepseek-r1:7b", messages=[{"role": "user", "content": augmented_message}])
-        
-        if isinstance(response, dict):
-            if "response" in response:
-                model_response = response["response"]
-            elif "message" in response and isinstance(response["message"], dict):
-                model_response = response["message"].get("content", str(response))
-            else:
-                model_response = str(response)
-        else:
-            model_response = str(response)
-        
-        # 清理响应
-        model_response = clean_model_response(model_response)
-        
-        # 保存历史记录
-        save_chat_history(conversation_id, message, model_response, formatted_results)
-        
-        return jsonify({
-            "response": model_response,
-            "has_search_results": bool(formatted_results),
-            "conversation_id": conversation_id
-        })
-        
-    except Exception as e:
-        print(f"调用模型出错: {e}")
-        try:
-            # 备用方法
-            import subprocess
-            cmd = ["ollama", "run", "deepseek-r1:7b", "-m", message]
-            result = subprocess.run(cmd, text=True, capture_output=True, timeout=60)
-            
-            if result.returncode == 0:
-                model_response = result.stdout.strip()
-                model_response = clean_model_response(model_response)
-                
-                # 保存历史记录
-                save_chat_history(conversation_id, message, model_response, formatted_results)
-                
-                return jsonify({
-                    "response": model_response,
-                    "has_search_results": bool(formatted_results),
-                    "conversation_id": conversation_id
-                })
-            else:
-                return jsonify({"error": f"命令行调用失败: {result.stderr}"}), 500
-        except Exception as e2:
-            return jsonify({"error": f"所有尝试都失败了: {str(e)} 和 {str(e2)}"}), 500
-
-def stream_search_and_response(message, conversation_id):
-    """流式生成搜索进度和最终响应"""
+        yield from job.iter_events(timeout=DISCONNECT_CHECK_INTERVAL)
+        finished = True
+    finally:
+        if not finished and job.status not in FINISHED_STATES:
+            print(f"客户端已断开，取消任务 {job.id}")
+            job_manager.cancel(job.id, "客户端已断开连接")
+
+def search_progress_event(event):
+    """将爬虫产出的搜索事件转换为前端使用的 search_progress 消息"""
+    if event["type"] == "serp_loaded":
+        title = event.get("title") or "百度搜索"
+        return {"type": "search_progress", "stage": "serp_loaded", "title": title, "count": event.get("count", 0)}
+    if event["type"] == "result":
+        return {"type": "search_progress", "stage": "result", "title": event["title"], "index": event["index"],
+                "snippet": event.get("snippet", "")}
+    if event["type"] == "content":
+        if not event.get("ok"):
+            return None
+        return {"type": "search_progress", "stage": "content", "title": f"正在阅读：{event['title']}", "index": event["index"]}
+    return None
+
+def stream_search_and_response(message, conversation_id, enable_web_search=True, no_cache=False, trace=False,
+                               pipeline=False):
+    """
+    流式生成搜索进度、模型输出和最终响应
+
+    发送给模型的内容与之前某次完全一致时（且未设置 no_cache），不调用模型，
+    直接发送缓存的回答，final_response 中 cached 为 true。
+
+    pipeline 为 True 时，搜索结果页解析后即转发各条结果的摘要，正文边提取边到达；
+    从本轮开始经过 SEARCH_ANSWER_DEADLINE 秒后不再等待剩余的正文，用已经拿到的内容生成回答。
+
+    每行一个 JSON 事件：
+        search_progress: 搜索进度；联网搜索后 stage 为 sources 的事件报告各条结果的正文
+                         是否进入了提示词（sources，见 source_report()）以及是否有正文迟到被丢弃（partial）
+        token: 模型输出片段，channel 为 think（思考过程）或 answer（回答）
+        trace: 各阶段耗时（仅在 trace 为 True 时），在 final_response 或 error 之前发送
+        final_response: 完整回答，生成结束后发送
+        error: 出错
+
+    所在任务被取消时（客户端断开或主动取消），搜索、关键词提取和模型调用在下一次检查处停止，
+    生成器直接结束，不保存历史记录，也不发送 final_response。
+    """
+    request_trace, trace_token = start_trace() if trace else (None, None)
+    started = time.monotonic()
     try:
-        key_words = get_key_words(message)
-        
-        # 先发送初始搜索标题
-        initial_title = f"{key_words}_搜索中..."
-        yield json.dumps({"type": "search_progress", "title": initial_title}) + '\n'
-        
-        # 启动搜索并实时获取搜索标题
-        search_titles = get_search_title(key_words)
-        
-        # 同时进行搜索获取正文内容
-        search_results = search(key_words)
-        formatted_results = ""
-        
-        # 逐个生成标题更新
-        for title in search_titles:
-            yield json.dumps({"type": "search_progress", "title": title}) + '\n'
-            time.sleep(0.5)  # 适当间隔，不要太频繁
-        
-        # 处理搜索结果
-        if isinstance(search_results, list):
-            formatted_results = ""
-            for i, item in enumerate(search_results):
-                formatted_results += f"\n结果 {i+1}:\n"
-                if 'title' in item:
-                    formatted_results += f"标题: {item['title']}\n"
-                    # 发送最后的结果标题
-                    if i == 0:  # 只发送第一个结果的标题作为最终标题
-                        yield json.dumps({"type": "search_progress", "title": item['title']}) + '\n'
-                if 'snippet' in item:
-                    formatted_results += f"摘要: {item['snippet']}\n"
-                if 'content' in item:
-                    # 限制正文长度
-                    content = item['content']
-                    if len(content) > 1000:
-                        content = content[:1000] + "...(内容已截断)"
-                    formatted_results += f"正文: {content}\n"
-                formatted_results += "\n"
-        elif search_results:
-            formatted_results = str(search_results)
+        search_results = None
+        sources = None
+        partial = False
+        # 先查询历史问答，几乎相同的问题直接复用当时的搜索结果，跳过联网搜索
+        with span("qa_recall"):
+            reused_results, memory, score = qa_index.recall(message, conversation_id)
+        if enable_web_search and reused_results:
+            yield json.dumps({"type": "search_progress", "stage": "reused", "title": f"找到相似的历史问题（相似度 {score:.2f}），使用当时的搜索结果"}) + '\n'
+        elif enable_web_search:
+            key_words = get_key_words(message)
+            
+            # 先发送初始搜索标题
+            initial_title = f"{key_words}_搜索中..."
+            yield json.dumps({"type": "search_progress", "title": initial_title}) + '\n'
+            
+            # 只进行一次搜索，边搜索边把进度转发给前端
+            for event in cached_search_events(key_words, answer_budget(started, pipeline)):
+                if event["type"] == "done":
+                    search_results = event["results"]
+                    sources = event.get("sources")
+                    partial = event.get("partial", False)
+                    if event.get("cached"):
+                        yield json.dumps({"type": "search_progress", "stage": "cached", "title": f"{key_words}_使用缓存的搜索结果"}) + '\n'
+                    break
+                progress = search_progress_event(event)
+                if progress:
+                    yield json.dumps(progress) + '\n'
         
-        # 构建模型提示
-        if formatted_results:
-            augmented_message = message + "\t" + "以下是联网搜索的结果，请你结合联网搜索的结果和你自身的记忆回答用户的问题，如果记忆和联网搜索有出入，请以联网搜索的结果为准，搜索结果为：" + formatted_results
+        # 处理搜索结果，只把与问题最相关的段落放入提示词
+        if isinstance(search_results, list) and search_results and search_results[0].get('title'):
+            # 发送第一个结果的标题作为最终标题
+            yield json.dumps({"type": "search_progress", "title": search_results[0]['title']}) + '\n'
+        report = None
+        if enable_web_search and reused_results:
+            formatted_results = reused_results
         else:
-            augmented_message = message
+            selected = []
+            with span("context"):
+                formatted_results = build_context(message, search_results, selected=selected)
+            if enable_web_search:
+                report = source_report(search_results, sources, selected)
+                yield json.dumps({"type": "search_progress", "stage": "sources", "sources": report, "partial": partial}) + '\n'
         
-        # 调用模型
-        response = ollama.chat(model="deepseek-r1:7b", messages=[{"role": "user", "content": augmented_message}])
+        # 构建模型提示，带上最近几轮历史，支持追问
+        with span("prompt"):
+            augmented_message = build_prompt(message, formatted_results, memory)
+            messages = build_messages(get_recent_history(conversation_id), augmented_message)
+        cache_key = answer_key(MODEL_NAME, message, formatted_results + memory, messages[:-1])
+        model_response = None if no_cache else answer_cache.get(cache_key)
+        cached = model_response is not None
+        metrics = {}
         
-        if isinstance(response, dict):
-            if "response" in response:
-                model_response = response["response"]
-            elif "message" in response and isinstance(response["message"], dict):
-                model_response = response["message"].get("content", str(response))
-            else:
-                model_response = str(response)
-        else:
-            model_response = str(response)
+        if not cached:
+            # 流式调用模型，逐个片段转发给前端
+            think, answer = [], []
+            for channel, text in stream_chat(messages, metrics=metrics):
+                (think if channel == "think" else answer).append(text)
+                yield json.dumps({"type": "token", "channel": channel, "text": text}) + '\n'
+            model_response = join_parts("".join(think), "".join(answer))
+            answer_cache.put(cache_key, model_response)
         
-        # 清理响应
-        model_response = clean_model_response(model_response)
+        # 生成结束后再保存历史记录；此时已取消的对话没有人接收，不再保存
+        check_cancelled()
+        save_chat_history(conversation_id, message, model_response, formatted_results, cached=cached, metrics=metrics)
         
-        # 保存历史记录
-        save_chat_history(conversation_id, message, model_response, formatted_results)
+        if request_trace:
+            yield json.dumps({"type": "trace", "spans": request_trace.to_list()}) + '\n'
         
         # 发送最终响应
         yield json.dumps({
             "type": "final_response",
             "response": model_response,
             "has_search_results": bool(formatted_results),
-            "conversation_id": conversation_id
+            "sources": report,
+            "conversation_id": conversation_id,
+            "cached": cached,
+            "metrics": metrics
         }) + '\n'
         
+    except Cancelled as e:
+        print(f"对话已取消: {e}")
     except Exception as e:
         print(f"流式响应出错: {e}")
-        yield json.dumps({"type": "error", "error": str(e)}) + '\n'
+        if request_trace:
+            yield json.dumps({"type": "trace", "spans": request_trace.to_list()}) + '\n'
+        # 后端连续失败（熔断）时为 503，非流式接口据此返回状态码
+        status = 503 if isinstance(e, CircuitOpenError) else 500
+        yield json.dumps({"type": "error", "error": str(e), "status": status}) + '\n'
+    finally:
+        if trace_token is not None:
+            end_trace(trace_token)
+
+def submit_chat_job(message, conversation_id, enable_web_search=True, no_cache=False, trace=False, pipeline=False):
+    """把一轮对话提交为后台任务"""
+    return job_manager.submit(
+        conversation_id, message,
+        lambda: stream_search_and_response(message, conversation_id, enable_web_search, no_cache, trace, pipeline)
+    )
+
+@app.route('/api/jobs', methods=['POST'])
+def create_job():
+    """提交一轮对话任务，立即返回任务ID"""
+    data = request.json
+    message = data.get('message', '')
+    enable_web_search = data.get('enable_web_search', True)
+    no_cache = data.get('no_cache', False)
+    trace = data.get('trace', False)
+    pipeline = data.get('pipeline', SEARCH_PIPELINE_ENABLED)
+    conversation_id = get_conversation_id()
+    
+    if not message.strip():
+        return jsonify({"error": "消息不能为空"}), 400
+    
+    try:
+        job = submit_chat_job(message, conversation_id, enable_web_search, no_cache, trace, pipeline)
+    except QueueFullError as e:
+        return jsonify({"error": str(e)}), 503
+    return jsonify(job.to_dict()), 202
+
+@app.route('/api/jobs')
+def get_jobs():
+    """任务队列状态：工作线程数、排队数、运行数等"""
+    return jsonify(job_manager.snapshot())
+
+@app.route('/api/jobs/<job_id>')
+def get_job(job_id):
+    """获取任务状态"""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"error": "任务不存在"}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/api/jobs/<job_id>/events')
+def get_job_events(job_id):
+    """
+    以 NDJSON 流的形式读取任务事件，直到任务结束
+
+    断线后可以用 since=已收到的事件行数 重新连接，从中断处继续。
+    """
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"error": "任务不存在"}), 404
+    since = request.args.get('since', 0, type=int)
+
+    def generate():
+        yield from job.iter_events(since)
+        # 最后告知客户端任务的结束状态（不计入事件行数）
+        yield json.dumps({"type": "job_status", "status": job.status}) + '\n'
+
+    return Response(generate(), content_type='application/x-ndjson')
+
+@app.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    """取消任务"""
+    job = job_manager.cancel(job_id)
+    if job is None:
+        return jsonify({"error": "任务不存在"}), 404
+    return jsonify(job.to_dict())
 
 @app.route('/api/history')
 def get_history():
-    """获取历史会话列表"""
-    conversations = get_all_conversations()
+    """获取历史会话列表，支持 offset / limit / sort 分页参数"""
+    offset = request.args.get('offset', 0, type=int)
+    limit = min(request.args.get('limit', PAGE_SIZE, type=int), 200)
+    sort = request.args.get('sort', 'first')
+    conversations = get_all_conversations(offset, limit, sort)
     return jsonify(conversations)
 
+def conditional_json(data_loader, version, request_key):
+    """
+    带 ETag 的 JSON 响应：客户端缓存仍然有效时返回 304，且不读取任何记录
+
+    Args:
+        data_loader: 无参函数，返回响应数据
+        version: 数据版本标识
+        request_key: 影响响应内容的请求参数
+    """
+    etag = hashlib.sha1(f"{version}#{request_key}".encode("utf-8")).hexdigest()
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = jsonify(data_loader())
+    response.set_etag(etag)
+    # 允许浏览器缓存，但每次使用前都要用 ETag 向服务器确认
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
 @app.route('/api/history/<conversation_id>')
 def get_conversation(conversation_id):
-    """获取特定会话的历史记录"""
-    history = get_chat_history(conversation_id)
-    return jsonify(history)
+    """
+    获取特定会话的历史记录
+
+    查询参数：
+        limit: 指定后按游标分页，从最新一轮开始返回最多 limit 轮
+        before: 游标，返回下标小于该值的轮次（取自上一页的 next_cursor）
+        include_search: 为 0 时不返回 search_results，只标记 has_search_results
+
+    未指定 limit 时返回完整记录数组（与旧版接口一致）。
+    """
+    limit = request.args.get('limit', type=int)
+    before = request.args.get('before', type=int)
+    include_search = request.args.get('include_search', '1') != '0'
+
+    def strip_search(entry):
+        if include_search:
+            return entry
+        entry = dict(entry)
+        entry["has_search_results"] = bool(entry.pop("search_results", None))
+        return entry
+
+    def load():
+        if limit is None:
+            return [strip_search(entry) for entry in get_chat_history(conversation_id)]
+
+        page, total = history_store.read_page(conversation_id, before=before, limit=min(limit, 200))
+        turns = []
+        for index, entry in page:
+            entry = strip_search(entry)
+            entry["index"] = index
+            turns.append(entry)
+        first_index = page[0][0] if page else 0
+        return {
+            "turns": turns,
+            "total": total,
+            "next_cursor": first_index if first_index > 0 else None
+        }
+
+    return conditional_json(load, history_store.version(conversation_id), request.query_string.decode())
+
+@app.route('/api/history/<conversation_id>/turns/<int:index>/search_results')
+def get_turn_search_results(conversation_id, index):
+    """按需获取某一轮对话的联网搜索结果"""
+    def load():
+        page, _ = history_store.read_page(conversation_id, before=index + 1, limit=1)
+        if not page or page[0][0] != index:
+            return {"search_results": None}
+        return {"search_results": page[0][1].get("search_results")}
+
+    return conditional_json(load, history_store.version(conversation_id), str(index))
+
+@app.route('/api/history/<conversation_id>/metrics')
+def get_conversation_metrics(conversation_id):
+    """返回会话每一轮的生成统计（token 数、加载/提示词/生成耗时）及合计"""
+    if not history_store.exists(conversation_id):
+        return jsonify({"error": "会话不存在"}), 404
+
+    turns = []
+    totals = {}
+    for index, entry in enumerate(history_store.read(conversation_id)):
+        metrics = entry.get("metrics")
+        if not metrics:
+            continue
+        turns.append({"index": index, "timestamp": entry.get("timestamp"), "metrics": metrics})
+        for field in METRIC_FIELDS:
+            totals[field] = totals.get(field, 0) + metrics.get(field, 0)
+    return jsonify({"turns": turns, "totals": totals})
 
 @app.route('/api/new')
 def new_conversation():
@@ -335,5 +502,48 @@ def toggle_search():
     enable_web_search = data.get('enable_web_search', True)
     return jsonify({"enable_web_search": enable_web_search})
 
+# 导出时收集的计数器
+telemetry.register("driver_pool", driver_pool.snapshot)
+telemetry.register("content_fetch", get_fetch_stats)
+for profile_name, profile in crawl_profiles.items():
+    telemetry.register(f"crawl_{profile_name}", profile.snapshot)
+telemetry.register("search_cache", search_cache.snapshot)
+telemetry.register("search_flight", search_flight.snapshot)
+telemetry.register("keyword_cache", keyword_cache.snapshot)
+telemetry.register("keyword_flight", keyword_flight.snapshot)
+telemetry.register("answer_cache", answer_cache.snapshot)
+telemetry.register("qa_index", qa_index.snapshot)
+telemetry.register("chat_jobs", job_manager.snapshot)
+telemetry.register("model_breaker", model_monitor.breaker.snapshot)
+
+@app.route('/api/metrics')
+def export_metrics():
+    """以 Prometheus 文本格式导出各阶段耗时直方图和缓存、浏览器池等计数器"""
+    return Response(telemetry.render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@app.before_request
+def start_model_monitor():
+    """
+    收到第一个请求时开始预热和探测模型（重复调用无效）
+
+    不依赖启动方式：flask run、gunicorn、waitress 等都会经过这里；
+    debug 模式下重载器的父进程不处理请求，不会在其中预热。
+    """
+    model_monitor.start()
+
+@app.route('/api/health')
+def health():
+    """存活检查，同时返回模型预热和断路器状态"""
+    return jsonify(model_monitor.snapshot())
+
+@app.route('/api/ready')
+def ready():
+    """就绪检查：模型预热完成前返回 503"""
+    snapshot = model_monitor.snapshot()
+    return jsonify(snapshot), (200 if snapshot["ready"] else 503)
+
 if __name__ == '__main__':
+    # 直接运行时不必等到第一个请求，在实际服务的进程中立即预热模型（重载器的父进程不处理请求，跳过）
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        model_monitor.start()
     app.run(debug=True) 
\ No newline at end of file
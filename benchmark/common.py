@@ -0,0 +1,420 @@
+"""
+基准测试脚本共用的工具：启动被测应用、发送请求、采样内存、读取 /api/metrics、统计分位数
+"""
+import os
+import re
+import sys
+import json
+import time
+import socket
+import platform
+import tempfile
+import threading
+import subprocess
+
+import requests
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# 输出格式的版本，字段有不兼容的变化时递增
+RESULT_VERSION = 1
+
+_bucket_pattern = re.compile(r'^deepseek_stage_duration_seconds_bucket\{stage="([^"]+)",le="([^"]+)"\} (\S+)$')
+_sum_pattern = re.compile(r'^deepseek_stage_duration_seconds_(sum|count)\{stage="([^"]+)"\} (\S+)$')
+
+
+def percentile(values, q):
+    """线性插值的分位数，q 取 0 ~ 100"""
+    if not values:
+        return None
+    values = sorted(values)
+    position = (len(values) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def summarize(seconds):
+    """把一组耗时（秒）汇总为毫秒的 p50 / p95 / p99 / 平均值 / 最大值"""
+    if not seconds:
+        return {"count": 0}
+    return {
+        "count": len(seconds),
+        "p50_ms": round(percentile(seconds, 50) * 1000, 1),
+        "p95_ms": round(percentile(seconds, 95) * 1000, 1),
+        "p99_ms": round(percentile(seconds, 99) * 1000, 1),
+        "mean_ms": round(sum(seconds) / len(seconds) * 1000, 1),
+        "max_ms": round(max(seconds) * 1000, 1),
+    }
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def stand_in_env(stand_in_url):
+    """把外部服务都指向本地替身服务的环境变量"""
+    return {
+        "SEARCH_BASE_URL": stand_in_url,
+        "DEEPSEEK_BASE_URL": stand_in_url,
+        "deepseek_api_key": "benchmark",
+        "OLLAMA_HOST": stand_in_url,
+        # 替身服务不需要代理
+        "NO_PROXY": "127.0.0.1,localhost",
+    }
+
+
+def parse_env(items):
+    """解析命令行中的 KEY=VALUE 列表"""
+    env = {}
+    for item in items or ():
+        key, _, value = item.partition("=")
+        env[key] = value
+    return env
+
+
+class AppProcess:
+    """
+    在子进程中启动被测的 Flask 应用
+
+    历史记录、搜索缓存和回答缓存都放在临时目录中，不影响仓库中的数据；
+    默认关闭搜索缓存和历史问答复用，每个请求都完整执行一遍流程。
+    """
+
+    def __init__(self, env=None, port=None, warm_caches=False, log_path=None):
+        self.port = port or free_port()
+        self.workdir = tempfile.mkdtemp(prefix="deepseek-bench-")
+        self.log_path = log_path or os.path.join(self.workdir, "app.log")
+        self.env = dict(os.environ)
+        self.env.update({
+            "HISTORY_DIR": os.path.join(self.workdir, "chat_history"),
+            "SEARCH_CACHE_PATH": os.path.join(self.workdir, "search_cache.db"),
+            "ANSWER_CACHE_PATH": os.path.join(self.workdir, "answer_cache.db"),
+            "PYTHONUNBUFFERED": "1",
+        })
+        if not warm_caches:
+            self.env.update({"SEARCH_CACHE_TTL": "0", "QA_INDEX_ENABLED": "0", "ANSWER_CACHE_ENABLED": "0"})
+        self.env.update(env or {})
+        self.process = None
+        self._log = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.port}"
+
+    def start(self, timeout=60):
+        """启动应用，等待模型预热完成（/api/ready 返回 200）"""
+        code = ("import app; app.model_monitor.start(); "
+                f"app.app.run(host='127.0.0.1', port={self.port}, threaded=True, use_reloader=False)")
+        self._log = open(self.log_path, "w", encoding="utf-8")
+        self.process = subprocess.Popen([sys.executable, "-c", code], cwd=REPO_DIR, env=self.env,
+                                        stdout=self._log, stderr=subprocess.STDOUT)
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"应用启动失败，日志见 {self.log_path}")
+            try:
+                if requests.get(f"{self.url}/api/ready", timeout=1).status_code == 200:
+                    return self
+            except requests.RequestException:
+                pass
+            time.sleep(0.2)
+        self.stop()
+        raise RuntimeError(f"应用在 {timeout} 秒内未就绪，日志见 {self.log_path}")
+
+    def stop(self):
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        if self._log:
+            self._log.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class RssSampler:
+    """
+    定期采样进程树的常驻内存（VmRSS），分别记录峰值
+
+    应用进程启动的 Chrome 和 chromedriver 是子进程，内存不计入应用进程的 VmRSS，
+    因此同时采样所有子孙进程：peak_kb 为整棵进程树合计的峰值，peak_app_kb 和
+    peak_children_kb 分别为应用进程自身和子孙进程合计的峰值（三个峰值可能出现在不同时刻）。
+    只支持 Linux（读取 /proc），其他平台上峰值为 None。
+    """
+
+    def __init__(self, pid, interval=0.05):
+        self.pid = pid
+        self.interval = interval
+        self.peak_kb = None
+        self.peak_app_kb = None
+        self.peak_children_kb = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def _rss_kb(pid):
+        try:
+            with open(f"/proc/{pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        return int(line.split()[1])
+        except OSError:
+            return None
+        return None
+
+    @staticmethod
+    def _children(pid):
+        """读取进程所有线程的直接子进程；内核不支持 children 文件时扫描 /proc 中的父进程号"""
+        children = []
+        try:
+            for tid in os.listdir(f"/proc/{pid}/task"):
+                with open(f"/proc/{pid}/task/{tid}/children") as f:
+                    children.extend(int(child) for child in f.read().split())
+            return children
+        except FileNotFoundError:
+            pass
+        except OSError:
+            return children
+        for entry in os.listdir("/proc"):
+            if not entry.isdigit():
+                continue
+            try:
+                with open(f"/proc/{entry}/stat") as f:
+                    # 进程名可能包含空格和括号，从最后一个右括号之后解析
+                    fields = f.read().rsplit(")", 1)[1].split()
+            except (OSError, IndexError):
+                continue
+            if int(fields[1]) == pid:
+                children.append(int(entry))
+        return children
+
+    def _descendants(self):
+        found, pending = [], [self.pid]
+        while pending:
+            for child in self._children(pending.pop()):
+                if child not in found:
+                    found.append(child)
+                    pending.append(child)
+        return found
+
+    def _sample(self):
+        app_kb = self._rss_kb(self.pid)
+        if app_kb is None:
+            return
+        children_kb = sum(self._rss_kb(child) or 0 for child in self._descendants())
+        self.peak_app_kb = max(self.peak_app_kb or 0, app_kb)
+        self.peak_children_kb = max(self.peak_children_kb or 0, children_kb)
+        self.peak_kb = max(self.peak_kb or 0, app_kb + children_kb)
+
+    def _run(self):
+        while True:
+            self._sample()
+            if self._stop.wait(self.interval):
+                break
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    @staticmethod
+    def _mb(kb):
+        return round(kb / 1024, 1) if kb is not None else None
+
+    @property
+    def peak_mb(self):
+        return self._mb(self.peak_kb)
+
+    def peaks(self):
+        """输出到结果中的内存峰值（MB）"""
+        return {
+            "peak_rss_mb": self.peak_mb,
+            "peak_app_rss_mb": self._mb(self.peak_app_kb),
+            "peak_children_rss_mb": self._mb(self.peak_children_kb),
+        }
+
+
+def expected_calls(enable_web_search):
+    """
+    请求流程中一定会访问的替身接口
+
+    搜索缓存在冷启动时关闭，联网搜索的请求都会加载搜索结果页；关键词接口有独立的缓存，
+    重复的问题可能不再访问，不作要求。
+    """
+    return ["chat"] + (["serp"] if enable_web_search else [])
+
+
+def missing_calls(before, after, expected):
+    """返回两次 StandInServer.snapshot() 之间没有收到任何请求的接口"""
+    return [name for name in expected if after.get(name, 0) - before.get(name, 0) <= 0]
+
+
+def scrape_stages(base_url):
+    """
+    读取 /api/metrics 中各阶段的耗时直方图
+
+    Returns:
+        dict: {阶段: {"buckets": [(上界, 累计次数), ...], "sum": 秒, "count": 次数}}
+    """
+    text = requests.get(f"{base_url}/api/metrics", timeout=10).text
+    stages = {}
+    for line in text.splitlines():
+        match = _bucket_pattern.match(line)
+        if match:
+            stage, bound, value = match.groups()
+            stage_data = stages.setdefault(stage, {"buckets": [], "sum": 0.0, "count": 0})
+            stage_data["buckets"].append((float(bound), float(value)))
+            continue
+        match = _sum_pattern.match(line)
+        if match:
+            field, stage, value = match.groups()
+            stage_data = stages.setdefault(stage, {"buckets": [], "sum": 0.0, "count": 0})
+            stage_data[field] = float(value)
+    return stages
+
+
+def _bucket_quantile(buckets, q):
+    """按直方图估算分位数，返回所在分桶的上界（秒）"""
+    total = buckets[-1][1] if buckets else 0
+    if not total:
+        return None
+    for bound, cumulative in buckets:
+        if cumulative >= total * q:
+            return bound
+    return buckets[-1][0]
+
+
+def stage_delta(before, after):
+    """
+    计算两次 scrape_stages() 之间各阶段的次数、平均耗时和分位数估计
+
+    分位数来自直方图，只能精确到分桶上界（+Inf 表示超过最大分桶）。
+    """
+    result = {}
+    for stage, data in sorted(after.items()):
+        previous = before.get(stage, {"buckets": [], "sum": 0.0, "count": 0})
+        count = data["count"] - previous["count"]
+        if count <= 0:
+            continue
+        earlier = dict(previous["buckets"])
+        buckets = [(bound, value - earlier.get(bound, 0)) for bound, value in data["buckets"]]
+        p50, p95 = _bucket_quantile(buckets, 0.5), _bucket_quantile(buckets, 0.95)
+        result[stage] = {
+            "count": int(count),
+            "mean_ms": round((data["sum"] - previous["sum"]) / count * 1000, 1),
+            "p50_le_ms": _bound_ms(p50),
+            "p95_le_ms": _bound_ms(p95),
+        }
+    return result
+
+
+def _bound_ms(bound):
+    if bound is None:
+        return None
+    return "+Inf" if bound == float("inf") else round(bound * 1000, 1)
+
+
+def read_ndjson(response, on_event=None):
+    """
+    逐行读取 NDJSON 响应
+
+    Returns:
+        tuple: (事件列表, 第一行到达的时间 perf_counter)
+    """
+    events = []
+    first = None
+    for line in response.iter_lines():
+        if not line:
+            continue
+        if first is None:
+            first = time.perf_counter()
+        event = json.loads(line)
+        events.append(event)
+        if on_event:
+            on_event(event)
+    return events, first
+
+
+def send(session, base_url, message, stream, enable_web_search, timeout):
+    """
+    发送一个请求并计时
+
+    Returns:
+        dict: latency / first_event / first_token（秒）、response_chars（回答长度）和 error（成功时为 None）
+    """
+    payload = {"message": message, "stream": stream, "enable_web_search": enable_web_search, "no_cache": True}
+    started = time.perf_counter()
+    first_token = None
+    response_chars = 0
+    try:
+        response = session.post(f"{base_url}/api/send", json=payload, stream=stream, timeout=timeout)
+        if not stream:
+            first_event = time.perf_counter()
+            data = response.json()
+            error = data.get("error") if response.status_code == 200 else f"HTTP {response.status_code}: {data.get('error')}"
+            response_chars = len(data.get("response") or "")
+        elif response.status_code != 200:
+            first_event = time.perf_counter()
+            error = f"HTTP {response.status_code}: {response.text[:200]}"
+        else:
+            def on_event(event):
+                nonlocal first_token
+                if first_token is None and event.get("type") == "token":
+                    first_token = time.perf_counter()
+
+            events, first_event = read_ndjson(response, on_event)
+            last = events[-1] if events else {}
+            if last.get("type") == "final_response":
+                error = None
+                response_chars = len(last.get("response") or "")
+            else:
+                error = last.get("error") or "响应在 final_response 之前结束"
+    except requests.RequestException as e:
+        first_event = None
+        error = f"{type(e).__name__}: {e}"
+    finished = time.perf_counter()
+
+    return {
+        "latency": finished - started,
+        "first_event": first_event - started if first_event else None,
+        "first_token": first_token - started if first_token else None,
+        "response_chars": response_chars,
+        "error": error,
+    }
+
+
+def environment():
+    """记录运行环境，便于比较不同机器、不同版本的结果"""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR,
+                                capture_output=True, text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "commit": commit,
+    }
+
+
+def write_result(result, path=None):
+    """以固定的键顺序输出 JSON，便于用 diff 比较两次运行"""
+    text = json.dumps(result, ensure_ascii=False, indent=2, sort_keys=True) + "\n"
+    if path:
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        sys.stdout.write(text)
@@ -0,0 +1,355 @@
+"""
+按聊天历史回放真实流量
+
+读取聊天历史（旧版 <id>.json 和 JSONL 分段均可），按原始的到达间隔重建请求序列，
+发送到正在运行的应用（--target）或本地替身服务上启动的应用，记录每一轮的延迟和错误。
+
+到达时间的推算：
+    历史记录的时间戳是回答保存的时间，有生成统计（metrics）时减去当时的总耗时；
+    会话的第一轮没有生成统计时，使用会话ID中的创建时间（chat_YYYYMMDD_HHMMSS）。
+同一会话的各轮按顺序发送：上一轮没有结束时，下一轮要等它结束后再发送（lag 记录推迟的时间），
+并共用一个 HTTP 会话，服务端因此会把之前的轮次作为历史消息回放给模型。
+
+使用本地替身服务时，录制过的问题返回当时的回答，正文页面返回当时的搜索结果，
+提示词和输出长度与真实流量一致。
+
+结果 JSON 输出到标准输出（或 --output），进度和摘要输出到标准错误。使用本地替身服务时，
+回放期间替身服务的模型接口（有联网搜索的轮次时还有搜索结果页）没有收到任何请求，
+记录在 missing_stand_in_calls 中，输出结果后以状态码 1 退出。
+
+内存峰值（peak_rss_mb）是整个回放期间应用进程及其子进程（Chrome、chromedriver）合计的峰值，
+peak_app_rss_mb 和 peak_children_rss_mb 分别为两者各自的峰值，不区分阶段；使用 --target 时不采样。
+
+示例：
+    python benchmark/replay.py --speed 10 --max-gap 30 --output replay.json
+    python benchmark/replay.py --target http://127.0.0.1:5000 --history-dir chat_history
+"""
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import threading
+from datetime import datetime
+
+import requests
+
+import stand_ins
+from common import (REPO_DIR, AppProcess, RssSampler, RESULT_VERSION, summarize, stand_in_env, parse_env,
+                    scrape_stages, stage_delta, send, environment, write_result, expected_calls, missing_calls)
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+CONVERSATION_TIME_FORMAT = "chat_%Y%m%d_%H%M%S"
+# 与 history_store 的文件布局一致：<id>.json（旧版）、<id>.segments/NNNNNN.jsonl（已封存分段，
+# 更早的版本直接放在历史目录中：<id>.NNNNNN.jsonl）、<id>.jsonl（当前文件）
+SEGMENT_DIR_SUFFIX = ".segments"
+_history_file_pattern = re.compile(r"^(?P<id>.+?)(?:\.(?P<seq>\d{6}))?\.jsonl$")
+_segment_file_pattern = re.compile(r"^(?P<seq>\d{6})\.jsonl$")
+
+
+def _parse_time(text, fmt):
+    try:
+        return datetime.strptime(text, fmt).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+def _payload_text(search_results):
+    """把录制的搜索结果（整理后的文本或结果列表）转换为文本"""
+    if not search_results:
+        return ""
+    if isinstance(search_results, str):
+        return search_results
+    return json.dumps(search_results, ensure_ascii=False)
+
+
+def _read_history_file(path):
+    """读取一个记录文件；JSONL 中损坏的行以 None 占位，保证下标与服务端的轮次一致"""
+    if path.endswith(".json"):
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    entries = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entries.append(json.loads(line))
+            except json.JSONDecodeError:
+                entries.append(None)
+    return entries
+
+
+def read_history(history_dir):
+    """
+    只读地读取聊天历史目录
+
+    不使用 history_store：导入它会创建全局的 HistoryStore（建立目录、启动刷盘线程），
+    HistoryStore 初始化时还会移动旧版分段文件，回放不应修改录制的数据。
+
+    Returns:
+        dict: {会话ID: [(排序键, 文件路径), ...]}，按排序键读取即为记录的先后顺序
+    """
+    sources = {}
+    for filename in os.listdir(history_dir):
+        path = os.path.join(history_dir, filename)
+        if filename.endswith(".json"):
+            sources.setdefault(filename[:-len(".json")], []).append(((0, 0), path))
+        elif filename.endswith(SEGMENT_DIR_SUFFIX) and os.path.isdir(path):
+            conversation_id = filename[:-len(SEGMENT_DIR_SUFFIX)]
+            for segment in os.listdir(path):
+                match = _segment_file_pattern.match(segment)
+                if match:
+                    sources.setdefault(conversation_id, []).append(
+                        ((1, int(match.group("seq"))), os.path.join(path, segment)))
+        else:
+            match = _history_file_pattern.match(filename)
+            if match:
+                key = (1, int(match.group("seq"))) if match.group("seq") else (2, 0)
+                sources.setdefault(match.group("id"), []).append((key, path))
+    return {conversation_id: sorted(files) for conversation_id, files in sources.items()}
+
+
+def load_turns(history_dir, conversations=None, limit=None):
+    """
+    读取聊天历史，按推算的到达时间排序
+
+    Returns:
+        list: [{"conversation_id", "turn", "arrival", "question", "answer", "search", "web_search"}, ...]
+              arrival 为 Unix 时间戳
+    """
+    turns = []
+    for conversation_id, files in sorted(read_history(history_dir).items()):
+        if conversations and conversation_id not in conversations:
+            continue
+        entries = []
+        try:
+            for _, path in files:
+                entries.extend(_read_history_file(path))
+        except (OSError, ValueError) as e:
+            print(f"读取会话 {conversation_id} 失败，跳过: {e}", file=sys.stderr)
+            continue
+
+        started = _parse_time(conversation_id, CONVERSATION_TIME_FORMAT)
+        previous = None
+        for index, entry in enumerate(entries):
+            # 损坏的记录行读出为 None，保留下标以便与服务端的轮次对应
+            if not entry:
+                continue
+            question = entry.get("user") or ""
+            saved = _parse_time(entry.get("timestamp"), TIME_FORMAT)
+            if not question.strip() or saved is None:
+                continue
+            metrics = entry.get("metrics") or {}
+            if metrics.get("total_duration"):
+                arrival = saved - metrics["total_duration"] / 1e9
+            elif index == 0 and started is not None and started <= saved:
+                arrival = started
+            else:
+                arrival = saved
+            # 时间戳只精确到秒，保证同一会话内的顺序
+            if previous is not None:
+                arrival = max(arrival, previous)
+            previous = arrival
+
+            search = _payload_text(entry.get("search_results"))
+            turns.append({
+                "conversation_id": conversation_id,
+                "turn": index,
+                "arrival": arrival,
+                "question": question,
+                "answer": entry.get("bot") or "",
+                "search": search,
+                "web_search": bool(search),
+            })
+
+    turns.sort(key=lambda t: (t["arrival"], t["conversation_id"], t["turn"]))
+    return turns[:limit] if limit else turns
+
+
+def schedule(turns, speed=1.0, max_gap=None):
+    """
+    计算每一轮相对回放开始的发送时间（秒）
+
+    原始间隔除以 speed；max_gap 不为空时，把超过该值的空闲间隔压缩为 max_gap 秒。
+    """
+    offset = 0.0
+    previous = None
+    for turn in turns:
+        if previous is not None:
+            gap = (turn["arrival"] - previous) / speed
+            if max_gap is not None:
+                gap = min(gap, max_gap)
+            offset += gap
+        previous = turn["arrival"]
+        turn["offset"] = offset
+    return turns
+
+
+def replay(base_url, turns, stream, timeout):
+    """
+    按计划的时间发送请求，每个会话一个线程，会话内按顺序发送
+
+    Returns:
+        tuple: (每一轮的记录列表, 回放总耗时)
+    """
+    by_conversation = {}
+    for turn in turns:
+        by_conversation.setdefault(turn["conversation_id"], []).append(turn)
+
+    records = []
+    records_lock = threading.Lock()
+    started = time.perf_counter()
+
+    def run_conversation(conversation_turns):
+        session = requests.Session()
+        # 每个录制的会话在服务端对应一个新会话
+        try:
+            session.get(f"{base_url}/api/new", timeout=timeout)
+        except requests.RequestException as e:
+            print(f"创建会话失败: {e}", file=sys.stderr)
+        for turn in conversation_turns:
+            delay = turn["offset"] - (time.perf_counter() - started)
+            if delay > 0:
+                time.sleep(delay)
+            sent = time.perf_counter() - started
+            sample = send(session, base_url, turn["question"], stream, turn["web_search"], timeout)
+            record = {
+                "conversation_id": turn["conversation_id"],
+                "turn": turn["turn"],
+                "scheduled_s": round(turn["offset"], 3),
+                "lag_s": round(sent - turn["offset"], 3),
+                "latency_ms": round(sample["latency"] * 1000, 1),
+                "first_event_ms": round(sample["first_event"] * 1000, 1) if sample["first_event"] else None,
+                "first_token_ms": round(sample["first_token"] * 1000, 1) if sample["first_token"] else None,
+                "web_search": turn["web_search"],
+                "question_chars": len(turn["question"]),
+                "recorded_search_chars": len(turn["search"]),
+                "recorded_answer_chars": len(turn["answer"]),
+                "response_chars": sample["response_chars"],
+                "error": sample["error"],
+            }
+            with records_lock:
+                records.append(record)
+            status = "失败: " + record["error"] if record["error"] else "完成"
+            print(f"[{sent:8.1f}s] {turn['conversation_id']} 第 {turn['turn']} 轮 {record['latency_ms']:.0f}ms {status}",
+                  file=sys.stderr)
+
+    threads = [threading.Thread(target=run_conversation, args=(conversation_turns,), daemon=True)
+               for conversation_turns in by_conversation.values()]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    records.sort(key=lambda r: (r["scheduled_s"], r["conversation_id"], r["turn"]))
+    return records, time.perf_counter() - started
+
+
+def summarize_records(records, duration):
+    ok = [r for r in records if r["error"] is None]
+    errors = {}
+    for r in records:
+        if r["error"] is not None:
+            errors[r["error"]] = errors.get(r["error"], 0) + 1
+    return {
+        "turns": len(records),
+        "ok": len(ok),
+        "errors": len(records) - len(ok),
+        "error_counts": errors,
+        "duration_s": round(duration, 3),
+        "throughput_rps": round(len(ok) / duration, 3) if duration else None,
+        "latency": summarize([r["latency_ms"] / 1000 for r in ok]),
+        "first_event": summarize([r["first_event_ms"] / 1000 for r in ok if r["first_event_ms"] is not None]),
+        "first_token": summarize([r["first_token_ms"] / 1000 for r in ok if r["first_token_ms"] is not None]),
+        "lag": summarize([max(0.0, r["lag_s"]) for r in records]),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="按聊天历史回放真实流量")
+    parser.add_argument("--history-dir", default=os.path.join(REPO_DIR, "chat_history"), help="聊天历史目录")
+    parser.add_argument("--conversation", action="append", help="只回放指定的会话，可重复")
+    parser.add_argument("--limit", type=int, help="最多回放的轮数")
+    parser.add_argument("--speed", type=float, default=1.0, help="回放速度倍数，2 表示间隔缩短为一半")
+    parser.add_argument("--max-gap", type=float, help="两轮之间的最长等待（秒），压缩长时间的空闲")
+    parser.add_argument("--mode", choices=("stream", "json"), default="stream", help="流式或非流式请求")
+    parser.add_argument("--timeout", type=float, default=300, help="单个请求的超时时间（秒）")
+    parser.add_argument("--target", help="正在运行的应用地址；为空时在本地替身服务上启动应用")
+    parser.add_argument("--env", action="append", metavar="KEY=VALUE", help="传给应用的额外环境变量，可重复")
+    parser.add_argument("--output", help="结果 JSON 的输出路径，默认输出到标准输出")
+    stand_ins.add_arguments(parser)
+    args = parser.parse_args()
+    if args.speed <= 0:
+        parser.error("--speed 必须大于 0")
+    if not os.path.isdir(args.history_dir):
+        parser.error(f"聊天历史目录不存在: {args.history_dir}")
+
+    turns = schedule(load_turns(args.history_dir, args.conversation, args.limit), args.speed, args.max_gap)
+    if not turns:
+        parser.error(f"{args.history_dir} 中没有可回放的记录")
+    print(f"共 {len(turns)} 轮，计划回放时长 {turns[-1]['offset']:.1f} 秒", file=sys.stderr)
+    stream = args.mode == "stream"
+
+    config = None
+    server = None
+    missing = []
+    peaks = {"peak_rss_mb": None, "peak_app_rss_mb": None, "peak_children_rss_mb": None}
+    if args.target:
+        before = scrape_stages(args.target)
+        records, duration = replay(args.target, turns, stream, args.timeout)
+        stages = stage_delta(before, scrape_stages(args.target))
+    else:
+        config = stand_ins.config_from_args(args)
+        server = stand_ins.StandInServer(config, recordings=turns).start()
+        env = dict(stand_in_env(server.url), **parse_env(args.env))
+        try:
+            with AppProcess(env) as app:
+                print(f"应用已就绪: {app.url}（日志: {app.log_path}）", file=sys.stderr)
+                before = scrape_stages(app.url)
+                calls_before = server.snapshot()
+                with RssSampler(app.process.pid) as sampler:
+                    records, duration = replay(app.url, turns, stream, args.timeout)
+                stages = stage_delta(before, scrape_stages(app.url))
+                peaks = sampler.peaks()
+                expected = expected_calls(any(turn["web_search"] for turn in turns))
+                missing = missing_calls(calls_before, server.snapshot(), expected)
+        finally:
+            server.stop()
+
+    summary = summarize_records(records, duration)
+    summary.update(peaks)
+    summary["missing_stand_in_calls"] = missing
+    latency = summary["latency"]
+    print(f"完成 {summary['ok']}/{summary['turns']} 轮，失败 {summary['errors']} 轮，"
+          f"p50 {latency.get('p50_ms', '-')}ms，p95 {latency.get('p95_ms', '-')}ms，p99 {latency.get('p99_ms', '-')}ms", file=sys.stderr)
+
+    write_result({
+        "version": RESULT_VERSION,
+        "benchmark": "replay",
+        "config": {
+            "history_dir": os.path.abspath(args.history_dir),
+            "conversations": sorted({t["conversation_id"] for t in turns}),
+            "speed": args.speed,
+            "max_gap": args.max_gap,
+            "mode": args.mode,
+            "target": args.target,
+            "env": parse_env(args.env),
+            "stand_ins": config.to_dict() if config else None,
+        },
+        "environment": environment(),
+        "stand_in_requests": server.snapshot() if server else None,
+        "summary": summary,
+        "stages": stages,
+        "turns": records,
+    }, args.output)
+
+    if missing:
+        print(f"替身服务没有收到以下请求: {', '.join(missing)}，对应的阶段没有执行", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
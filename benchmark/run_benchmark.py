@@ -0,0 +1,176 @@
+"""
+离线端到端基准测试
+
+启动本地替身服务（百度搜索结果页、正文页面、关键词接口、ollama）和被测应用，
+按设定的并发数向 /api/send 发送请求（流式和非流式），统计：
+    latency      请求从发出到响应结束的耗时 p50 / p95 / p99
+    first_event  收到第一行事件的耗时（非流式时即收到响应的耗时）
+    first_token  收到第一个模型 token 的耗时（仅流式）
+    throughput   每秒完成的请求数
+    peak_rss_mb  应用进程及其子进程（Chrome、chromedriver）在整个场景期间合计的内存峰值，
+                 peak_app_rss_mb 和 peak_children_rss_mb 分别为应用进程和子进程的峰值
+                 （按场景统计，不区分阶段：并发请求的各阶段交错执行，无法把内存归到某个阶段）
+    stages       应用内各阶段（关键词、搜索、正文提取、模型等）的次数和耗时，来自 /api/metrics
+
+结果以键顺序固定的 JSON 输出，可直接 diff 比较两次运行；进度和摘要表格输出到标准错误，
+不会混入标准输出中的 JSON。
+
+搜索结果页由无头 Chrome 加载，运行机器上需要安装 Chrome 和 chromedriver（CHROMEDRIVER_PATH）；
+没有浏览器时也可以加 --no-web-search 只测量模型部分。场景期间替身服务的搜索结果页或模型接口
+没有收到任何请求时（例如缺少浏览器，搜索阶段全部失败），记录在场景的 missing_stand_in_calls 中，
+输出结果后以状态码 1 退出。使用 --warm-caches 时缓存可能跳过这些接口，不做检查。
+
+示例：
+    python benchmark/run_benchmark.py --concurrency 1,4,8 --requests 32 --output bench.json
+"""
+import sys
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+import stand_ins
+from common import (AppProcess, RssSampler, RESULT_VERSION, summarize, stand_in_env, parse_env,
+                    scrape_stages, stage_delta, send, environment, write_result, expected_calls, missing_calls)
+
+QUESTIONS = [
+    "如何使用python爬取网页数据？",
+    "Flask 的流式响应是怎么实现的？",
+    "什么是 BM25 检索算法？",
+    "ollama 如何让模型常驻内存？",
+    "SQLite 适合做缓存吗？",
+    "无头浏览器为什么占用这么多内存？",
+    "如何估算大模型的 token 数量？",
+    "线程池和进程池应该怎么选？",
+]
+# 保留的错误样例数量
+ERROR_SAMPLES = 5
+
+
+def run_scenario(app, server, mode, concurrency, total, enable_web_search, timeout, expected=()):
+    """
+    以固定并发数发送 total 个请求，每个并发各自使用一个会话
+
+    内存峰值在整个场景期间采样应用进程树，是场景级别的数值，stages 中只有次数和耗时。
+    expected 中的替身接口在场景期间没有收到请求时，记录在 missing_stand_in_calls 中。
+    """
+    stream = mode == "stream"
+    local = threading.local()
+
+    def worker(i):
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        return send(local.session, app.url, QUESTIONS[i % len(QUESTIONS)], stream, enable_web_search, timeout)
+
+    before = scrape_stages(app.url)
+    calls_before = server.snapshot()
+    with RssSampler(app.process.pid) as sampler:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            samples = list(executor.map(worker, range(total)))
+        duration = time.perf_counter() - started
+    after = scrape_stages(app.url)
+    calls_after = server.snapshot()
+
+    ok = [s for s in samples if s["error"] is None]
+    errors = [s["error"] for s in samples if s["error"] is not None]
+    result = {
+        "name": f"{mode}-c{concurrency}",
+        "mode": mode,
+        "concurrency": concurrency,
+        "requests": total,
+        "ok": len(ok),
+        "errors": len(errors),
+        "error_samples": sorted(set(errors))[:ERROR_SAMPLES],
+        "duration_s": round(duration, 3),
+        "throughput_rps": round(len(ok) / duration, 3) if duration else None,
+        "latency": summarize([s["latency"] for s in ok]),
+        "first_event": summarize([s["first_event"] for s in ok if s["first_event"] is not None]),
+        "first_token": summarize([s["first_token"] for s in ok if s["first_token"] is not None]),
+        "stages": stage_delta(before, after),
+        "missing_stand_in_calls": missing_calls(calls_before, calls_after, expected),
+    }
+    result.update(sampler.peaks())
+    return result
+
+
+def print_summary(scenarios):
+    """把各场景的摘要表格输出到标准错误，标准输出只留给结果 JSON"""
+    print(f"{'场景':<14}{'成功':>6}{'失败':>6}{'吞吐(rps)':>11}{'p50(ms)':>10}{'p95(ms)':>10}{'p99(ms)':>10}"
+          f"{'首事件p50':>11}{'内存(MB)':>10}", file=sys.stderr)
+    for s in scenarios:
+        latency, first = s["latency"], s["first_event"]
+        print(f"{s['name']:<14}{s['ok']:>6}{s['errors']:>6}{s['throughput_rps'] or 0:>11.2f}"
+              f"{latency.get('p50_ms', '-'):>10}{latency.get('p95_ms', '-'):>10}{latency.get('p99_ms', '-'):>10}"
+              f"{first.get('p50_ms', '-'):>11}{s['peak_rss_mb'] or '-':>10}", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="离线端到端基准测试")
+    parser.add_argument("--concurrency", default="1,4,8", help="逗号分隔的并发数")
+    parser.add_argument("--requests", type=int, default=16, help="每个场景的请求数")
+    parser.add_argument("--modes", default="stream,json", help="逗号分隔：stream（流式）、json（非流式）")
+    parser.add_argument("--warmup", type=int, default=1, help="正式测量前预热的请求数")
+    parser.add_argument("--timeout", type=float, default=300, help="单个请求的超时时间（秒）")
+    parser.add_argument("--no-web-search", action="store_true", help="关闭联网搜索，只测量模型部分")
+    parser.add_argument("--warm-caches", action="store_true", help="保留搜索缓存和历史问答复用（默认关闭）")
+    parser.add_argument("--env", action="append", metavar="KEY=VALUE", help="传给应用的额外环境变量，可重复")
+    parser.add_argument("--output", help="结果 JSON 的输出路径，默认输出到标准输出")
+    stand_ins.add_arguments(parser)
+    args = parser.parse_args()
+
+    concurrency_levels = [int(c) for c in args.concurrency.split(",") if c]
+    modes = [m for m in args.modes.split(",") if m]
+    enable_web_search = not args.no_web_search
+
+    config = stand_ins.config_from_args(args)
+    server = stand_ins.StandInServer(config).start()
+    extra_env = parse_env(args.env)
+    env = dict(stand_in_env(server.url), **extra_env)
+    expected = [] if args.warm_caches else expected_calls(enable_web_search)
+
+    scenarios = []
+    try:
+        with AppProcess(env, warm_caches=args.warm_caches) as app:
+            print(f"应用已就绪: {app.url}（日志: {app.log_path}）", file=sys.stderr)
+            for i in range(args.warmup):
+                send(requests.Session(), app.url, QUESTIONS[i % len(QUESTIONS)], True, enable_web_search, args.timeout)
+            for mode in modes:
+                for concurrency in concurrency_levels:
+                    print(f"运行场景 {mode}-c{concurrency}...", file=sys.stderr)
+                    scenarios.append(run_scenario(app, server, mode, concurrency, args.requests, enable_web_search,
+                                                  args.timeout, expected))
+    finally:
+        server.stop()
+
+    print_summary(scenarios)
+    write_result({
+        "version": RESULT_VERSION,
+        "benchmark": "end_to_end",
+        "config": {
+            "concurrency": concurrency_levels,
+            "modes": modes,
+            "requests": args.requests,
+            "warmup": args.warmup,
+            "enable_web_search": enable_web_search,
+            "warm_caches": args.warm_caches,
+            "env": extra_env,
+            "stand_ins": config.to_dict(),
+        },
+        "environment": environment(),
+        "stand_in_requests": server.snapshot(),
+        "scenarios": scenarios,
+    }, args.output)
+
+    incomplete = [s for s in scenarios if s["missing_stand_in_calls"]]
+    for s in incomplete:
+        print(f"场景 {s['name']} 中替身服务没有收到以下请求: {', '.join(s['missing_stand_in_calls'])}，"
+              "对应的阶段没有执行", file=sys.stderr)
+    if incomplete:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,336 @@
+"""
+基准测试用的本地替身服务
+
+在一个 HTTP 服务中模拟项目依赖的全部外部服务，延迟均可配置，便于重复测量：
+    /s?wd=关键词          百度搜索结果页（fixtures/serp.html，div.c-container 结构）
+    /article/<n>          搜索结果指向的正文页面（fixtures/article.html）
+    /chat/completions     DeepSeek 关键词提取接口（OpenAI 格式）
+    /api/chat             ollama 对话接口，按 token_latency 逐个 token 流式返回
+    /api/tags             ollama 已安装的模型列表，供存活探测使用
+
+单独运行：
+    python benchmark/stand_ins.py --port 8765 --token-latency 0.02
+"""
+import os
+import html
+import json
+import time
+import random
+import argparse
+import threading
+from string import Template
+from datetime import datetime, timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+# 模型回答的素材，按两个字符切分成 token
+THINK_TEXT = "用户的问题需要结合搜索结果回答。先概括要点，再给出具体步骤和注意事项。"
+ANSWER_TEXT = ("根据搜索结果，这个问题可以分为三个方面来理解：首先是基本概念和工作原理；"
+               "其次是具体的使用方法，包括准备数据、调用接口和检查结果；"
+               "最后是性能和可观测性方面的注意事项，例如复用连接、并发请求和记录各阶段耗时。")
+
+
+class StandInConfig:
+    """替身服务的延迟配置（秒）"""
+
+    def __init__(self, serp_latency=0.2, article_latency=0.1, article_jitter=0.05, keyword_latency=0.1,
+                 prompt_latency=0.05, token_latency=0.02, think_tokens=20, answer_tokens=80,
+                 model="deepseek-r1:7b", seed=0):
+        self.serp_latency = serp_latency
+        self.article_latency = article_latency
+        # 正文页面在 article_latency 基础上增加 0 ~ article_jitter 秒的随机延迟
+        self.article_jitter = article_jitter
+        self.keyword_latency = keyword_latency
+        # 模型处理提示词的耗时：每 1000 个字符 prompt_latency 秒
+        self.prompt_latency = prompt_latency
+        self.token_latency = token_latency
+        self.think_tokens = think_tokens
+        self.answer_tokens = answer_tokens
+        self.model = model
+        self.seed = seed
+
+    def to_dict(self):
+        return dict(self.__dict__)
+
+
+def keyword_for(question):
+    """替身关键词接口的提取规则：去掉标点后取前若干个字，同一问题总是得到相同的关键词"""
+    return "".join(c for c in question if c.isalnum() or c == " ").strip()[:12] or "搜索"
+
+
+def _load_fixture(name):
+    with open(os.path.join(FIXTURES_DIR, name), encoding="utf-8") as f:
+        return Template(f.read())
+
+
+def _tokens(text, count):
+    """把素材循环切分成 count 个两字符的 token"""
+    tokens = []
+    i = 0
+    while len(tokens) < count:
+        tokens.append(text[i % len(text):i % len(text) + 2])
+        i += 2
+    return tokens
+
+
+class StandInServer:
+    """
+    替身服务，在后台线程中运行
+
+    stats 记录各接口被调用的次数，可用于确认请求确实经过了替身服务。
+
+    recordings 为 [{"question", "answer", "search"}, ...] 时（来自聊天历史），
+    对这些问题返回当时的回答，正文页面返回当时的搜索结果，使提示词和输出长度与真实流量一致。
+    """
+
+    def __init__(self, config=None, host="127.0.0.1", port=0, recordings=None):
+        self.config = config or StandInConfig()
+        self.answers = {}
+        self.searches = {}
+        for recording in recordings or ():
+            if recording.get("answer"):
+                self.answers[recording["question"].strip()] = recording["answer"]
+            if recording.get("search"):
+                self.searches[keyword_for(recording["question"])] = recording["search"]
+        self.serp_template = _load_fixture("serp.html")
+        self.article_template = _load_fixture("article.html")
+        self.stats = {"serp": 0, "article": 0, "keywords": 0, "chat": 0, "chat_aborted": 0, "tags": 0}
+        self._random = random.Random(self.config.seed)
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="stand-ins", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def article_delay(self):
+        with self._lock:
+            jitter = self._random.uniform(0, self.config.article_jitter)
+        return self.config.article_latency + jitter
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.stats)
+
+    def reply_tokens(self, messages):
+        """返回本次回答的 token 序列：问题有录制的回答时切分录制的回答，否则使用素材"""
+        user_messages = [m.get("content") or "" for m in messages if m.get("role") == "user"]
+        # 提示词以用户原始问题开头，搜索结果和历史问答用制表符隔开附加在后面
+        question = user_messages[-1].split("\t", 1)[0].strip() if user_messages else ""
+        recorded = self.answers.get(question)
+        if recorded:
+            return _tokens(recorded, (len(recorded) + 1) // 2)
+        think = _tokens(THINK_TEXT, self.config.think_tokens)
+        answer = _tokens(ANSWER_TEXT, self.config.answer_tokens)
+        return ["<think>"] + think + ["</think>\n\n"] + answer
+
+    def recorded_article(self, query, number, title):
+        """
+        返回录制的搜索结果组成的正文页面，没有录制时返回 None
+
+        录制的搜索结果平均分给前三篇正文，总长度与当时放入提示词的内容相当。
+        """
+        recorded = self.searches.get(query)
+        if not recorded or number not in ("1", "2", "3"):
+            return None
+        size = (len(recorded) + 2) // 3
+        start = (int(number) - 1) * size
+        paragraphs = [line for line in recorded[start:start + size].splitlines() if line.strip()]
+        body = "\n".join(f"    <p>{html.escape(line)}</p>" for line in paragraphs)
+        return (f"<!DOCTYPE html>\n<html lang=\"zh-CN\">\n<head><meta charset=\"utf-8\">"
+                f"<title>{html.escape(title)}</title></head>\n<body>\n  <article>\n{body}\n  </article>\n</body>\n</html>\n")
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                parts = urlsplit(self.path)
+                if parts.path == "/s":
+                    query = parse_qs(parts.query).get("wd", [""])[0]
+                    server.count("serp")
+                    time.sleep(server.config.serp_latency)
+                    page = server.serp_template.safe_substitute(host=server.url, query=query)
+                    self._send(200, "text/html; charset=utf-8", page.encode("utf-8"))
+                elif parts.path.startswith("/article/"):
+                    query = parse_qs(parts.query).get("wd", [""])[0]
+                    server.count("article")
+                    time.sleep(server.article_delay())
+                    number = parts.path.rsplit('/', 1)[-1]
+                    title = f"{query} - 第 {number} 篇"
+                    page = server.recorded_article(query, number, title)
+                    if page is None:
+                        page = server.article_template.safe_substitute(title=title, query=query)
+                    self._send(200, "text/html; charset=utf-8", page.encode("utf-8"))
+                elif parts.path == "/api/tags":
+                    server.count("tags")
+                    self._send_json({"models": [{
+                        "name": server.config.model, "model": server.config.model,
+                        "modified_at": _now(), "size": 0, "digest": "stand-in", "details": {},
+                    }]})
+                else:
+                    self._send(404, "text/plain", b"not found")
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = json.loads(self.rfile.read(length) or b"{}")
+                path = urlsplit(self.path).path
+                if path.endswith("/chat/completions"):
+                    self._keywords(body)
+                elif path == "/api/chat":
+                    self._chat(body)
+                else:
+                    self._send(404, "text/plain", b"not found")
+
+            def _keywords(self, body):
+                server.count("keywords")
+                time.sleep(server.config.keyword_latency)
+                question = body["messages"][-1]["content"]
+                key_words = keyword_for(question)
+                self._send_json({
+                    "id": "stand-in", "object": "chat.completion", "created": int(time.time()),
+                    "model": body.get("model", "deepseek-chat"),
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": key_words}}],
+                    "usage": {"prompt_tokens": len(question), "completion_tokens": len(key_words),
+                              "total_tokens": len(question) + len(key_words)},
+                })
+
+            def _chat(self, body):
+                server.count("chat")
+                config = server.config
+                started = time.perf_counter()
+                prompt_chars = sum(len(m.get("content") or "") for m in body.get("messages", []))
+                num_predict = (body.get("options") or {}).get("num_predict")
+                time.sleep(config.prompt_latency * prompt_chars / 1000)
+                prompt_done = time.perf_counter()
+
+                tokens = server.reply_tokens(body.get("messages", []))
+                if num_predict:
+                    tokens = tokens[:num_predict]
+
+                def metrics():
+                    now = time.perf_counter()
+                    return {
+                        "total_duration": int((now - started) * 1e9),
+                        "load_duration": 0,
+                        "prompt_eval_count": prompt_chars,
+                        "prompt_eval_duration": int((prompt_done - started) * 1e9),
+                        "eval_count": len(tokens),
+                        "eval_duration": int((now - prompt_done) * 1e9),
+                    }
+
+                if not body.get("stream", True):
+                    time.sleep(config.token_latency * len(tokens))
+                    self._send_json(dict(self._chunk(body, "".join(tokens), True), **metrics()))
+                    return
+
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                try:
+                    for token in tokens:
+                        time.sleep(config.token_latency)
+                        self._write_chunk(self._chunk(body, token, False))
+                    self._write_chunk(dict(self._chunk(body, "", True), **metrics()))
+                    self.wfile.write(b"0\r\n\r\n")
+                except (BrokenPipeError, ConnectionResetError):
+                    # 客户端中途断开（例如对话被取消），停止生成
+                    server.count("chat_aborted")
+
+            def _chunk(self, body, content, done):
+                chunk = {
+                    "model": body.get("model", server.config.model),
+                    "created_at": _now(),
+                    "message": {"role": "assistant", "content": content},
+                    "done": done,
+                }
+                if done:
+                    chunk["done_reason"] = "stop"
+                return chunk
+
+            def _write_chunk(self, data):
+                line = json.dumps(data, ensure_ascii=False).encode("utf-8") + b"\n"
+                self.wfile.write(f"{len(line):x}\r\n".encode("ascii") + line + b"\r\n")
+                self.wfile.flush()
+
+            def _send_json(self, data):
+                self._send(200, "application/json", json.dumps(data, ensure_ascii=False).encode("utf-8"))
+
+            def _send(self, status, content_type, payload):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+        return Handler
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat()
+
+
+def add_arguments(parser):
+    """添加替身服务的延迟参数，供各个基准测试脚本共用"""
+    defaults = StandInConfig()
+    group = parser.add_argument_group("替身服务")
+    group.add_argument("--serp-latency", type=float, default=defaults.serp_latency, help="搜索结果页延迟（秒）")
+    group.add_argument("--article-latency", type=float, default=defaults.article_latency, help="正文页面延迟（秒）")
+    group.add_argument("--article-jitter", type=float, default=defaults.article_jitter, help="正文页面的随机附加延迟上限（秒）")
+    group.add_argument("--keyword-latency", type=float, default=defaults.keyword_latency, help="关键词接口延迟（秒）")
+    group.add_argument("--prompt-latency", type=float, default=defaults.prompt_latency, help="模型每处理 1000 个字符提示词的耗时（秒）")
+    group.add_argument("--token-latency", type=float, default=defaults.token_latency, help="模型每输出一个 token 的耗时（秒）")
+    group.add_argument("--think-tokens", type=int, default=defaults.think_tokens, help="思考过程的 token 数")
+    group.add_argument("--answer-tokens", type=int, default=defaults.answer_tokens, help="回答的 token 数")
+    group.add_argument("--seed", type=int, default=defaults.seed, help="随机延迟的种子")
+
+
+def config_from_args(args):
+    return StandInConfig(
+        serp_latency=args.serp_latency, article_latency=args.article_latency, article_jitter=args.article_jitter,
+        keyword_latency=args.keyword_latency, prompt_latency=args.prompt_latency, token_latency=args.token_latency,
+        think_tokens=args.think_tokens, answer_tokens=args.answer_tokens, seed=args.seed,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="运行基准测试用的本地替身服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    server = StandInServer(config_from_args(args), args.host, args.port)
+    print(f"替身服务已启动: {server.url}")
+    print(f"  SEARCH_BASE_URL={server.url}")
+    print(f"  DEEPSEEK_BASE_URL={server.url}")
+    print(f"  OLLAMA_HOST={server.url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
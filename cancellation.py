@@ -0,0 +1,127 @@
+import threading
+import contextvars
+
+# --- 配置 ---
+# 等待期间检查取消请求的间隔（秒）
+CANCEL_POLL_INTERVAL = 0.2
+
+# 当前请求的取消令牌；后台任务线程和提取正文的线程池通过 contextvars 传递
+_current_token = contextvars.ContextVar("cancel_token", default=None)
+
+
+class Cancelled(Exception):
+    """请求已被取消（客户端断开连接或主动取消），后续步骤不再执行"""
+
+
+class CancelToken:
+    """
+    一轮对话的取消令牌
+
+    取消是协作式的：各阶段在等待和循环中调用 check()，发现已取消时抛出 Cancelled，
+    由各自的 finally / with 块释放浏览器、关闭模型的流式连接。
+
+    带 parent 的令牌用于请求内部的子任务（如单个页面的正文提取）：
+    可以单独取消，父令牌被取消时也视为已取消。
+    """
+
+    def __init__(self, parent=None):
+        self._event = threading.Event()
+        self.reason = None
+        self.parent = parent
+
+    def cancel(self, reason="已取消"):
+        if not self._event.is_set():
+            self.reason = reason
+            self._event.set()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set() or (self.parent is not None and self.parent.cancelled)
+
+    def check(self):
+        """
+        Raises:
+            Cancelled: 令牌（或父令牌）已被取消
+        """
+        if self.parent is not None:
+            self.parent.check()
+        if self._event.is_set():
+            raise Cancelled(self.reason)
+
+
+def bind(token):
+    """
+    把令牌设为当前上下文的取消令牌
+
+    Returns:
+        结束时传给 unbind() 的标记
+    """
+    return _current_token.set(token)
+
+
+def unbind(marker):
+    _current_token.reset(marker)
+
+
+def current_token():
+    return _current_token.get()
+
+
+def check_cancelled():
+    """当前请求已取消时抛出 Cancelled；不在任何请求中时不做任何事"""
+    token = _current_token.get()
+    if token is not None:
+        token.check()
+
+
+def wait_event(event, timeout=None):
+    """
+    等待 threading.Event，期间当前请求被取消时立即抛出 Cancelled
+
+    Returns:
+        bool: 事件在 timeout 秒内被设置时返回 True
+    """
+    token = _current_token.get()
+    if token is None:
+        return event.wait(timeout)
+    remaining = timeout
+    while True:
+        token.check()
+        interval = CANCEL_POLL_INTERVAL if remaining is None else min(CANCEL_POLL_INTERVAL, remaining)
+        if event.wait(interval):
+            return True
+        if remaining is not None:
+            remaining -= interval
+            if remaining <= 0:
+                return False
+
+
+def call_cancellable(fn, *args):
+    """
+    在后台线程中执行阻塞调用（如远程接口请求），当前请求被取消时不再等待其结果
+
+    被放弃的调用在后台自行结束，结果丢弃。没有取消令牌时直接在当前线程执行。
+
+    Raises:
+        Cancelled: 等待期间请求被取消
+    """
+    if _current_token.get() is None:
+        return fn(*args)
+
+    done = threading.Event()
+    outcome = {}
+
+    def run():
+        try:
+            outcome["result"] = fn(*args)
+        except BaseException as e:
+            outcome["error"] = e
+        finally:
+            done.set()
+
+    context = contextvars.copy_context()
+    threading.Thread(target=context.run, args=(run,), daemon=True).start()
+    wait_event(done)
+    if "error" in outcome:
+        raise outcome["error"]
+    return outcome["result"]
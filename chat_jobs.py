@@ -0,0 +1,240 @@
+import os
+import json
+import time
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from cancellation import CancelToken, Cancelled, bind, unbind
+
+# --- 配置 ---
+# 同时处理的对话任务数量
+CHAT_WORKERS = int(os.getenv("CHAT_WORKERS", "2"))
+# 最多排队等待的任务数量，超过后拒绝新任务
+CHAT_MAX_QUEUE = int(os.getenv("CHAT_MAX_QUEUE", "16"))
+# 已结束任务保留多久（秒），期间客户端仍可重新连接获取事件
+JOB_RETENTION = float(os.getenv("CHAT_JOB_RETENTION", "600"))
+
+# 任务状态
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+ERROR = "error"
+CANCELLED = "cancelled"
+FINISHED_STATES = (DONE, ERROR, CANCELLED)
+
+
+class QueueFullError(Exception):
+    """任务队列已满"""
+
+
+class ChatJob:
+    """
+    一轮对话任务
+
+    任务产生的每一行 NDJSON 事件都会保存下来，客户端断线后可以从任意位置重新读取。
+    """
+
+    def __init__(self, conversation_id, message):
+        self.id = uuid.uuid4().hex
+        self.conversation_id = conversation_id
+        self.message = message
+        self.status = QUEUED
+        self.error = None
+        self.events = []
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        # 任务执行期间设为当前上下文的取消令牌，搜索、关键词提取和模型调用都会检查它
+        self.cancel_token = CancelToken()
+        self._cond = threading.Condition()
+
+    def push(self, line):
+        """追加一行事件并唤醒等待中的读取方"""
+        with self._cond:
+            self.events.append(line)
+            self._cond.notify_all()
+
+    def set_status(self, status, error=None):
+        with self._cond:
+            self.status = status
+            if error:
+                self.error = error
+            if status == RUNNING:
+                self.started = time.time()
+            elif status in FINISHED_STATES:
+                self.finished = time.time()
+            self._cond.notify_all()
+
+    def cancel(self, reason="已取消"):
+        """
+        请求取消；排队中的任务不会再执行，运行中的任务在当前阶段的下一次检查处停止
+
+        （关键词提取、等待浏览器、页面加载、正文提取和模型输出的每一块都会检查）
+        """
+        self.cancel_token.cancel(reason)
+        with self._cond:
+            if self.status == QUEUED:
+                self.status = CANCELLED
+                self.finished = time.time()
+            self._cond.notify_all()
+
+    def iter_events(self, since=0, timeout=15):
+        """
+        从第 since 行开始读取事件，直到任务结束
+
+        长时间没有新事件时产出空行作为心跳，避免连接被代理断开。
+        """
+        index = max(0, since)
+        while True:
+            timed_out = False
+            with self._cond:
+                if index >= len(self.events) and self.status not in FINISHED_STATES:
+                    timed_out = not self._cond.wait(timeout)
+                lines = self.events[index:]
+                finished = self.status in FINISHED_STATES
+            index += len(lines)
+            if lines:
+                yield from lines
+            elif timed_out:
+                yield "\n"
+            if finished and index >= len(self.events):
+                return
+
+    def to_dict(self):
+        with self._cond:
+            return {
+                "job_id": self.id,
+                "conversation_id": self.conversation_id,
+                "status": self.status,
+                "error": self.error,
+                "events": len(self.events),
+                "created": self.created,
+                "started": self.started,
+                "finished": self.finished,
+            }
+
+
+class JobManager:
+    """
+    有界的后台任务执行器，对话请求提交后立即返回任务ID
+    """
+
+    def __init__(self, workers=CHAT_WORKERS, max_queue=CHAT_MAX_QUEUE, retention=JOB_RETENTION):
+        self.workers = max(1, workers)
+        self.max_queue = max(0, max_queue)
+        self.retention = retention
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="chat-job")
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self.stats = {"submitted": 0, "rejected": 0, "done": 0, "error": 0, "cancelled": 0}
+
+    def submit(self, conversation_id, message, factory):
+        """
+        提交任务
+
+        Args:
+            conversation_id: 会话ID
+            message: 用户消息
+            factory: 无参函数，返回产出 NDJSON 行的生成器
+
+        Raises:
+            QueueFullError: 排队任务数已达上限
+        """
+        self._cleanup()
+        job = ChatJob(conversation_id, message)
+        with self._lock:
+            if self._count(QUEUED) + self._count(RUNNING) >= self.workers + self.max_queue:
+                self.stats["rejected"] += 1
+                raise QueueFullError("服务器繁忙，请稍后再试")
+            self._jobs[job.id] = job
+            self.stats["submitted"] += 1
+        self._executor.submit(self._run, job, factory)
+        return job
+
+    def _run(self, job, factory):
+        if job.cancel_token.cancelled:
+            self._finish(job, CANCELLED)
+            return
+
+        job.set_status(RUNNING)
+        marker = bind(job.cancel_token)
+        generator = factory()
+        status = DONE
+        error = None
+        try:
+            for line in generator:
+                if job.cancel_token.cancelled:
+                    status = CANCELLED
+                    break
+                job.push(line)
+                event = _parse_event(line)
+                if event.get("type") == "error":
+                    status = ERROR
+                    error = str(event.get("error") or "未知错误")
+        except Cancelled:
+            status = CANCELLED
+        except Exception as e:
+            print(f"对话任务出错: {e}")
+            job.push(json.dumps({"type": "error", "error": str(e)}) + "\n")
+            status = ERROR
+            error = str(e)
+        finally:
+            # 关闭生成器，让搜索和模型调用尽快释放资源
+            generator.close()
+            unbind(marker)
+        if job.cancel_token.cancelled:
+            status = CANCELLED
+            print(f"对话任务已取消: {job.id}（{job.cancel_token.reason}）")
+        self._finish(job, status, error if status == ERROR else None)
+
+    def _finish(self, job, status, error=None):
+        job.set_status(status, error)
+        with self._lock:
+            self.stats[status] += 1
+
+    def _count(self, status):
+        return sum(1 for job in self._jobs.values() if job.status == status)
+
+    def _cleanup(self):
+        """移除超过保留时间的已结束任务"""
+        now = time.time()
+        with self._lock:
+            expired = [job_id for job_id, job in self._jobs.items()
+                       if job.finished and now - job.finished > self.retention]
+            for job_id in expired:
+                del self._jobs[job_id]
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id, reason="已取消"):
+        job = self.get(job_id)
+        if job is None:
+            return None
+        job.cancel(reason)
+        return job
+
+    def snapshot(self):
+        """返回队列深度、工作线程数等运行状态"""
+        with self._lock:
+            data = dict(self.stats)
+            data["workers"] = self.workers
+            data["max_queue"] = self.max_queue
+            data["queued"] = self._count(QUEUED)
+            data["running"] = self._count(RUNNING)
+            data["retained"] = len(self._jobs)
+        return data
+
+
+def _parse_event(line):
+    """解析一行事件，不是 JSON 对象时返回空字典"""
+    try:
+        event = json.loads(line)
+    except ValueError:
+        return {}
+    return event if isinstance(event, dict) else {}
+
+
+job_manager = JobManager()
@@ -0,0 +1,316 @@
+import os
+import re
+import time
+import ollama
+
+from context_builder import estimate_tokens
+from model_health import CircuitBreaker, ModelMonitor
+from telemetry import telemetry, span, record
+from cancellation import Cancelled, check_cancelled
+
+# --- 配置 ---
+# 本地回答问题使用的模型
+MODEL_NAME = os.getenv("OLLAMA_MODEL", "deepseek-r1:7b")
+# ollama 服务地址，为空时使用 OLLAMA_HOST 环境变量或默认地址
+OLLAMA_HOST = os.getenv("OLLAMA_HOST") or None
+# 单次请求的超时时间（秒），首次加载模型可能较慢
+MODEL_REQUEST_TIMEOUT = float(os.getenv("MODEL_REQUEST_TIMEOUT", "300"))
+# 模型在两次请求之间保持加载的时间，避免每轮对话重新加载模型
+KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+# 模型上下文长度（token），为 0 时使用 ollama 的默认值
+NUM_CTX = int(os.getenv("OLLAMA_NUM_CTX", "0"))
+# 每次请求最多带上的历史轮数
+HISTORY_MAX_TURNS = int(os.getenv("CHAT_HISTORY_MAX_TURNS", "8"))
+# 历史消息最多占用的 token 数（估算值）
+HISTORY_TOKEN_BUDGET = int(os.getenv("CHAT_HISTORY_TOKEN_BUDGET", "2000"))
+
+# 长期复用的客户端，底层 HTTP 连接池在请求之间保持连接
+client = ollama.Client(host=OLLAMA_HOST, timeout=MODEL_REQUEST_TIMEOUT)
+# 后端连续失败时暂停调用，避免每个请求都等到超时
+model_breaker = CircuitBreaker("模型")
+
+THINK_OPEN = "<think>"
+THINK_CLOSE = "</think>"
+
+# 后端在每次生成结束时返回的计数和耗时字段（耗时单位为纳秒）
+METRIC_FIELDS = ("prompt_eval_count", "eval_count", "total_duration", "load_duration",
+                 "prompt_eval_duration", "eval_duration")
+
+
+class ThinkSplitter:
+    """
+    把流式输出的文本拆分为思考过程（think）和回答（answer）两部分
+
+    标签可能被拆在两个数据块之间，因此未确定的结尾部分会暂存到下一块再判断。
+    """
+
+    def __init__(self):
+        self.channel = "answer"
+        self._pending = ""
+        self._answer_started = False
+
+    def feed(self, text):
+        """
+        输入一段新文本
+
+        Returns:
+            list: [(channel, text), ...]，channel 为 think 或 answer
+        """
+        self._pending += text
+        parts = []
+        while self._pending:
+            tag = THINK_CLOSE if self.channel == "think" else THINK_OPEN
+            index = self._pending.find(tag)
+            if index >= 0:
+                self._emit(parts, self._pending[:index])
+                self._pending = self._pending[index + len(tag):]
+                self.channel = "answer" if self.channel == "think" else "think"
+                continue
+
+            # 结尾可能是标签的前半部分，先保留
+            keep = _partial_suffix(self._pending, tag)
+            self._emit(parts, self._pending[:len(self._pending) - keep])
+            self._pending = self._pending[len(self._pending) - keep:]
+            break
+        return parts
+
+    def flush(self):
+        """输出暂存的剩余文本"""
+        parts = []
+        self._emit(parts, self._pending)
+        self._pending = ""
+        return parts
+
+    def _emit(self, parts, text):
+        if not text:
+            return
+        # 回答开头的空白（通常是 </think> 后的换行）没有意义，不输出
+        if self.channel == "answer" and not self._answer_started:
+            text = text.lstrip()
+            if not text:
+                return
+            self._answer_started = True
+        parts.append((self.channel, text))
+
+
+def _partial_suffix(text, tag):
+    """返回 text 结尾与 tag 开头重合的最大长度"""
+    for size in range(min(len(text), len(tag) - 1), 0, -1):
+        if tag.startswith(text[-size:]):
+            return size
+    return 0
+
+
+def chat_options():
+    """返回调用模型时的公共参数：保持模型常驻，可选地固定上下文长度"""
+    kwargs = {"keep_alive": KEEP_ALIVE}
+    if NUM_CTX > 0:
+        # 上下文长度不变时 ollama 才能复用已加载的模型和提示词缓存
+        kwargs["options"] = {"num_ctx": NUM_CTX}
+    return kwargs
+
+
+class ChatResult:
+    """
+    一次模型调用的结果：思考过程、回答和生成统计
+
+    metrics 中保存后端返回的 token 数和各阶段耗时，以及由此计算的生成速度。
+    """
+
+    def __init__(self, think="", answer="", metrics=None):
+        self.think = think
+        self.answer = answer
+        self.metrics = metrics or {}
+
+    @property
+    def text(self):
+        """与历史记录中保存的格式一致的完整回答"""
+        return join_parts(self.think, self.answer)
+
+
+def extract_metrics(response):
+    """
+    从后端响应（或流式输出的最后一块）中读取生成统计
+
+    Returns:
+        dict: METRIC_FIELDS 中后端返回了的字段，以及 tokens_per_second
+    """
+    metrics = {}
+    for field in METRIC_FIELDS:
+        value = response.get(field)
+        if value is not None:
+            metrics[field] = value
+    if metrics.get("eval_count") and metrics.get("eval_duration"):
+        metrics["tokens_per_second"] = round(metrics["eval_count"] / metrics["eval_duration"] * 1e9, 2)
+    return metrics
+
+
+def observe_metrics(metrics):
+    """把后端报告的加载、提示词计算和生成耗时计入耗时直方图"""
+    for field, stage in (("load_duration", "model_load"), ("prompt_eval_duration", "model_prompt_eval"),
+                         ("eval_duration", "model_eval")):
+        if metrics.get(field):
+            telemetry.observe(stage, metrics[field] / 1e9)
+
+
+def parse_response(response):
+    """直接读取响应中的消息内容，一次扫描拆分思考过程和回答"""
+    splitter = ThinkSplitter()
+    think, answer = [], []
+    content = response["message"]["content"] or ""
+    for channel, text in splitter.feed(content) + splitter.flush():
+        (think if channel == "think" else answer).append(text)
+    return ChatResult("".join(think), "".join(answer), extract_metrics(response))
+
+
+def stream_chat(messages, model=MODEL_NAME, metrics=None):
+    """
+    以流式方式调用模型，边生成边产出文本片段
+
+    每收到一块输出都检查当前请求是否已取消；取消或提前关闭时断开与后端的流式连接，
+    后端随即停止生成。
+
+    Args:
+        messages: 发送给模型的消息列表
+        model: 模型名称
+        metrics: 可选的字典，生成结束后写入 extract_metrics() 的结果
+
+    Yields:
+        tuple: (channel, text)，channel 为 think 或 answer
+
+    Raises:
+        Cancelled: 生成过程中当前请求被取消
+    """
+    check_cancelled()
+    model_breaker.allow()
+    splitter = ThinkSplitter()
+    started = time.perf_counter()
+    first_token = True
+    stream = client.chat(model=model, messages=messages, stream=True, **chat_options())
+    try:
+        for chunk in stream:
+            check_cancelled()
+            text = chunk["message"]["content"]
+            if text:
+                if first_token:
+                    # 首个 token 的等待时间包含模型加载和提示词计算
+                    record("model_first_token", started, time.perf_counter() - started)
+                    first_token = False
+                yield from splitter.feed(text)
+            if chunk.get("done"):
+                chunk_metrics = extract_metrics(chunk)
+                observe_metrics(chunk_metrics)
+                if metrics is not None:
+                    metrics.update(chunk_metrics)
+    except (Cancelled, GeneratorExit):
+        # 取消或调用方提前关闭不是后端故障，不计入断路器，只结束半开状态下的试探
+        model_breaker.release()
+        raise
+    except Exception:
+        model_breaker.record_failure()
+        raise
+    finally:
+        # 关闭底层的 HTTP 响应；提前结束时后端检测到连接断开后停止生成
+        stream.close()
+    model_breaker.record_success()
+    record("model", started, time.perf_counter() - started)
+    yield from splitter.flush()
+
+
+def chat(messages, model=MODEL_NAME):
+    """
+    非流式调用模型，受断路器保护
+
+    Returns:
+        ChatResult: 思考过程、回答和生成统计
+
+    Raises:
+        CircuitOpenError: 后端连续失败，断路器已断开
+    """
+    check_cancelled()
+    model_breaker.allow()
+    try:
+        with span("model"):
+            response = client.chat(model=model, messages=messages, **chat_options())
+    except Exception:
+        model_breaker.record_failure()
+        raise
+    model_breaker.record_success()
+    result = parse_response(response)
+    observe_metrics(result.metrics)
+    return result
+
+
+def warm_up(model=MODEL_NAME):
+    """用一个很短的提示词让后端提前加载模型，只生成一个 token"""
+    kwargs = chat_options()
+    kwargs["options"] = dict(kwargs.get("options", {}), num_predict=1)
+    client.chat(model=model, messages=[{"role": "user", "content": "你好"}], **kwargs)
+
+
+# 启动时预热模型并定期探测后端，由入口程序调用 model_monitor.start()
+model_monitor = ModelMonitor(client, MODEL_NAME, model_breaker, warm_up)
+
+
+def join_parts(think, answer):
+    """把思考过程和回答拼回与非流式调用相同的格式，便于保存和展示"""
+    if think:
+        return f"{THINK_OPEN}{think}{THINK_CLOSE}\n\n{answer}"
+    return answer
+
+
+def strip_think(text):
+    """去掉回答中的思考过程，只保留最终回答"""
+    return re.sub(f"{THINK_OPEN}.*?{THINK_CLOSE}", "", text or "", flags=re.DOTALL).strip()
+
+
+def history_window(total, max_turns=HISTORY_MAX_TURNS):
+    """
+    计算本轮请求从第几轮历史开始回放
+
+    起点按 max_turns 的一半为步长前进，而不是每轮都丢掉最早的一轮，
+    这样连续多轮请求的消息开头保持不变，模型可以复用上一次请求的提示词缓存，
+    只需计算新增的部分。
+    """
+    if max_turns <= 0:
+        return total
+    if total <= max_turns:
+        return 0
+    step = max(1, max_turns // 2)
+    return -(-(total - max_turns) // step) * step
+
+
+def build_messages(history, prompt, token_budget=HISTORY_TOKEN_BUDGET, max_turns=HISTORY_MAX_TURNS):
+    """
+    把历史对话和本轮提示组合成发送给模型的消息列表
+
+    历史轮次只回放用户原始问题和去掉思考过程的回答，本轮的搜索结果只放在最后一条消息里，
+    因此前面的消息在后续轮次中保持一致。历史超过 token 预算时从最早的轮次开始丢弃，
+    与 history_window 一样每次丢弃 max_turns 的一半，消息开头在之后的几轮中保持不变。
+
+    Args:
+        history: 按时间顺序排列的历史记录 [{"user", "bot"}, ...]，由 history_window 截取
+        prompt: 本轮发送给模型的用户消息（可能已附加搜索结果）
+        token_budget: 历史消息最多占用的 token 数（估算值）
+        max_turns: 与 history_window 相同的最大轮数，决定丢弃的步长
+    """
+    # 不完整的记录也占一个位置，丢弃时按记录条数对齐 history_window 的步长
+    turns = []
+    for entry in history:
+        if entry.get("user") and entry.get("bot"):
+            turns.append((entry["user"], strip_think(entry["bot"])))
+        else:
+            turns.append(None)
+
+    costs = [estimate_tokens(turn[0]) + estimate_tokens(turn[1]) if turn else 0 for turn in turns]
+    step = max(1, max_turns // 2)
+    start = 0
+    while start < len(turns) and sum(costs[start:]) > token_budget:
+        start += step
+
+    messages = []
+    for user, bot in filter(None, turns[start:]):
+        messages.append({"role": "user", "content": user})
+        messages.append({"role": "assistant", "content": bot})
+    messages.append({"role": "user", "content": prompt})
+    return messages
@@ -0,0 +1,261 @@
+import os
+import re
+import math
+
+import numpy as np
+
+# --- 配置 ---
+# 搜索结果在提示词中最多占用的 token 数（估算值）
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+# 正文切分成段落时每段的最大字符数
+PASSAGE_CHARS = int(os.getenv("CONTEXT_PASSAGE_CHARS", "300"))
+# 有正文时，标题和摘要最多占用的预算比例，其余留给正文段落
+CONTEXT_HEADER_SHARE = float(os.getenv("CONTEXT_HEADER_SHARE", "0.4"))
+# 两个段落的相似度超过该值时视为重复，只保留得分高的一个
+DUPLICATE_THRESHOLD = float(os.getenv("CONTEXT_DUPLICATE_THRESHOLD", "0.8"))
+# BM25 参数
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+MEMORY_PROMPT = "以下是之前回答过的相似问题，可供参考："
+SEARCH_PROMPT = "以下是联网搜索的结果，请你结合联网搜索的结果和你自身的记忆回答用户的问题，如果记忆和联网搜索有出入，请以联网搜索的结果为准，搜索结果为："
+
+_cjk_pattern = re.compile(r"[\u4e00-\u9fff]")
+_word_pattern = re.compile(r"[\u4e00-\u9fff]+|[A-Za-z0-9]+")
+_sentence_pattern = re.compile(r"[^。！？!?；;\n]+[。！？!?；;]*")
+
+
+def tokenize(text):
+    """
+    切分检索用的词项：中文按相邻两字切分（单字词保留单字），英文和数字按单词切分并转为小写
+    """
+    tokens = []
+    for word in _word_pattern.findall(text or ""):
+        if _cjk_pattern.match(word):
+            if len(word) == 1:
+                tokens.append(word)
+            else:
+                tokens.extend(word[i:i + 2] for i in range(len(word) - 1))
+        else:
+            tokens.append(word.lower())
+    return tokens
+
+
+def estimate_tokens(text):
+    """粗略估算文本占用的 token 数：每个汉字约 1 个，其他字符约 4 个算 1 个"""
+    if not text:
+        return 0
+    cjk = len(_cjk_pattern.findall(text))
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+
+def split_passages(text, size=PASSAGE_CHARS):
+    """按句子边界把正文切分成不超过 size 个字符的段落"""
+    passages = []
+    current = ""
+    for sentence in _sentence_pattern.findall(text or ""):
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+        # 超长的句子直接按长度切开
+        while len(sentence) > size:
+            if current:
+                passages.append(current)
+                current = ""
+            passages.append(sentence[:size])
+            sentence = sentence[size:]
+        if current and len(current) + len(sentence) > size:
+            passages.append(current)
+            current = ""
+        current += sentence
+    if current:
+        passages.append(current)
+    return passages
+
+
+def bm25_scores(query_tokens, docs_tokens, k1=BM25_K1, b=BM25_B):
+    """
+    计算每个文档相对查询的 BM25 得分
+
+    只统计查询中出现的词项，词频矩阵为 文档数 x 查询词数。
+    """
+    terms = sorted(set(query_tokens))
+    if not terms or not docs_tokens:
+        return np.zeros(len(docs_tokens))
+
+    column = {term: j for j, term in enumerate(terms)}
+    tf = np.zeros((len(docs_tokens), len(terms)))
+    for i, tokens in enumerate(docs_tokens):
+        for token in tokens:
+            j = column.get(token)
+            if j is not None:
+                tf[i, j] += 1
+
+    lengths = np.array([len(tokens) for tokens in docs_tokens], dtype=float)
+    avg_length = lengths.mean() or 1.0
+    df = (tf > 0).sum(axis=0)
+    idf = np.log(1 + (len(docs_tokens) - df + 0.5) / (df + 0.5))
+    norm = k1 * (1 - b + b * lengths / avg_length)
+    return ((tf * (k1 + 1)) / (tf + norm[:, None]) * idf).sum(axis=1)
+
+
+def _shingles(text):
+    text = re.sub(r"\s+", "", text)
+    return {text[i:i + 3] for i in range(max(1, len(text) - 2))}
+
+
+def _is_duplicate(shingles, selected):
+    for other in selected:
+        union = len(shingles | other)
+        if union and len(shingles & other) / union >= DUPLICATE_THRESHOLD:
+            return True
+    return False
+
+
+def select_passages(question, results, budget=CONTEXT_TOKEN_BUDGET):
+    """
+    从搜索结果正文中挑选与问题最相关的段落
+
+    正文切分成段落后按 BM25 得分从高到低依次加入，跳过与已选段落重复的，
+    直到用完 token 预算。没有任何段落与问题相关时按原顺序选取。
+
+    Returns:
+        list: [{"result": 结果下标, "passage": 段落下标, "text", "score"}, ...] 按结果和段落原顺序排列
+    """
+    candidates = []
+    for i, item in enumerate(results):
+        for j, text in enumerate(split_passages(item.get("content") or "")):
+            candidates.append({"result": i, "passage": j, "text": text})
+    if not candidates:
+        return []
+
+    scores = bm25_scores(tokenize(question), [tokenize(c["text"]) for c in candidates])
+    for candidate, score in zip(candidates, scores):
+        candidate["score"] = float(score)
+    if scores.max() > 0:
+        ranked = [candidates[k] for k in np.argsort(-scores, kind="stable") if scores[k] > 0]
+    else:
+        ranked = candidates
+
+    selected, selected_shingles = [], []
+    remaining = budget
+    for candidate in ranked:
+        cost = estimate_tokens(candidate["text"])
+        if cost > remaining:
+            continue
+        shingles = _shingles(candidate["text"])
+        if _is_duplicate(shingles, selected_shingles):
+            continue
+        selected.append(candidate)
+        selected_shingles.append(shingles)
+        remaining -= cost
+    return sorted(selected, key=lambda c: (c["result"], c["passage"]))
+
+
+def truncate_to_tokens(text, budget):
+    """截取文本开头不超过 budget 个 token（估算值）的部分"""
+    if estimate_tokens(text) <= budget:
+        return text
+    lo, hi = 0, len(text)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if estimate_tokens(text[:mid]) <= budget:
+            lo = mid
+        else:
+            hi = mid - 1
+    return text[:lo]
+
+
+def _fit_headers(results, budget):
+    """
+    生成每条结果的标题和摘要，总量不超过 budget 个 token
+
+    先保证标题：放不下全部标题时只保留前面的结果；剩余预算平均分给各条摘要，
+    短摘要用不完的部分留给后面的长摘要，超出的摘要截断。
+
+    Returns:
+        list: 每条保留的结果一个字符串（含结尾的空行），按结果顺序排列
+    """
+    bases = []
+    used = 0
+    for i, item in enumerate(results):
+        base = f"\n结果 {i+1}:\n"
+        if item.get("title"):
+            base += f"标题: {item['title']}\n"
+        cost = estimate_tokens(base + "\n")
+        if used + cost > budget:
+            break
+        bases.append(base)
+        used += cost
+
+    snippets = {}
+    remaining = budget - used
+    # 按摘要长度从短到长分配，每条最多分到剩余预算的平均值
+    order = sorted((i for i in range(len(bases)) if results[i].get("snippet")),
+                   key=lambda i: len(results[i]["snippet"]))
+    for n, i in enumerate(order):
+        share = remaining // (len(order) - n)
+        line = truncate_to_tokens(f"摘要: {results[i]['snippet']}", share - 1)
+        if len(line) > len("摘要: "):
+            snippets[i] = line + "\n"
+            remaining -= estimate_tokens(snippets[i])
+    return [base + snippets.get(i, "") + "\n" for i, base in enumerate(bases)]
+
+
+def _format_context(headers, passages):
+    by_result = {}
+    for passage in passages:
+        by_result.setdefault(passage["result"], []).append(passage["text"])
+    formatted_results = ""
+    for i, header in enumerate(headers):
+        formatted_results += header[:-1]
+        if i in by_result:
+            formatted_results += "正文: " + " …… ".join(by_result[i]) + "\n"
+        formatted_results += "\n"
+    return formatted_results
+
+
+def build_context(question, results, budget=CONTEXT_TOKEN_BUDGET, selected=None):
+    """
+    把搜索结果整理成放入提示词的文本
+
+    每条结果保留标题和摘要，正文只放入 select_passages() 选中的段落。
+    有正文时标题和摘要最多占用 CONTEXT_HEADER_SHARE 的预算，摘要按需截断，
+    其余预算留给正文；整体严格不超过 budget 个 token（估算值）。
+
+    Args:
+        selected: 可选的列表，传入时追加选中的段落，用于报告各条结果在提示词中用了多少正文
+
+    Returns:
+        str: 整理后的搜索结果；没有结果时返回空字符串
+    """
+    if not results:
+        return ""
+    if not isinstance(results, list):
+        return str(results)
+
+    has_content = any(item.get("content") for item in results)
+    header_budget = int(budget * CONTEXT_HEADER_SHARE) if has_content else budget
+    headers = _fit_headers(results, header_budget)
+    # 放不下标题的结果不再使用其正文
+    kept = results[:len(headers)]
+    passages = select_passages(question, kept, max(0, budget - sum(estimate_tokens(h) for h in headers)))
+
+    formatted_results = _format_context(headers, passages)
+    # "正文: "、段落分隔符等格式文本也计入预算，超出时去掉得分最低的段落
+    while passages and estimate_tokens(formatted_results) > budget:
+        passages.remove(min(passages, key=lambda p: p["score"]))
+        formatted_results = _format_context(headers, passages)
+    if selected is not None:
+        selected.extend(passages)
+    return formatted_results
+
+
+def build_prompt(message, context, memory=""):
+    """把整理后的搜索结果和相似的历史问答附加到用户问题后面"""
+    prompt = message
+    if context:
+        prompt += "\t" + SEARCH_PROMPT + context
+    if memory:
+        prompt += "\t" + MEMORY_PROMPT + memory
+    return prompt
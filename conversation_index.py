@@ -0,0 +1,121 @@
+import os
+import sqlite3
+import threading
+
+from history_store import history_store
+
+# --- 配置 ---
+# 会话目录数据库路径
+CONVERSATION_INDEX_PATH = os.getenv("CONVERSATION_INDEX_PATH", os.path.join(history_store.directory, "index.db"))
+# 会话列表每页默认条数
+PAGE_SIZE = int(os.getenv("CONVERSATION_PAGE_SIZE", "50"))
+# 侧边栏标题的最大长度
+TITLE_LENGTH = 20
+
+# 允许的排序字段
+SORT_FIELDS = {"first": "first_ts", "last": "last_ts"}
+
+
+def make_title(message):
+    """用第一条用户消息生成会话标题"""
+    if not message:
+        return "空会话"
+    return message[:TITLE_LENGTH] + "..." if len(message) > TITLE_LENGTH else message
+
+
+class ConversationIndex:
+    """
+    会话元数据目录（ID、标题、首条/末条时间、轮数）
+
+    每次写入历史记录时增量更新，列出会话时无需读取任何会话文件。
+    数据库缺失时根据历史文件重建。
+    """
+
+    def __init__(self, path=CONVERSATION_INDEX_PATH, store=history_store):
+        self.path = path
+        self.store = store
+        self._lock = threading.Lock()
+        is_new = not os.path.exists(path)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS conversations (
+                id TEXT PRIMARY KEY,
+                title TEXT NOT NULL,
+                first_ts TEXT NOT NULL,
+                last_ts TEXT NOT NULL,
+                turns INTEGER NOT NULL
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_conversations_first ON conversations (first_ts)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_conversations_last ON conversations (last_ts)")
+        self._conn.commit()
+        if is_new:
+            self.rebuild()
+
+    def rebuild(self):
+        """扫描全部历史文件，重建目录"""
+        rows = []
+        for conversation_id in self.store.list_ids():
+            try:
+                entries = self.store.read(conversation_id)
+            except Exception as e:
+                print(f"读取会话 {conversation_id} 失败，跳过: {e}")
+                continue
+            if entries:
+                rows.append((conversation_id, make_title(entries[0].get("user", "")),
+                             entries[0].get("timestamp", ""), entries[-1].get("timestamp", ""), len(entries)))
+            else:
+                rows.append((conversation_id, make_title(""), "", "", 0))
+
+        with self._lock:
+            self._conn.execute("DELETE FROM conversations")
+            self._conn.executemany("INSERT INTO conversations VALUES (?, ?, ?, ?, ?)", rows)
+            self._conn.commit()
+        print(f"会话目录已重建，共 {len(rows)} 个会话")
+
+    def record(self, conversation_id, entry):
+        """写入一条历史记录后更新目录，可直接作为 HistoryStore 的监听回调"""
+        timestamp = entry.get("timestamp", "")
+        with self._lock:
+            self._conn.execute(
+                """INSERT INTO conversations (id, title, first_ts, last_ts, turns) VALUES (?, ?, ?, ?, 1)
+                   ON CONFLICT(id) DO UPDATE SET
+                       title = CASE WHEN turns = 0 THEN excluded.title ELSE title END,
+                       first_ts = CASE WHEN turns = 0 THEN excluded.first_ts ELSE first_ts END,
+                       last_ts = excluded.last_ts,
+                       turns = turns + 1""",
+                (conversation_id, make_title(entry.get("user", "")), timestamp, timestamp),
+            )
+            self._conn.commit()
+
+    def list(self, offset=0, limit=PAGE_SIZE, sort="first"):
+        """
+        分页列出会话，最新的在前面
+
+        Args:
+            offset: 跳过的条数
+            limit: 返回的最大条数
+            sort: first 按会话开始时间，last 按最近一条消息时间
+
+        Returns:
+            list: [{"id", "title", "timestamp", "last_timestamp", "turns"}, ...]
+        """
+        column = SORT_FIELDS.get(sort, "first_ts")
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT id, title, first_ts, last_ts, turns FROM conversations "
+                f"ORDER BY {column} DESC, id DESC LIMIT ? OFFSET ?",
+                (max(0, limit), max(0, offset)),
+            ).fetchall()
+        return [
+            {"id": row[0], "title": row[1], "timestamp": row[2], "last_timestamp": row[3], "turns": row[4]}
+            for row in rows
+        ]
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM conversations").fetchone()[0]
+
+
+conversation_index = ConversationIndex()
+history_store.add_listener(conversation_index.record)
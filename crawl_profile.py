@@ -0,0 +1,195 @@
+import os
+import json
+import threading
+
+# --- 配置 ---
+# 是否启用精简的抓取配置：屏蔽图片、字体等与正文无关的资源，限制单个页面的传输量
+CRAWL_LEAN_ENABLED = os.getenv("CRAWL_LEAN_ENABLED", "1") == "1"
+# 是否在浏览器层面关闭图片加载（对池中所有浏览器生效，创建浏览器时设置）
+CRAWL_DISABLE_IMAGES = os.getenv("CRAWL_DISABLE_IMAGES", "1" if CRAWL_LEAN_ENABLED else "0") == "1"
+# 默认屏蔽的资源类型，逗号分隔，取值见 RESOURCE_TYPE_PATTERNS
+CRAWL_BLOCK_TYPES = os.getenv("CRAWL_BLOCK_TYPES", "image,media,font")
+# 额外屏蔽的 URL 模式（逗号分隔，* 为通配符），默认屏蔽常见的统计和广告脚本
+CRAWL_BLOCK_PATTERNS = os.getenv(
+    "CRAWL_BLOCK_PATTERNS",
+    "*hm.baidu.com/*,*pos.baidu.com/*,*cpro.baidu.com/*,*google-analytics.com/*,"
+    "*googletagmanager.com/*,*doubleclick.net/*,*googlesyndication.com/*,*cnzz.com/*",
+)
+# 单个页面最多传输的字节数，超过后停止加载并使用已加载的内容；0 表示不限制
+CRAWL_MAX_PAGE_BYTES = int(os.getenv("CRAWL_MAX_PAGE_BYTES", str(3 * 1024 * 1024)))
+
+# 资源类型对应的 URL 模式（Network.setBlockedURLs 只支持按 URL 屏蔽）
+RESOURCE_TYPE_PATTERNS = {
+    "image": ("png", "jpg", "jpeg", "gif", "webp", "avif", "bmp", "ico", "svg"),
+    "media": ("mp4", "webm", "m3u8", "flv", "mp3", "m4a", "ogg", "wav"),
+    "font": ("woff", "woff2", "ttf", "otf", "eot"),
+    "stylesheet": ("css",),
+}
+# 被屏蔽的请求不知道实际大小，按资源类型的典型大小估算节省的字节数
+BLOCKED_BYTES_ESTIMATE = {
+    "Image": 30 * 1024,
+    "Media": 500 * 1024,
+    "Font": 40 * 1024,
+    "Stylesheet": 20 * 1024,
+    "Script": 25 * 1024,
+}
+DEFAULT_BLOCKED_BYTES = 10 * 1024
+
+
+def _split(text):
+    return [item.strip() for item in (text or "").split(",") if item.strip()]
+
+
+def type_patterns(block_types):
+    """把资源类型转换为 URL 模式，带查询参数的地址同样匹配"""
+    patterns = []
+    for block_type in block_types:
+        for ext in RESOURCE_TYPE_PATTERNS.get(block_type, ()):
+            patterns.extend((f"*.{ext}", f"*.{ext}?*"))
+    return patterns
+
+
+class CrawlProfile:
+    """
+    一个爬虫入口的页面加载配置及其统计
+
+    屏蔽规则通过 DevTools 协议（Network.setBlockedURLs）在每次打开页面前设置，
+    同一个池中的浏览器可以按入口使用不同的配置。传输字节数从 Chrome 的性能日志
+    （Network.* 事件）中统计，超过 max_bytes 时由 load_page() 停止加载。
+    """
+
+    def __init__(self, name, enabled=CRAWL_LEAN_ENABLED, block_types=(), block_patterns=(),
+                 max_bytes=CRAWL_MAX_PAGE_BYTES):
+        """
+        Args:
+            name: 入口名称，用于指标命名
+            enabled: 为 False 时不屏蔽任何请求、不限制传输量，只统计
+            block_types: 屏蔽的资源类型，见 RESOURCE_TYPE_PATTERNS
+            block_patterns: 额外屏蔽的 URL 模式
+            max_bytes: 单个页面最多传输的字节数，0 表示不限制
+        """
+        self.name = name
+        self.enabled = enabled
+        self.block_types = list(block_types)
+        self.blocked_urls = type_patterns(block_types) + list(block_patterns) if enabled else []
+        self.max_bytes = max_bytes if enabled else 0
+        self._lock = threading.Lock()
+        self.stats = {
+            "pages": 0,
+            "capped_pages": 0,
+            "bytes_transferred": 0,
+            "blocked_requests": 0,
+            "bytes_saved_estimate": 0,
+            "load_seconds": 0.0,
+        }
+
+    @classmethod
+    def from_env(cls, name, block_types=CRAWL_BLOCK_TYPES):
+        """
+        读取入口专用的环境变量，未设置时使用全局配置
+
+        例如入口 search 读取 CRAWL_SEARCH_LEAN、CRAWL_SEARCH_BLOCK_TYPES、
+        CRAWL_SEARCH_BLOCK_PATTERNS 和 CRAWL_SEARCH_MAX_PAGE_BYTES。
+        """
+        prefix = f"CRAWL_{name.upper()}_"
+        enabled = os.getenv(prefix + "LEAN", "1" if CRAWL_LEAN_ENABLED else "0") == "1"
+        return cls(
+            name,
+            enabled=enabled,
+            block_types=_split(os.getenv(prefix + "BLOCK_TYPES", block_types)),
+            block_patterns=_split(os.getenv(prefix + "BLOCK_PATTERNS", CRAWL_BLOCK_PATTERNS)),
+            max_bytes=int(os.getenv(prefix + "MAX_PAGE_BYTES", str(CRAWL_MAX_PAGE_BYTES))),
+        )
+
+    def apply(self, driver):
+        """在打开页面前设置当前标签页的屏蔽规则；不支持 DevTools 协议的浏览器忽略"""
+        try:
+            driver.execute_cdp_cmd("Network.enable", {})
+            driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": self.blocked_urls})
+        except Exception as e:
+            print(f"设置请求屏蔽规则失败: {e}")
+
+    def observe(self, transfer, seconds, capped=False):
+        """记录一次页面加载的传输量、屏蔽数和耗时"""
+        with self._lock:
+            self.stats["pages"] += 1
+            self.stats["capped_pages"] += int(capped)
+            self.stats["bytes_transferred"] += transfer.bytes
+            self.stats["blocked_requests"] += transfer.blocked
+            self.stats["bytes_saved_estimate"] += transfer.saved_estimate
+            self.stats["load_seconds"] += seconds
+
+    def snapshot(self):
+        with self._lock:
+            stats = dict(self.stats)
+        pages = stats["pages"]
+        stats["enabled"] = self.enabled
+        stats["max_page_bytes"] = self.max_bytes
+        stats["avg_page_bytes"] = stats["bytes_transferred"] / pages if pages else 0.0
+        stats["avg_load_seconds"] = stats["load_seconds"] / pages if pages else 0.0
+        return stats
+
+
+class TransferCounter:
+    """
+    从 Chrome 性能日志中累计一次页面加载的传输字节数和被屏蔽的请求
+
+    需要创建浏览器时开启性能日志（enable_transfer_logging()）。读取日志会清空
+    浏览器端的缓冲，打开页面前先调用 reset() 丢弃上一个页面留下的事件。
+    """
+
+    def __init__(self, driver):
+        self.driver = driver
+        self._received = {}  # requestId -> 已接收的字节数
+        self.blocked = 0
+        self.saved_estimate = 0
+
+    def _read(self):
+        try:
+            return self.driver.get_log("performance")
+        except Exception:
+            return []
+
+    def reset(self):
+        self._read()
+
+    def poll(self):
+        """读取新的网络事件，返回目前为止传输的字节数"""
+        for entry in self._read():
+            try:
+                message = json.loads(entry["message"])["message"]
+            except (KeyError, TypeError, ValueError):
+                continue
+            method, params = message.get("method"), message.get("params") or {}
+            request_id = params.get("requestId")
+            if method == "Network.dataReceived":
+                self._received[request_id] = self._received.get(request_id, 0) + params.get("encodedDataLength", 0)
+            elif method == "Network.loadingFinished":
+                # 结束事件中的长度是整个响应（含响应头）的传输量，以它为准
+                self._received[request_id] = params.get("encodedDataLength", 0)
+            elif method == "Network.loadingFailed" and params.get("blockedReason"):
+                self.blocked += 1
+                self.saved_estimate += BLOCKED_BYTES_ESTIMATE.get(params.get("type"), DEFAULT_BLOCKED_BYTES)
+        return self.bytes
+
+    @property
+    def bytes(self):
+        return int(sum(self._received.values()))
+
+
+def enable_transfer_logging(options):
+    """在 ChromeOptions 上开启性能日志和关闭图片加载（按 CRAWL_DISABLE_IMAGES）"""
+    options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
+    options.add_experimental_option("perfLoggingPrefs", {"enableNetwork": True, "enablePage": False})
+    if CRAWL_DISABLE_IMAGES:
+        options.add_argument("--blink-settings=imagesEnabled=false")
+        options.add_experimental_option("prefs", {"profile.managed_default_content_settings.images": 2})
+
+
+# 各爬虫入口的配置：搜索结果页只解析 HTML，样式表也可以屏蔽；
+# 浏览器提取正文时依赖 .text 的可见性判断，保留样式表
+crawl_profiles = {
+    "search": CrawlProfile.from_env("search", CRAWL_BLOCK_TYPES + ",stylesheet"),
+    "titles": CrawlProfile.from_env("titles", CRAWL_BLOCK_TYPES + ",stylesheet"),
+    "extract": CrawlProfile.from_env("extract"),
+}
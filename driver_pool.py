@@ -0,0 +1,239 @@
+import os
+import time
+import queue
+import threading
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+from selenium.common.exceptions import WebDriverException
+
+from telemetry import span
+from cancellation import CANCEL_POLL_INTERVAL, check_cancelled
+
+# --- 配置 ---
+# 池中最多同时存在的浏览器实例数量
+POOL_SIZE = int(os.getenv("CRAWLER_POOL_SIZE", "3"))
+# 单个浏览器访问多少个页面后回收重建，避免内存持续增长
+MAX_PAGES_PER_DRIVER = int(os.getenv("CRAWLER_MAX_PAGES_PER_DRIVER", "50"))
+# 借用浏览器时最长等待时间（秒）
+ACQUIRE_TIMEOUT = float(os.getenv("CRAWLER_ACQUIRE_TIMEOUT", "30"))
+# 归还浏览器时清理的站点数据类型（Storage.clearDataForOrigin）
+CLEAR_STORAGE_TYPES = "local_storage,indexeddb,websql,cache_storage,service_workers,file_systems"
+
+
+def _add_origin(origins, url):
+    """记录 URL 所在的站点（scheme://host[:port]），about:blank 等没有站点的地址忽略"""
+    parts = urlsplit(url or "")
+    if parts.scheme in ("http", "https") and parts.netloc:
+        origins.add(f"{parts.scheme}://{parts.netloc}")
+
+
+class PooledDriver:
+    """
+    对 webdriver 的简单包装，记录已访问页面数量
+    """
+
+    def __init__(self, driver):
+        self.driver = driver
+        self.pages = 0
+        # 本次借用期间访问过的站点，归还时清理它们的存储
+        self.origins = set()
+
+    def get(self, url):
+        """访问页面并计数"""
+        self.pages += 1
+        _add_origin(self.origins, url)
+        return self.driver.get(url)
+
+    def __getattr__(self, name):
+        return getattr(self.driver, name)
+
+
+class DriverPool:
+    """
+    有界、线程安全的浏览器实例池
+
+    浏览器按需创建，最多 size 个；用完归还后保持常驻，
+    下次借用时无需再次冷启动 Chrome。
+    """
+
+    def __init__(self, factory, size=POOL_SIZE, max_pages=MAX_PAGES_PER_DRIVER):
+        """
+        Args:
+            factory: 无参函数，返回一个新的 webdriver 实例
+            size: 池的最大容量
+            max_pages: 单个实例访问页面数上限，超过后回收
+        """
+        self.factory = factory
+        self.size = max(1, size)
+        self.max_pages = max_pages
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._closed = False
+        self.stats = {"created": 0, "reused": 0, "recycled": 0, "broken": 0}
+
+    def _new_driver(self):
+        driver = PooledDriver(self.factory())
+        with self._lock:
+            self.stats["created"] += 1
+        return driver
+
+    def _is_healthy(self, pooled):
+        """通过一次轻量调用检查浏览器进程是否仍然可用"""
+        try:
+            pooled.driver.current_url
+            return True
+        except Exception:
+            return False
+
+    def _reset(self, pooled):
+        """
+        清理上一次使用留下的状态：多余标签页、当前页面、所有站点的 cookies 和访问过的站点的存储
+
+        delete_all_cookies() 只删除当前页面所在站点的 cookies，这里通过 DevTools 协议清空整个浏览器的。
+        """
+        driver = pooled.driver
+        _add_origin(pooled.origins, driver.current_url)
+        handles = driver.window_handles
+        for handle in handles[1:]:
+            driver.switch_to.window(handle)
+            driver.close()
+        driver.switch_to.window(handles[0])
+        driver.get("about:blank")
+        driver.execute_cdp_cmd("Network.clearBrowserCookies", {})
+        for origin in pooled.origins:
+            driver.execute_cdp_cmd("Storage.clearDataForOrigin",
+                                   {"origin": origin, "storageTypes": CLEAR_STORAGE_TYPES})
+        pooled.origins.clear()
+
+    def _discard(self, pooled):
+        """关闭浏览器并释放占用的名额"""
+        try:
+            pooled.driver.quit()
+        except Exception:
+            pass
+        with self._lock:
+            self._created -= 1
+
+    def acquire(self, timeout=ACQUIRE_TIMEOUT):
+        """
+        借出一个浏览器实例
+
+        优先复用空闲实例；未达到容量上限时新建；否则等待归还。
+        等待期间当前请求被取消时抛出 Cancelled。
+        """
+        if self._closed:
+            raise RuntimeError("浏览器池已关闭")
+
+        deadline = time.monotonic() + timeout
+        while True:
+            check_cancelled()
+            try:
+                pooled = self._idle.get_nowait()
+            except queue.Empty:
+                pooled = None
+
+            if pooled is None:
+                with self._lock:
+                    can_create = self._created < self.size
+                    if can_create:
+                        self._created += 1
+                if can_create:
+                    try:
+                        return self._new_driver()
+                    except Exception:
+                        with self._lock:
+                            self._created -= 1
+                        raise
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError("等待可用浏览器超时")
+                # 分段等待，期间可以响应取消，也能在有实例被丢弃后及时新建
+                try:
+                    pooled = self._idle.get(timeout=min(CANCEL_POLL_INTERVAL, remaining))
+                except queue.Empty:
+                    continue
+
+            if self._is_healthy(pooled):
+                with self._lock:
+                    self.stats["reused"] += 1
+                return pooled
+
+            # 浏览器已崩溃，丢弃后重新获取
+            with self._lock:
+                self.stats["broken"] += 1
+            self._discard(pooled)
+
+    def release(self, pooled, broken=False):
+        """
+        归还浏览器实例
+
+        Args:
+            pooled: acquire() 返回的实例
+            broken: 使用过程中浏览器出现致命错误时为 True，实例将被丢弃
+        """
+        if broken or self._closed:
+            if broken:
+                with self._lock:
+                    self.stats["broken"] += 1
+            self._discard(pooled)
+            return
+
+        if pooled.pages >= self.max_pages:
+            with self._lock:
+                self.stats["recycled"] += 1
+            self._discard(pooled)
+            return
+
+        try:
+            self._reset(pooled)
+        except Exception as e:
+            print(f"重置浏览器状态失败，丢弃该实例: {e}")
+            with self._lock:
+                self.stats["broken"] += 1
+            self._discard(pooled)
+            return
+
+        self._idle.put(pooled)
+
+    @contextmanager
+    def lease(self, timeout=ACQUIRE_TIMEOUT):
+        """
+        以上下文管理器的方式借用浏览器，退出时自动归还
+
+        用法:
+            with pool.lease() as driver:
+                driver.get(url)
+        """
+        # 等待空闲浏览器的时间单独统计，便于判断池容量是否不足
+        with span("driver_acquire"):
+            pooled = self.acquire(timeout=timeout)
+        broken = False
+        try:
+            yield pooled
+        except WebDriverException:
+            # 浏览器层面的异常，实例状态不可信，直接回收
+            broken = not self._is_healthy(pooled)
+            raise
+        finally:
+            self.release(pooled, broken=broken)
+
+    def snapshot(self):
+        """返回当前池状态，便于观察"""
+        with self._lock:
+            data = dict(self.stats)
+            data["size"] = self.size
+            data["alive"] = self._created
+        data["idle"] = self._idle.qsize()
+        return data
+
+    def close(self):
+        """关闭池中所有空闲浏览器"""
+        self._closed = True
+        while True:
+            try:
+                pooled = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(pooled)
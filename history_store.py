@@ -0,0 +1,333 @@
+import os
+import re
+import json
+import time
+import atexit
+import threading
+from collections import OrderedDict
+
+try:
+    import fcntl
+except ImportError:  # Windows 下没有 fcntl，只做进程内加锁
+    fcntl = None
+
+# --- 配置 ---
+# 聊天历史目录
+HISTORY_DIR = os.getenv("HISTORY_DIR", "chat_history")
+# 两次 fsync 之间的最长间隔（秒），期间的写入合并为一次 fsync
+FSYNC_INTERVAL = float(os.getenv("HISTORY_FSYNC_INTERVAL", "1.0"))
+# 单个记录文件的大小上限（字节），超过后封存为只读分段并新建文件
+SEGMENT_MAX_BYTES = int(os.getenv("HISTORY_SEGMENT_MAX_BYTES", str(4 * 1024 * 1024)))
+# 同时保持打开的文件数量
+MAX_OPEN_FILES = 64
+# 会话锁的数量：会话按ID哈希共用固定数量的锁，锁表不随会话数增长
+LOCK_STRIPES = 64
+# 已封存分段所在子目录的后缀：<id>.segments/NNNNNN.jsonl
+SEGMENT_DIR_SUFFIX = ".segments"
+
+_segment_pattern = re.compile(r"^(?P<id>.+?)(?:\.(?P<seq>\d{6}))?\.jsonl$")
+_segment_file_pattern = re.compile(r"^(?P<seq>\d{6})\.jsonl$")
+
+
+class HistoryStore:
+    """
+    追加写入的聊天历史存储
+
+    每个会话对应一个 JSONL 文件，每轮对话追加一行，写入代价与会话长度无关。
+    文件超过 SEGMENT_MAX_BYTES 后通过原子重命名封存为 <id>.segments/NNNNNN.jsonl，
+    每个会话的分段在自己的子目录中，查找分段不需要扫描整个历史目录。
+    读取时依次合并旧版 <id>.json、已封存分段和当前文件。
+    """
+
+    def __init__(self, directory=HISTORY_DIR, fsync_interval=FSYNC_INTERVAL, segment_max_bytes=SEGMENT_MAX_BYTES):
+        self.directory = directory
+        self.fsync_interval = fsync_interval
+        self.segment_max_bytes = segment_max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+        self._locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+        self._handles = OrderedDict()  # 会话ID -> 打开的文件
+        self._handles_guard = threading.Lock()
+        self._dirty = set()
+        self._last_sync = {}
+        self._closed = False
+        self._listeners = []
+
+        self._migrate_segments()
+
+        self._flusher = threading.Thread(target=self._flush_loop, daemon=True)
+        self._flusher.start()
+
+    # --- 路径 ---
+    def _active_path(self, conversation_id):
+        return os.path.join(self.directory, f"{conversation_id}.jsonl")
+
+    def _legacy_path(self, conversation_id):
+        return os.path.join(self.directory, f"{conversation_id}.json")
+
+    def _segment_dir(self, conversation_id):
+        return os.path.join(self.directory, conversation_id + SEGMENT_DIR_SUFFIX)
+
+    def _segment_paths(self, conversation_id):
+        """按顺序返回已封存的分段文件（只列出该会话的分段子目录）"""
+        directory = self._segment_dir(conversation_id)
+        try:
+            filenames = os.listdir(directory)
+        except FileNotFoundError:
+            return []
+        segments = []
+        for filename in filenames:
+            match = _segment_file_pattern.match(filename)
+            if match:
+                segments.append((int(match.group("seq")), os.path.join(directory, filename)))
+        return [path for _, path in sorted(segments)]
+
+    def _migrate_segments(self):
+        """把旧版直接放在历史目录中的分段 <id>.NNNNNN.jsonl 移入各会话的分段子目录"""
+        for filename in os.listdir(self.directory):
+            match = _segment_pattern.match(filename)
+            if not match or not match.group("seq"):
+                continue
+            directory = self._segment_dir(match.group("id"))
+            os.makedirs(directory, exist_ok=True)
+            os.replace(os.path.join(self.directory, filename),
+                       os.path.join(directory, f"{match.group('seq')}.jsonl"))
+
+    def _lock_for(self, conversation_id):
+        """会话锁：按会话ID哈希选取固定数量的锁之一，不同会话可能共用同一把锁"""
+        return self._locks[hash(conversation_id) % len(self._locks)]
+
+    def add_listener(self, callback):
+        """
+        注册写入回调，每追加一条记录后调用 callback(conversation_id, entry)
+
+        用于增量维护会话目录等派生数据；回调出错不影响写入。
+        """
+        self._listeners.append(callback)
+
+    # --- 写入 ---
+    def _handle_for(self, conversation_id):
+        with self._handles_guard:
+            handle = self._handles.get(conversation_id)
+            if handle is not None:
+                self._handles.move_to_end(conversation_id)
+                return handle
+            path = self._active_path(conversation_id)
+            handle = open(path, "a", encoding="utf-8")
+            # 上次写入中断时文件末尾可能缺少换行，补上后新记录不会与残缺行粘连
+            if handle.tell() > 0:
+                with open(path, "rb") as f:
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b"\n":
+                        handle.write("\n")
+            self._handles[conversation_id] = handle
+            # 关闭最久未写入的文件；正在被其他线程写入的跳过
+            for old_id in list(self._handles):
+                if len(self._handles) <= MAX_OPEN_FILES:
+                    break
+                old_lock = self._lock_for(old_id)
+                if old_id == conversation_id or not old_lock.acquire(blocking=False):
+                    continue
+                try:
+                    old_handle = self._handles.pop(old_id)
+                    self._sync_handle(old_id, old_handle)
+                    old_handle.close()
+                finally:
+                    old_lock.release()
+            return handle
+
+    def _sync_handle(self, conversation_id, handle):
+        if conversation_id in self._dirty:
+            handle.flush()
+            os.fsync(handle.fileno())
+            self._dirty.discard(conversation_id)
+        self._last_sync[conversation_id] = time.monotonic()
+
+    def append(self, conversation_id, entry):
+        """
+        追加一条对话记录
+
+        写入后立即 flush；fsync 按 fsync_interval 合并执行，由后台线程补齐。
+        """
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        with self._lock_for(conversation_id):
+            handle = self._handle_for(conversation_id)
+            if fcntl is not None:
+                fcntl.flock(handle.fileno(), fcntl.LOCK_EX)
+            try:
+                handle.write(line)
+                handle.flush()
+                self._dirty.add(conversation_id)
+                if time.monotonic() - self._last_sync.get(conversation_id, 0) >= self.fsync_interval:
+                    self._sync_handle(conversation_id, handle)
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(handle.fileno(), fcntl.LOCK_UN)
+
+            if handle.tell() >= self.segment_max_bytes:
+                self._rollover(conversation_id)
+
+        for callback in self._listeners:
+            try:
+                callback(conversation_id, entry)
+            except Exception as e:
+                print(f"历史记录写入回调出错: {e}")
+
+    def _rollover(self, conversation_id):
+        """封存当前文件，下一次写入会创建新文件（调用方需持有会话锁）"""
+        with self._handles_guard:
+            handle = self._handles.pop(conversation_id, None)
+        if handle is not None:
+            self._sync_handle(conversation_id, handle)
+            handle.close()
+
+        segments = self._segment_paths(conversation_id)
+        next_seq = 1
+        if segments:
+            next_seq = int(_segment_file_pattern.match(os.path.basename(segments[-1])).group("seq")) + 1
+        directory = self._segment_dir(conversation_id)
+        os.makedirs(directory, exist_ok=True)
+        sealed = os.path.join(directory, f"{next_seq:06d}.jsonl")
+        os.replace(self._active_path(conversation_id), sealed)
+
+    def _flush_loop(self):
+        while not self._closed:
+            time.sleep(self.fsync_interval)
+            self.flush()
+
+    def flush(self):
+        """把所有尚未 fsync 的写入落盘"""
+        with self._handles_guard:
+            handles = list(self._handles.items())
+        for conversation_id, handle in handles:
+            if conversation_id not in self._dirty:
+                continue
+            with self._lock_for(conversation_id):
+                if not handle.closed:
+                    self._sync_handle(conversation_id, handle)
+
+    def close(self):
+        self.flush()
+        self._closed = True
+        with self._handles_guard:
+            for handle in self._handles.values():
+                handle.close()
+            self._handles.clear()
+
+    # --- 读取 ---
+    def exists(self, conversation_id):
+        return (os.path.exists(self._legacy_path(conversation_id))
+                or os.path.exists(self._active_path(conversation_id))
+                or bool(self._segment_paths(conversation_id)))
+
+    def _sources(self, conversation_id):
+        """按时间顺序返回会话的所有记录文件：旧版 JSON、已封存分段、当前文件"""
+        paths = [self._legacy_path(conversation_id)] + self._segment_paths(conversation_id) + [self._active_path(conversation_id)]
+        return [path for path in paths if os.path.exists(path)]
+
+    def read(self, conversation_id):
+        """
+        读取会话的全部记录，兼容旧版整文件 JSON
+
+        读取期间持有会话锁，避免列出文件后当前文件被封存（重命名）导致打开失败。
+        """
+        entries = []
+        with self._lock_for(conversation_id):
+            for path in self._sources(conversation_id):
+                entries.extend(entry for entry in _load_entries(path) if entry is not None)
+        return entries
+
+    def read_page(self, conversation_id, before=None, limit=20):
+        """
+        从新到旧分页读取会话记录，只解析与所请求范围重叠的文件
+
+        Args:
+            before: 游标，返回下标小于该值的记录；为空时从最新一条开始
+            limit: 返回的最大条数
+
+        Returns:
+            tuple: ([(下标, 记录), ...] 按时间正序, 总条数)
+        """
+        # 持有会话锁，统计条数和读取内容时看到的是同一组文件
+        with self._lock_for(conversation_id):
+            sources = self._sources(conversation_id)
+            counts = [_count_entries(path) for path in sources]
+            total = sum(counts)
+            end = total if before is None else max(0, min(before, total))
+            start = max(0, end - max(0, limit))
+
+            page = []
+            offset = 0
+            for path, count in zip(sources, counts):
+                lo, hi = offset, offset + count
+                offset = hi
+                if hi <= start or lo >= end:
+                    continue
+                entries = _load_entries(path)
+                for index in range(max(lo, start), min(hi, end)):
+                    entry = entries[index - lo] if index - lo < len(entries) else None
+                    if entry is not None:
+                        page.append((index, entry))
+        return page, total
+
+    def version(self, conversation_id):
+        """
+        返回会话内容的版本标识，文件有任何追加或封存都会改变
+
+        只读取文件元数据，可用于生成 ETag。
+        """
+        parts = []
+        with self._lock_for(conversation_id):
+            for path in self._sources(conversation_id):
+                stat = os.stat(path)
+                parts.append(f"{os.path.basename(path)}:{stat.st_size}:{stat.st_mtime_ns}")
+        return "|".join(parts)
+
+    def list_ids(self):
+        """列出所有会话ID"""
+        ids = set()
+        for filename in os.listdir(self.directory):
+            if filename.endswith(".json"):
+                ids.add(filename[:-len(".json")])
+            elif filename.endswith(SEGMENT_DIR_SUFFIX):
+                ids.add(filename[:-len(SEGMENT_DIR_SUFFIX)])
+            else:
+                match = _segment_pattern.match(filename)
+                if match:
+                    ids.add(match.group("id"))
+        return sorted(ids)
+
+
+def _load_entries(path):
+    """
+    读取一个记录文件
+
+    JSONL 文件中写入中断留下的不完整行以 None 占位，保证下标与 _count_entries 一致。
+    """
+    if path.endswith(".json"):
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    entries = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entries.append(json.loads(line))
+            except json.JSONDecodeError:
+                print(f"跳过损坏的历史记录行: {path}")
+                entries.append(None)
+    return entries
+
+def _count_entries(path):
+    """统计记录文件中的条数；JSONL 文件只数行，不解析内容"""
+    if path.endswith(".json"):
+        return len(_load_entries(path))
+    with open(path, "rb") as f:
+        return sum(1 for line in f if line.strip())
+
+
+history_store = HistoryStore()
+atexit.register(history_store.close)
@@ -1,19 +1,228 @@
 import os
+import re
+import math
+import threading
+from collections import OrderedDict, Counter
+from concurrent.futures import ThreadPoolExecutor
 from openai import OpenAI
+from single_flight import SingleFlight
+from telemetry import span
+from cancellation import check_cancelled, call_cancellable
 api_keys=os.getenv("deepseek_api_key")
-base_url="https://api.deepseek.com"
+base_url=os.getenv("DEEPSEEK_BASE_URL", "https://api.deepseek.com")
 
-client=OpenAI(api_key=api_keys,base_url=base_url)
-def get_key_words(question):
-    response=client.chat.completions.create(
+# --- 配置 ---
+# 关键词提取策略：
+#   remote: 只调用远程 deepseek-chat 接口（默认，与原有行为一致）
+#   local: 只使用本地提取，不访问网络
+#   local_first: 立即返回本地提取结果，同时在后台调用远程接口优化，结果写入缓存供下次使用
+KEYWORD_STRATEGY = os.getenv("KEYWORD_STRATEGY", "remote")
+# 远程接口超时时间（秒）与重试次数
+KEYWORD_API_TIMEOUT = float(os.getenv("KEYWORD_API_TIMEOUT", "10"))
+KEYWORD_API_RETRIES = int(os.getenv("KEYWORD_API_RETRIES", "1"))
+# 关键词缓存的最大条目数
+KEYWORD_CACHE_SIZE = int(os.getenv("KEYWORD_CACHE_SIZE", "1024"))
+# 等待其他请求中相同问题关键词提取结果的最长时间（秒）
+KEYWORD_FLIGHT_TIMEOUT = float(os.getenv("KEYWORD_FLIGHT_TIMEOUT", "30"))
+# 本地提取时最多保留的关键词数量
+LOCAL_TOP_K = 3
+# local_first 后台优化使用的线程数，以及最多排队的优化任务数（超过时不再优化新问题）
+KEYWORD_REFINE_WORKERS = int(os.getenv("KEYWORD_REFINE_WORKERS", "2"))
+KEYWORD_REFINE_MAX_PENDING = int(os.getenv("KEYWORD_REFINE_MAX_PENDING", "32"))
+
+SYSTEM_PROMPT = "你是一个善于提炼搜索关键词的大师，你需要从用户输入的问题中提炼出一个用于搜索的关键词，注意，你只需要返回关键词，不需要返回其他任何内容！"
+
+# 本地提取时忽略的常见虚词和疑问词
+STOP_WORDS = [
+    "请问", "请你", "帮我", "告诉我", "一下", "如何", "怎么样", "怎么", "怎样", "什么", "为什么", "为何",
+    "哪些", "哪个", "哪里", "多少", "是否", "能否", "可以", "能不能", "有没有", "是不是", "一个", "一些",
+    "使用", "通过", "关于", "以及", "还是", "或者", "并且", "我们", "你们", "他们", "这个", "那个",
+    "的", "了", "吗", "呢", "啊", "吧", "呀", "和", "与", "及", "或", "是", "在", "有", "我", "你", "他", "她", "它",
+    "要", "想", "会", "能", "用", "把", "被", "给", "对", "从", "到", "就", "都", "也", "还", "很",
+]
+ENGLISH_STOP_WORDS = {"a", "an", "the", "of", "to", "in", "on", "for", "and", "or", "is", "are", "how", "what", "why", "with", "use", "using"}
+_stop_pattern = re.compile("|".join(sorted(map(re.escape, STOP_WORDS), key=len, reverse=True)))
+_token_pattern = re.compile(r"[A-Za-z][A-Za-z0-9+#.\-]*|\d+(?:\.\d+)?|[\u4e00-\u9fff]+")
+
+try:
+    import jieba.analyse
+except ImportError:
+    jieba = None
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    """延迟创建远程接口客户端，仅使用本地提取时不需要 API Key"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = OpenAI(api_key=api_keys, base_url=base_url,
+                             timeout=KEYWORD_API_TIMEOUT, max_retries=KEYWORD_API_RETRIES)
+        return _client
+
+
+class KeywordCache:
+    """
+    线程安全的 LRU 缓存，以问题文本为键保存提取出的关键词
+    """
+
+    def __init__(self, max_size=KEYWORD_CACHE_SIZE):
+        self.max_size = max(1, max_size)
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def get(self, key):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.stats["hits"] += 1
+                return self._data[key]
+            self.stats["misses"] += 1
+            return None
+
+    def put(self, key, value):
+        with self._lock:
+            self._put(key, value)
+
+    def put_if_absent(self, key, value):
+        """仅在缓存中没有该键时写入；检查和写入在同一次加锁内完成，不会覆盖期间写入的结果"""
+        with self._lock:
+            if key not in self._data:
+                self._put(key, value)
+
+    def _put(self, key, value):
+        """写入并按容量淘汰（调用方需持有 _lock）"""
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def snapshot(self):
+        with self._lock:
+            data = dict(self.stats)
+            data["entries"] = len(self._data)
+        return data
+
+
+keyword_cache = KeywordCache()
+# 相同问题的并发提取只调用一次接口
+keyword_flight = SingleFlight("关键词")
+
+
+def get_remote_key_words(question):
+    """调用远程 deepseek-chat 接口提取关键词"""
+    response=get_client().chat.completions.create(
         model="deepseek-chat",
         messages=[
-        {"role":"system","content":"你是一个善于提炼搜索关键词的大师，你需要从用户输入的问题中提炼出一个用于搜索的关键词，注意，你只需要返回关键词，不需要返回其他任何内容！"},
+        {"role":"system","content":SYSTEM_PROMPT},
         {"role":"user","content":question}
     ]
     )
-    return response.choices[0].message.content
-    
+    return response.choices[0].message.content.strip()
+
+def get_local_key_words(question, top_k=LOCAL_TOP_K):
+    """
+    在本地提取关键词，不访问网络
+
+    安装了 jieba 时使用其 TextRank / TF-IDF 提取；否则按虚词切分问题，
+    以词频和词长为候选词打分。结果按在问题中出现的顺序用空格连接。
+    """
+    question = question.strip()
+    if not question:
+        return question
+
+    if jieba is not None:
+        words = jieba.analyse.textrank(question, topK=top_k) or jieba.analyse.extract_tags(question, topK=top_k)
+    else:
+        words = _score_candidates(question, top_k)
+
+    if not words:
+        return question
+    # 按原问题中的位置排序，保持自然语序
+    words = sorted(set(words), key=lambda w: question.lower().find(w.lower()))
+    return " ".join(words)
+
+def _score_candidates(question, top_k):
+    """不依赖分词库的简单提取：用虚词切分出候选词，按词频和词长打分"""
+    candidates = []
+    for token in _token_pattern.findall(question):
+        if re.match(r"[\u4e00-\u9fff]", token):
+            for part in _stop_pattern.split(token):
+                if len(part) >= 2:
+                    candidates.append(part)
+        elif token.lower() not in ENGLISH_STOP_WORDS:
+            candidates.append(token)
+
+    counts = Counter(candidates)
+    scores = {word: count * (1 + math.log(len(word))) for word, count in counts.items()}
+    return sorted(scores, key=scores.get, reverse=True)[:top_k]
+
+_refine_executor = ThreadPoolExecutor(max_workers=max(1, KEYWORD_REFINE_WORKERS), thread_name_prefix="keyword-refine")
+_refine_pending = set()
+_refine_lock = threading.Lock()
+
+def _refine_in_background(key, question):
+    """
+    后台调用远程接口，用更准确的关键词替换缓存中的本地结果
+
+    同一问题已在排队或优化中时不重复提交；排队的任务达到 KEYWORD_REFINE_MAX_PENDING 时跳过，
+    远程接口变慢时不会堆积大量线程和请求。
+    """
+    with _refine_lock:
+        if key in _refine_pending or len(_refine_pending) >= KEYWORD_REFINE_MAX_PENDING:
+            return
+        _refine_pending.add(key)
+
+    def refine():
+        try:
+            keyword_cache.put(key, get_remote_key_words(question))
+        except Exception as e:
+            print(f"远程关键词优化失败: {e}")
+        finally:
+            with _refine_lock:
+                _refine_pending.discard(key)
+
+    _refine_executor.submit(refine)
+
+def get_key_words(question, strategy=None):
+    """
+    从用户问题中提取搜索关键词
+
+    Args:
+        question: 用户问题
+        strategy: remote / local / local_first，为空时使用 KEYWORD_STRATEGY
+
+    Returns:
+        str: 搜索关键词
+    """
+    check_cancelled()
+    strategy = strategy or KEYWORD_STRATEGY
+    key = (strategy, question.strip())
+    cached = keyword_cache.get(key)
+    if cached:
+        return cached
+
+    def extract():
+        if strategy == "local":
+            key_words = get_local_key_words(question)
+        elif strategy == "local_first":
+            key_words = get_local_key_words(question)
+            _refine_in_background(key, question)
+        else:
+            # 请求被取消时不再等待远程接口返回
+            key_words = call_cancellable(get_remote_key_words, question)
+
+        # local_first 的后台优化可能已先一步写入缓存，不覆盖更准确的结果
+        keyword_cache.put_if_absent(key, key_words)
+        return key_words
+
+    # 同一问题的并发请求共享一次提取结果
+    with span("keywords"):
+        return keyword_flight.do(key, extract, timeout=KEYWORD_FLIGHT_TIMEOUT)
+
 if __name__=="__main__":
     question="如何使用python爬取网页数据？"
     key_words=get_key_words(question)
@@ -3,58 +3,22 @@ import requests
 import tkinter as tk
 from tkinter import ttk
 import threading
-import ollama
 import json
 import re
 import time
-from bs4 import BeautifulSoup
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.chrome.service import Service as ChromeService
-from selenium.common.exceptions import NoSuchElementException, TimeoutException
 from urllib.parse import urljoin
 from key_words_abstract import get_key_words
-from web_crawler_server import search, get_full_content, is_readable_text, extract_text_with_selenium
+from search_cache import cached_search
+from context_builder import build_context, build_prompt
+from chat_model import chat, build_messages, history_window, model_monitor
 from openai import OpenAI
 api_keys=os.getenv("deepseek_api_key")
 base_url="https://api.deepseek.com"
 
 # 全局变量，用于跟踪是否启用联网搜索
 enable_web_search = True
-
-# 清理模型响应的函数
-def clean_model_response(response_text):
-    """
-    清理模型响应，去除元数据但保留思考过程
-    
-    Args:
-        response_text: 原始响应文本
-        
-    Returns:
-        str: 清理后的响应文本
-    """
-    # 提取消息内容部分
-    content_match = re.search(r"content='(.*?)', images=", response_text, re.DOTALL)
-    if content_match:
-        # 提取content字段内容并返回，保留思考过程
-        content = content_match.group(1)
-        return content.strip()
-    else:
-        # 如果无法匹配标准格式，尝试直接清理元数据
-        result = re.sub(r'^model=.*?\n', '', response_text, flags=re.MULTILINE)
-        result = re.sub(r'^created_at=.*?\n', '', result, flags=re.MULTILINE)
-        result = re.sub(r'^done=.*?\n', '', result, flags=re.MULTILINE)
-        result = re.sub(r'^done_reason=.*?\n', '', result, flags=re.MULTILINE)
-        result = re.sub(r'^total_duration=.*?\n', '', result, flags=re.MULTILINE)
-        result = re.sub(r'^load_duration=.*?\n', '', result, flags=re.MULTILINE)
-        result = re.sub(r'^prompt_eval.*?\n', '', result, flags=re.MULTILINE)
-        result = re.sub(r'^eval_.*?\n', '', result, flags=re.MULTILINE)
-        result = re.sub(r'^message=.*?\n', '', result, flags=re.MULTILINE)
-        
-        # 保留思考过程，不再删除<think>标签
-        return result.strip()
+# 本次运行中的对话记录，用于多轮追问
+chat_turns = []
 
 # 定义文本格式处理函数
 def format_model_output(text_widget, text):
@@ -101,7 +65,7 @@ def format_model_output(text_widget, text):
 def search_online(question):
     try:
         key_words=get_key_words(question)
-        search_results=search(key_words)
+        search_results=cached_search(key_words)
         return search_results
     except Exception as e:
         print(f"联网搜索出错: {e}")
@@ -125,26 +89,9 @@ def process_message(message):
     
     try:
         if search_results:
-            # 将search_results列表转换为字符串
-            if isinstance(search_results, list):
-                formatted_results = ""
-                for i, item in enumerate(search_results):
-                    formatted_results += f"\n结果 {i+1}:\n"
-                    if 'title' in item:
-                        formatted_results += f"标题: {item['title']}\n"
-                    if 'snippet' in item:
-                        formatted_results += f"摘要: {item['snippet']}\n"
-                    if 'content' in item:
-                        # 限制正文长度，避免提示词过长
-                        content = item['content']
-                        if len(content) > 1000:
-                            content = content[:1000] + "...(内容已截断)"
-                        formatted_results += f"正文: {content}\n"
-                    formatted_results += "\n"
-            else:
-                formatted_results = str(search_results)
-                
-            augmented_message = message + "\t" + "以下是联网搜索的结果，请你结合联网搜索的结果和你自身的记忆回答用户的问题，如果记忆和联网搜索有出入，请以联网搜索的结果为准，搜索结果为：" + formatted_results
+            # 只把与问题最相关的段落放入提示词，避免提示词过长
+            formatted_results = build_context(message, search_results)
+            augmented_message = build_prompt(message, formatted_results)
         else:
             augmented_message = message
             
@@ -157,26 +104,13 @@ def process_message(message):
         
         try:
             # 调用模型API
-            response = ollama.chat(model="deepseek-r1:7b", messages=[{"role":"user", "content":augmented_message}])
-            
-            # 添加调试信息
-            print("API响应类型:", type(response))
-            print("API响应内容:", response)
-            
-            # 检查响应格式并提取回答内容
-            if isinstance(response, dict):
-                if "response" in response:
-                    model_response = response["response"]
-                elif "message" in response and isinstance(response["message"], dict):
-                    model_response = response["message"].get("content", str(response))
-                else:
-                    # 尝试查找可能的响应字段
-                    model_response = str(response)
-            else:
-                model_response = str(response)
-            
-            # 清理模型响应
-            model_response = clean_model_response(model_response)
+            # 带上本次运行中最近几轮对话，支持追问
+            messages = build_messages(chat_turns[history_window(len(chat_turns)):], augmented_message)
+            result = chat(messages)
+            model_response = result.text
+            # 输出本轮的 token 数和耗时，便于调试
+            print("生成统计:", result.metrics)
+            chat_turns.append({"user": message, "bot": model_response})
             
             # 显示模型回答
             display_text.config(state=tk.NORMAL)
@@ -186,32 +120,9 @@ def process_message(message):
             display_text.config(state=tk.DISABLED)
             
         except Exception as e:
-            # 模型API调用失败，尝试备用方法
+            # 模型API调用失败；后端连续失败时断路器会直接拒绝，不再逐条等待超时
             display_text.config(state=tk.NORMAL)
-            display_text.insert(tk.END, f"API调用出错：{str(e)}\n")
-            display_text.insert(tk.END, "尝试使用备用方法获取响应...\n")
-            
-            try:
-                # 备用方法：直接使用命令行调用ollama
-                import subprocess
-                cmd = ["ollama", "run", "deepseek-r1:7b", "-m", message]
-                print(f"执行命令: {' '.join(cmd)}")
-                result = subprocess.run(cmd, text=True, capture_output=True, timeout=60)
-                
-                if result.returncode == 0:
-                    model_response = result.stdout.strip()
-                    
-                    # 清理模型响应
-                    model_response = clean_model_response(model_response)
-                    
-                    display_text.insert(tk.END, "DeepSeek：")
-                    format_model_output(display_text, model_response)
-                    display_text.insert(tk.END, "\n\n")
-                else:
-                    display_text.insert(tk.END, f"命令行调用失败: {result.stderr}\n\n")
-            except Exception as e2:
-                display_text.insert(tk.END, f"备用方法也失败了: {str(e2)}\n\n")
-            
+            display_text.insert(tk.END, f"API调用出错：{str(e)}\n\n")
             display_text.config(state=tk.DISABLED)
         
     except Exception as e:
@@ -303,6 +214,9 @@ display_text.config(state=tk.NORMAL)
 display_text.insert(tk.END, "DeepSeek：你好！我是DeepSeek助手，有什么可以帮到你的？\n\n")
 display_text.config(state=tk.DISABLED)
 
+# 在后台预热模型，第一条消息无需等待模型加载
+model_monitor.start()
+
 # 启动主循环
 root.mainloop()
 
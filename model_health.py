@@ -0,0 +1,193 @@
+import os
+import time
+import threading
+
+# --- 配置 ---
+# 连续失败多少次后断开（暂停调用模型）
+BREAKER_FAILURES = int(os.getenv("MODEL_BREAKER_FAILURES", "3"))
+# 断开后多久（秒）允许重新尝试
+BREAKER_RESET_TIMEOUT = float(os.getenv("MODEL_BREAKER_RESET_TIMEOUT", "30"))
+# 存活探测的间隔（秒）
+PROBE_INTERVAL = float(os.getenv("MODEL_PROBE_INTERVAL", "30"))
+
+# 断路器状态
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# 模型状态
+STARTING = "starting"
+WARMING = "warming"
+READY = "ready"
+UNAVAILABLE = "unavailable"
+
+
+class CircuitOpenError(Exception):
+    """后端连续失败，断路器已断开，暂不调用"""
+
+
+class CircuitBreaker:
+    """
+    断路器：后端连续失败 failures 次后断开，reset_timeout 秒内的调用直接失败，
+    之后进入半开状态只放行一个试探调用，其余调用在试探结束前直接失败；
+    试探成功即恢复，失败则重新断开。试探超过 reset_timeout 秒仍未结束时放行下一个试探。
+    """
+
+    def __init__(self, name, failures=BREAKER_FAILURES, reset_timeout=BREAKER_RESET_TIMEOUT):
+        self.name = name
+        self.failures = max(1, failures)
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self._consecutive = 0
+        self._opened_at = 0
+        self._trial_started = None  # 半开状态下正在进行的试探调用的开始时间
+        self._lock = threading.Lock()
+        self.stats = {"successes": 0, "failures": 0, "rejected": 0, "opened": 0}
+
+    def allow(self):
+        """
+        调用前检查
+
+        Raises:
+            CircuitOpenError: 断路器处于断开状态
+        """
+        with self._lock:
+            if self.state == CLOSED:
+                return
+            now = time.monotonic()
+            if self.state == OPEN and now - self._opened_at >= self.reset_timeout:
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN and (self._trial_started is None
+                                            or now - self._trial_started >= self.reset_timeout):
+                self._trial_started = now
+                return
+            self.stats["rejected"] += 1
+            raise CircuitOpenError(f"{self.name}服务暂时不可用，请稍后再试")
+
+    def release(self):
+        """调用被取消、没有结果时调用：不改变状态，只结束半开状态下的试探"""
+        with self._lock:
+            self._trial_started = None
+
+    def record_success(self):
+        with self._lock:
+            self.stats["successes"] += 1
+            self._consecutive = 0
+            self._trial_started = None
+            self.state = CLOSED
+
+    def record_failure(self):
+        with self._lock:
+            self._trial_started = None
+            self.stats["failures"] += 1
+            self._consecutive += 1
+            if self.state == HALF_OPEN or self._consecutive >= self.failures:
+                if self.state != OPEN:
+                    self.stats["opened"] += 1
+                    print(f"{self.name}连续失败 {self._consecutive} 次，断路器断开")
+                self.state = OPEN
+                self._opened_at = time.monotonic()
+
+    def snapshot(self):
+        with self._lock:
+            data = dict(self.stats)
+            data["state"] = self.state
+            data["consecutive_failures"] = self._consecutive
+        return data
+
+
+class ModelMonitor:
+    """
+    启动时预热模型，之后定期探测后端是否存活
+
+    探测和预热只决定就绪状态，不计入断路器：列出模型成功不代表生成能成功，
+    断路器只由真实的对话调用结果驱动。后端恢复后自动重新预热。
+    """
+
+    def __init__(self, client, model, breaker, warm_up, interval=PROBE_INTERVAL):
+        self.client = client
+        self.model = model
+        self.breaker = breaker
+        self.warm_up = warm_up
+        self.interval = interval
+        self.state = STARTING
+        self.last_error = None
+        self.last_probe = None
+        self.warmup_seconds = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    def start(self):
+        """在后台线程中预热并开始定期探测，重复调用无效"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="model-monitor", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        self._warm()
+        while not self._stop.wait(self.interval):
+            if self.probe() and self.state != READY:
+                self._warm()
+
+    def _set_state(self, state, error=None):
+        with self._lock:
+            self.state = state
+            self.last_error = error
+
+    def _warm(self):
+        """用一个很短的提示词让后端加载模型"""
+        self._set_state(WARMING)
+        print(f"正在预热模型 {self.model}...")
+        started = time.monotonic()
+        try:
+            self.warm_up()
+        except Exception as e:
+            print(f"模型预热失败: {e}")
+            self._set_state(UNAVAILABLE, str(e))
+            return
+        self.warmup_seconds = time.monotonic() - started
+        self._set_state(READY)
+        print(f"模型预热完成，耗时 {self.warmup_seconds:.1f} 秒")
+
+    def probe(self):
+        """
+        探测后端是否存活以及模型是否已安装
+
+        Returns:
+            bool: 探测是否成功
+        """
+        self.last_probe = time.time()
+        try:
+            response = self.client.list()
+        except Exception as e:
+            print(f"模型服务探测失败: {e}")
+            self._set_state(UNAVAILABLE, str(e))
+            return False
+
+        names = {model.get("model") or model.get("name") for model in response["models"]}
+        wanted = self.model if ":" in self.model else f"{self.model}:latest"
+        if wanted not in names:
+            self._set_state(UNAVAILABLE, f"模型 {self.model} 未安装")
+            return False
+        return True
+
+    def ready(self):
+        return self.state == READY
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "model": self.model,
+                "state": self.state,
+                "ready": self.state == READY,
+                "last_error": self.last_error,
+                "last_probe": self.last_probe,
+                "warmup_seconds": self.warmup_seconds,
+                "breaker": self.breaker.snapshot(),
+            }
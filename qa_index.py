@@ -0,0 +1,211 @@
+import os
+import math
+import threading
+from array import array
+from collections import Counter
+from datetime import datetime
+
+import numpy as np
+
+from chat_model import strip_think
+from context_builder import tokenize
+from history_store import history_store
+
+# --- 配置 ---
+# 是否在联网搜索前查询历史问答
+QA_INDEX_ENABLED = os.getenv("QA_INDEX_ENABLED", "1") == "1"
+# 相似度达到该值时视为已经回答过的问题，直接复用当时的搜索结果，跳过联网搜索
+QA_REUSE_THRESHOLD = float(os.getenv("QA_REUSE_THRESHOLD", "0.8"))
+# 相似度达到该值时把历史问答作为参考放入提示词
+QA_RELATED_THRESHOLD = float(os.getenv("QA_RELATED_THRESHOLD", "0.5"))
+# 超过该时间（秒）的历史问答不再复用搜索结果，只作为参考
+QA_REUSE_MAX_AGE = float(os.getenv("QA_REUSE_MAX_AGE", str(7 * 24 * 3600)))
+# 回答中的词项相对问题的权重
+ANSWER_WEIGHT = 0.3
+# 放入提示词的历史回答的最大长度
+MEMORY_ANSWER_CHARS = 500
+
+
+class QAIndex:
+    """
+    历史问答的 TF-IDF 向量索引
+
+    每轮对话（问题和去掉思考过程的回答）作为一个文档，写入历史记录时增量加入。
+    词频以 (文档, 词项, 权重) 三元组保存，查询时用 NumPy 按当前的 IDF 计算余弦相似度；
+    文档有新增时才重新计算 IDF 和文档向量的模长。
+    """
+
+    def __init__(self, store=history_store):
+        self.store = store
+        self.ready = False
+        self._vocab = {}            # 词项 -> 编号
+        self._df = []               # 编号 -> 文档频率
+        self._rows = array("q")     # 三元组：文档编号
+        self._cols = array("q")     # 三元组：词项编号
+        self._vals = array("d")     # 三元组：词频权重
+        self._matrix = None         # 查询时按需生成的 NumPy 数组
+        self._docs = []
+        self._seen = set()
+        self._lock = threading.Lock()
+
+    def start(self):
+        """在后台线程中根据历史文件建立索引，建立完成前查询不返回结果"""
+        threading.Thread(target=self.rebuild, name="qa-index", daemon=True).start()
+
+    def rebuild(self):
+        count = 0
+        for conversation_id in self.store.list_ids():
+            try:
+                entries = self.store.read(conversation_id)
+            except Exception as e:
+                print(f"读取会话 {conversation_id} 失败，跳过: {e}")
+                continue
+            for entry in entries:
+                count += self.add(conversation_id, entry)
+        self.ready = True
+        print(f"历史问答索引已建立，共 {count} 条")
+
+    def add(self, conversation_id, entry):
+        """
+        加入一条历史记录，可直接作为 HistoryStore 的监听回调
+
+        Returns:
+            int: 新加入时为 1，已存在或内容为空时为 0
+        """
+        question = entry.get("user") or ""
+        answer = strip_think(entry.get("bot") or "")
+        if not question.strip() or not answer:
+            return 0
+
+        weights = Counter()
+        for term, tf in Counter(tokenize(question)).items():
+            weights[term] += 1 + math.log(tf)
+        for term, tf in Counter(tokenize(answer)).items():
+            weights[term] += ANSWER_WEIGHT * (1 + math.log(tf))
+        if not weights:
+            return 0
+
+        key = (conversation_id, entry.get("timestamp"), question)
+        with self._lock:
+            # 建立索引期间新写入的记录可能同时出现在文件和监听回调中
+            if key in self._seen:
+                return 0
+            self._seen.add(key)
+
+            doc_id = len(self._docs)
+            for term, weight in weights.items():
+                term_id = self._vocab.get(term)
+                if term_id is None:
+                    term_id = self._vocab[term] = len(self._df)
+                    self._df.append(0)
+                self._df[term_id] += 1
+                self._rows.append(doc_id)
+                self._cols.append(term_id)
+                self._vals.append(weight)
+
+            self._docs.append({
+                "conversation_id": conversation_id,
+                "timestamp": entry.get("timestamp", ""),
+                "question": question,
+                "answer": answer,
+                "has_search_results": bool(entry.get("search_results")),
+            })
+            self._matrix = None
+        return 1
+
+    def _arrays(self):
+        """返回 (文档编号, 词项编号, 带 IDF 的权重, IDF, 文档模长)，调用方需持有锁"""
+        if self._matrix is None:
+            total = len(self._docs)
+            rows = np.frombuffer(self._rows, dtype=np.int64).copy()
+            cols = np.frombuffer(self._cols, dtype=np.int64).copy()
+            idf = np.log((total + 1) / (np.array(self._df, dtype=np.float64) + 1)) + 1
+            weighted = np.frombuffer(self._vals, dtype=np.float64) * idf[cols]
+            norms = np.sqrt(np.bincount(rows, weights=weighted ** 2, minlength=total))
+            norms[norms == 0] = 1.0
+            self._matrix = (rows, cols, weighted, idf, norms)
+        return self._matrix
+
+    def search(self, question, top_k=1):
+        """
+        查找与问题最相似的历史问答
+
+        Returns:
+            list: [(余弦相似度, 文档), ...] 按相似度从高到低排列
+        """
+        query = Counter(tokenize(question))
+        with self._lock:
+            total = len(self._docs)
+            if not self.ready or not total or not query:
+                return []
+
+            rows, cols, weighted, idf, norms = self._arrays()
+            query_vector = np.zeros(len(idf))
+            for term, tf in query.items():
+                term_id = self._vocab.get(term)
+                if term_id is not None:
+                    query_vector[term_id] = (1 + math.log(tf)) * idf[term_id]
+            query_norm = np.linalg.norm(query_vector)
+            if not query_norm:
+                return []
+
+            scores = np.bincount(rows, weights=weighted * query_vector[cols], minlength=total)
+            scores /= norms * query_norm
+            best = np.argsort(-scores)[:top_k]
+            return [(float(scores[i]), self._docs[i]) for i in best if scores[i] > 0]
+
+    def _search_results(self, doc):
+        """读取历史问答当时保存的搜索结果"""
+        for entry in reversed(self.store.read(doc["conversation_id"])):
+            if entry.get("timestamp") == doc["timestamp"] and entry.get("user") == doc["question"]:
+                return entry.get("search_results")
+        return None
+
+    def recall(self, question, exclude_conversation=None):
+        """
+        在联网搜索前查询历史问答
+
+        exclude_conversation 中的问答已作为历史消息回放给模型，不再重复返回。
+
+        Returns:
+            tuple: (可复用的搜索结果, 放入提示词的历史问答, 相似度)
+                   相似度不低于 QA_REUSE_THRESHOLD 且足够新时返回当时的搜索结果，可跳过联网搜索；
+                   不低于 QA_RELATED_THRESHOLD 时只返回历史问答作为参考
+        """
+        if not QA_INDEX_ENABLED:
+            return None, "", 0.0
+        matches = [(score, doc) for score, doc in self.search(question, top_k=5)
+                   if doc["conversation_id"] != exclude_conversation]
+        if not matches or matches[0][0] < QA_RELATED_THRESHOLD:
+            return None, "", 0.0
+
+        score, doc = matches[0]
+        answer = doc["answer"]
+        if len(answer) > MEMORY_ANSWER_CHARS:
+            answer = answer[:MEMORY_ANSWER_CHARS] + "..."
+        memory = f"\n问题: {doc['question']}\n回答: {answer}\n"
+
+        search_results = None
+        if score >= QA_REUSE_THRESHOLD and doc["has_search_results"] and _age(doc["timestamp"]) <= QA_REUSE_MAX_AGE:
+            try:
+                search_results = self._search_results(doc)
+            except Exception as e:
+                print(f"读取历史搜索结果失败: {e}")
+        return search_results, memory, score
+
+    def snapshot(self):
+        with self._lock:
+            return {"ready": self.ready, "documents": len(self._docs), "terms": len(self._vocab),
+                    "postings": len(self._vals)}
+
+
+def _age(timestamp):
+    """返回历史记录距今的秒数，时间无法解析时视为很久以前"""
+    try:
+        return (datetime.now() - datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S")).total_seconds()
+    except (TypeError, ValueError):
+        return float("inf")
+
+
+qa_index = QAIndex()
+history_store.add_listener(qa_index.add)
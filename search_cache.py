@@ -0,0 +1,221 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import threading
+import unicodedata
+
+from web_crawler_server import search_events
+from single_flight import SingleFlight, FlightAbandoned
+from cancellation import Cancelled
+
+# --- 配置 ---
+# 缓存数据库文件路径
+SEARCH_CACHE_PATH = os.getenv("SEARCH_CACHE_PATH", "search_cache.db")
+# 缓存有效期（秒）
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", "3600"))
+# 最多缓存的关键词数量，超过后淘汰最久未使用的条目
+SEARCH_CACHE_MAX_ENTRIES = int(os.getenv("SEARCH_CACHE_MAX_ENTRIES", "500"))
+# 等待其他请求中相同关键词搜索结果的最长时间（秒）
+SEARCH_FLIGHT_TIMEOUT = float(os.getenv("SEARCH_FLIGHT_TIMEOUT", "60"))
+
+
+def normalize_key(query):
+    """
+    规范化搜索关键词，使写法略有差异的同一关键词命中同一条缓存
+
+    统一全角/半角、大小写，合并空白，去掉首尾的标点和引号
+    """
+    key = unicodedata.normalize("NFKC", query or "")
+    key = key.lower().strip()
+    key = re.sub(r"\s+", " ", key)
+    key = key.strip(" \"'“”‘’「」《》?？!！.。,，;；:：")
+    return key
+
+
+class SearchCache:
+    """
+    基于 SQLite 的搜索结果缓存，带过期时间和 LRU 容量限制
+
+    条目保存在本地文件中，服务重启后仍然有效。
+    """
+
+    def __init__(self, path=SEARCH_CACHE_PATH, ttl=SEARCH_CACHE_TTL, max_entries=SEARCH_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max(1, max_entries)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS search_cache (
+                key TEXT PRIMARY KEY,
+                results TEXT NOT NULL,
+                created REAL NOT NULL,
+                accessed REAL NOT NULL
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_search_cache_accessed ON search_cache (accessed)")
+        self._conn.commit()
+        self.stats = {"hits": 0, "misses": 0, "expired": 0, "evictions": 0}
+
+    def get(self, query):
+        """
+        读取缓存
+
+        Returns:
+            list: 缓存的搜索结果；未命中或已过期时返回 None
+        """
+        key = normalize_key(query)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT results, created FROM search_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.stats["misses"] += 1
+                return None
+
+            results, created = row
+            if now - created > self.ttl:
+                self._conn.execute("DELETE FROM search_cache WHERE key = ?", (key,))
+                self._conn.commit()
+                self.stats["expired"] += 1
+                self.stats["misses"] += 1
+                return None
+
+            self._conn.execute("UPDATE search_cache SET accessed = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.stats["hits"] += 1
+        return json.loads(results)
+
+    def put(self, query, results):
+        """写入缓存，超过容量时淘汰最久未使用的条目"""
+        key = normalize_key(query)
+        now = time.time()
+        data = json.dumps(results, ensure_ascii=False)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO search_cache (key, results, created, accessed) VALUES (?, ?, ?, ?)",
+                (key, data, now, now),
+            )
+            count = self._conn.execute("SELECT COUNT(*) FROM search_cache").fetchone()[0]
+            overflow = count - self.max_entries
+            if overflow > 0:
+                self._conn.execute(
+                    "DELETE FROM search_cache WHERE key IN "
+                    "(SELECT key FROM search_cache ORDER BY accessed ASC LIMIT ?)",
+                    (overflow,),
+                )
+                self.stats["evictions"] += overflow
+            self._conn.commit()
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._conn.execute("DELETE FROM search_cache")
+            self._conn.commit()
+
+    def snapshot(self):
+        """返回命中、未命中、淘汰等计数"""
+        with self._lock:
+            data = dict(self.stats)
+            data["entries"] = self._conn.execute("SELECT COUNT(*) FROM search_cache").fetchone()[0]
+        lookups = data["hits"] + data["misses"]
+        data["hit_rate"] = data["hits"] / lookups if lookups else 0.0
+        return data
+
+
+search_cache = SearchCache()
+# 相同关键词的并发搜索只启动一次爬虫
+search_flight = SingleFlight("搜索")
+
+
+def _flight_timeout(budget):
+    """等待相同搜索的最长时间，不超过本次搜索剩余的时间预算"""
+    if budget is None:
+        return SEARCH_FLIGHT_TIMEOUT
+    return min(SEARCH_FLIGHT_TIMEOUT, budget.remaining())
+
+
+def _flight_key(query, budget):
+    """
+    合并相同搜索时使用的键
+
+    带时间预算（流水线搜索）的搜索可能因预算用完而只拿到部分正文，
+    不让使用完整预算的搜索与它合并。
+    """
+    key = normalize_key(query)
+    return key if budget is None else f"{key}#deadline"
+
+
+def cached_search(query, budget=None):
+    """
+    带缓存的 search()，命中时直接返回缓存的结果
+
+    同一关键词正在被其他请求搜索时，等待并共享那次搜索的结果；
+    等待超时时使用那次搜索已经解析到的摘要。
+    """
+    results = []
+    for event in cached_search_events(query, budget):
+        if event["type"] == "done":
+            results = event["results"]
+    return results
+
+
+def cached_search_events(query, budget=None):
+    """
+    带缓存的 search_events()，命中时只产出一个 done 事件
+
+    同一关键词正在被其他请求搜索时，不再启动爬虫，等待那次搜索结束后
+    产出带 shared 标记的 done 事件（含那次搜索的 sources 和 partial）；那次搜索被中途放弃时自行搜索；
+    等到超时或本次的时间预算用完仍未结束时，使用那次搜索已经解析到的摘要（不含正文），partial 为 True。
+    """
+    results = search_cache.get(query)
+    if results is not None:
+        print(f"搜索缓存命中: {query}")
+        yield {"type": "done", "results": results, "cached": True}
+        return
+
+    key = _flight_key(query, budget)
+    call, is_leader = search_flight.begin(key)
+    if not is_leader:
+        print(f"等待进行中的相同搜索: {query}")
+        try:
+            done = search_flight.wait(call, _flight_timeout(budget))
+        except FlightAbandoned:
+            yield from search_events(query, budget)
+            return
+        except TimeoutError:
+            snippets = list(call.progress or [])
+            print(f"等待相同搜索超时，使用已解析的 {len(snippets)} 条摘要: {query}")
+            sources = [{"index": i, "title": item["title"], "body": "late"} for i, item in enumerate(snippets)]
+            yield {"type": "done", "results": snippets, "sources": sources, "shared": True, "partial": True}
+            return
+        yield dict(done, shared=True)
+        return
+
+    finished = False
+    snippets = []
+    try:
+        for event in search_events(query, budget):
+            if event["type"] == "result":
+                # 发布已解析的摘要，等待超时的 follower 可以先使用
+                snippets.append({"title": event["title"], "snippet": event["snippet"]})
+                search_flight.publish(call, list(snippets))
+            elif event["type"] == "done":
+                if event["results"] and not event.get("partial"):
+                    search_cache.put(query, event["results"])
+                search_flight.finish(key, call, result=dict(event))
+                finished = True
+            yield event
+    except Exception as e:
+        if not finished:
+            # 本请求被取消不代表搜索失败，等待方应自行搜索
+            search_flight.finish(key, call, error=FlightAbandoned(query) if isinstance(e, Cancelled) else e)
+            finished = True
+        raise
+    finally:
+        if not finished:
+            # 生成器被提前关闭，通知等待方自行搜索
+            search_flight.finish(key, call, error=FlightAbandoned(query))
@@ -0,0 +1,110 @@
+import threading
+
+from cancellation import Cancelled, wait_event
+
+
+class FlightAbandoned(Exception):
+    """正在执行的请求被中途放弃（例如发起方断开连接），没有产生结果"""
+
+
+class _Call:
+    """一次正在执行的请求"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        # leader 发布的中间结果，follower 等待超时时可以先使用
+        self.progress = None
+
+
+class SingleFlight:
+    """
+    合并相同键的并发请求：同一时间只有第一个调用方（leader）真正执行，
+    其余调用方（follower）等待并共享它的结果或异常。
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.stats = {"leaders": 0, "shared": 0, "timeouts": 0}
+
+    def begin(self, key):
+        """
+        登记一次调用
+
+        Returns:
+            tuple: (call, is_leader)；is_leader 为 True 时调用方负责执行并调用 finish()
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self.stats["shared"] += 1
+                return call, False
+            call = self._calls[key] = _Call()
+            self.stats["leaders"] += 1
+            return call, True
+
+    def publish(self, call, progress):
+        """leader 执行期间发布中间结果（覆盖之前发布的）"""
+        call.progress = progress
+
+    def finish(self, key, call, result=None, error=None):
+        """leader 执行结束后发布结果或异常，唤醒所有 follower"""
+        call.result = result
+        call.error = error
+        with self._lock:
+            if self._calls.get(key) is call:
+                del self._calls[key]
+        call.done.set()
+
+    def wait(self, call, timeout=None):
+        """
+        follower 等待 leader 的结果，等待期间自己的请求被取消时立即返回
+
+        Raises:
+            TimeoutError: 超过 timeout 秒仍未完成
+            Cancelled: 等待期间当前请求被取消
+            其他异常: leader 执行时抛出的异常
+        """
+        if not wait_event(call.done, timeout):
+            with self._lock:
+                self.stats["timeouts"] += 1
+            raise TimeoutError(f"等待相同的{self.name}请求超时")
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def do(self, key, fn, timeout=None):
+        """
+        执行 fn()，相同 key 的并发调用只执行一次
+
+        leader 的请求被取消时，follower 不会收到 Cancelled，而是自行执行 fn()。
+
+        Args:
+            key: 请求的键
+            fn: 无参函数
+            timeout: follower 的最长等待时间（秒）
+        """
+        call, is_leader = self.begin(key)
+        if not is_leader:
+            try:
+                return self.wait(call, timeout)
+            except FlightAbandoned:
+                return fn()
+
+        try:
+            result = fn()
+        except BaseException as e:
+            abandoned = isinstance(e, Cancelled) or not isinstance(e, Exception)
+            self.finish(key, call, error=FlightAbandoned(str(e)) if abandoned else e)
+            raise
+        self.finish(key, call, result=result)
+        return result
+
+    def snapshot(self):
+        with self._lock:
+            data = dict(self.stats)
+            data["in_flight"] = len(self._calls)
+        return data
@@ -3,6 +3,13 @@ let enableWebSearch = true;
 let currentConversationId = null;
 let isProcessing = false;
 let searchAnimation = null; // 用于存储Lottie动画实例
+const HISTORY_PAGE_SIZE = 50; // 历史会话每页条数，与服务器默认值一致
+let historyOffset = 0;        // 已加载的历史会话数量
+let historyExhausted = false; // 是否已加载全部历史会话
+let historyLoading = false;   // 是否正在加载下一页
+const TRANSCRIPT_PAGE_SIZE = 20; // 打开历史会话时每次加载的轮数
+const JOB_MAX_RECONNECTS = 5;    // 任务事件流断开后最多重连次数
+let currentJobId = null;         // 正在进行的对话任务ID
 
 // DOM元素
 const userInput = document.getElementById('user-input');
@@ -50,6 +57,9 @@ document.addEventListener('DOMContentLoaded', () => {
     // 监听新建会话按钮
     newChatBtn.addEventListener('click', createNewChat);
     
+    // 关闭或离开页面时取消正在进行的对话，服务器不再继续搜索和生成
+    window.addEventListener('pagehide', () => cancelCurrentJob(true));
+    
     // 监听历史会话点击
     document.querySelectorAll('.history-item').forEach(item => {
         item.addEventListener('click', () => {
@@ -57,6 +67,16 @@ document.addEventListener('DOMContentLoaded', () => {
         });
     });
     
+    // 首屏由服务器渲染，滚动到底部时再加载更多历史会话
+    historyOffset = historyList.childElementCount;
+    historyExhausted = historyOffset < HISTORY_PAGE_SIZE;
+    const historyContainer = historyList.parentElement;
+    historyContainer.addEventListener('scroll', () => {
+        if (historyContainer.scrollTop + historyContainer.clientHeight >= historyContainer.scrollHeight - 40) {
+            loadMoreHistory();
+        }
+    });
+    
     // 自动聚焦输入框
     userInput.focus();
 });
@@ -93,64 +113,25 @@ async function sendMessage() {
     sendBtn.disabled = true;
     
     try {
-        // 发送请求到服务器
-        const response = await fetch('/api/send', {
+        // 提交对话任务，服务器立即返回任务ID
+        const response = await fetch('/api/jobs', {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
             },
             body: JSON.stringify({
                 message: message,
-                enable_web_search: enableWebSearch,
-                return_search_progress: true  // 请求服务器返回搜索进度和标题
+                enable_web_search: enableWebSearch
             }),
         });
         
         // 处理响应
         if (response.ok) {
-            const reader = response.body.getReader();
-            const decoder = new TextDecoder();
-            
-            // 循环读取响应流
-            while (true) {
-                const { value, done } = await reader.read();
-                if (done) break;
-                
-                const chunk = decoder.decode(value, { stream: true });
-                
-                try {
-                    // 尝试解析JSON响应
-                    const data = JSON.parse(chunk);
-                    
-                    // 如果是搜索进度更新
-                    if (data.type === 'search_progress' && data.title) {
-                        updateSearchText(data.title);
-                    } 
-                    // 如果是最终回复
-                    else if (data.type === 'final_response') {
-                        // 移除加载指示器
-                        if (loadingElement) {
-                            loadingElement.remove();
-                            if (searchAnimation) {
-                                searchAnimation.destroy();
-                                searchAnimation = null;
-                            }
-                        }
-                        
-                        // 添加机器人回复
-                        addMessage(data.response, 'bot', data.has_search_results);
-                        
-                        // 更新当前会话ID
-                        if (data.conversation_id) {
-                            currentConversationId = data.conversation_id;
-                            updateHistoryList();
-                        }
-                    }
-                } catch (e) {
-                    // 如果不是JSON，可能是其他格式的响应
-                    console.error('解析响应时出错:', e);
-                }
-            }
+            const job = await response.json();
+            currentJobId = job.job_id;
+            // 流式处理状态：加载指示器和正在生成的消息
+            const streamState = { loadingElement: loadingElement, live: null };
+            await followJob(job.job_id, streamState);
         } else {
             // 处理错误响应
             const data = await response.json();
@@ -180,6 +161,7 @@ async function sendMessage() {
         console.error('发送消息时出错:', error);
     } finally {
         // 重置处理状态
+        currentJobId = null;
         isProcessing = false;
         sendBtn.disabled = false;
         userInput.focus();
@@ -192,6 +174,211 @@ async function sendMessage() {
     }
 }
 
+// 按行读取NDJSON响应流（一个数据块可能包含多行或半行），对每个非空行调用 onLine
+async function readNdjsonStream(response, onLine) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        
+        buffer += decoder.decode(value, { stream: true });
+        const lines = buffer.split('\n');
+        buffer = lines.pop();
+        
+        for (const line of lines) {
+            if (line.trim()) {
+                onLine(line);
+            }
+        }
+    }
+    
+    // 处理最后一行没有换行符的数据
+    if (buffer.trim()) {
+        onLine(buffer);
+    }
+}
+
+// 跟随任务事件流直到任务结束，连接中断时从已收到的位置重新连接
+async function followJob(jobId, state) {
+    let received = 0;
+    let attempts = 0;
+    
+    while (true) {
+        let finished = false;
+        const receivedBefore = received;
+        try {
+            const response = await fetch(`/api/jobs/${jobId}/events?since=${received}`);
+            if (!response.ok) {
+                const data = await response.json();
+                throw new Error(data.error || '获取任务进度失败');
+            }
+            
+            await readNdjsonStream(response, line => {
+                let data = null;
+                try {
+                    data = JSON.parse(line);
+                } catch (e) {
+                    // 交给 handleStreamEvent 报告解析错误
+                }
+                if (data && data.type === 'job_status') {
+                    finished = true;
+                    return;
+                }
+                received++;
+                handleStreamEvent(line, state);
+            });
+            if (!finished) {
+                throw new Error('任务事件流意外结束');
+            }
+        } catch (error) {
+            // 本次连接收到过新事件时重新计算重连次数
+            attempts = received > receivedBefore ? 1 : attempts + 1;
+            if (attempts > JOB_MAX_RECONNECTS) {
+                throw error;
+            }
+            console.warn('任务事件流中断，正在重新连接:', error);
+            await new Promise(resolve => setTimeout(resolve, 1000 * attempts));
+        }
+        
+        if (finished) {
+            return;
+        }
+    }
+}
+
+// 移除加载指示器
+function removeLoadingIndicator(state) {
+    if (state.loadingElement) {
+        state.loadingElement.remove();
+        state.loadingElement = null;
+        if (searchAnimation) {
+            searchAnimation.destroy();
+            searchAnimation = null;
+        }
+    }
+    if (window.searchUpdateTimer) {
+        clearInterval(window.searchUpdateTimer);
+        window.searchUpdateTimer = null;
+    }
+}
+
+// 创建一条正在生成中的机器人消息
+function createStreamingMessage() {
+    const messageDiv = document.createElement('div');
+    messageDiv.className = 'message bot-message';
+    
+    const avatarDiv = document.createElement('div');
+    avatarDiv.className = 'message-avatar';
+    const avatarImg = document.createElement('img');
+    avatarImg.src = '/static/images/bot-avatar.png';
+    avatarImg.alt = 'DeepSeek';
+    avatarDiv.appendChild(avatarImg);
+    
+    const contentDiv = document.createElement('div');
+    contentDiv.className = 'message-content';
+    
+    if (enableWebSearch) {
+        const searchBadge = document.createElement('div');
+        searchBadge.className = 'search-badge';
+        searchBadge.textContent = '联网搜索';
+        contentDiv.appendChild(searchBadge);
+    }
+    
+    const thinkDiv = document.createElement('div');
+    thinkDiv.className = 'thinking-process';
+    thinkDiv.style.display = 'none';
+    contentDiv.appendChild(thinkDiv);
+    
+    const answerDiv = document.createElement('div');
+    contentDiv.appendChild(answerDiv);
+    
+    messageDiv.appendChild(avatarDiv);
+    messageDiv.appendChild(contentDiv);
+    chatContainer.appendChild(messageDiv);
+    
+    return { element: messageDiv, thinkDiv: thinkDiv, answerDiv: answerDiv, think: '', answer: '', renderScheduled: false };
+}
+
+// 把新的模型输出片段追加到正在生成的消息中
+function appendStreamingToken(live, channel, text) {
+    if (channel === 'think') {
+        live.think += text;
+    } else {
+        live.answer += text;
+    }
+    
+    // 合并同一帧内的多次更新，避免每个片段都重新解析Markdown
+    if (live.renderScheduled) {
+        return;
+    }
+    live.renderScheduled = true;
+    requestAnimationFrame(() => {
+        live.renderScheduled = false;
+        if (live.think) {
+            live.thinkDiv.style.display = '';
+            live.thinkDiv.textContent = live.think.trim();
+        }
+        live.answerDiv.innerHTML = formatMessageContent(live.answer);
+        chatContainer.scrollTop = chatContainer.scrollHeight;
+    });
+}
+
+// 处理流式响应中的一条事件
+function handleStreamEvent(line, state) {
+    let data;
+    try {
+        data = JSON.parse(line);
+    } catch (e) {
+        // 如果不是JSON，可能是其他格式的响应
+        console.error('解析响应时出错:', e);
+        return;
+    }
+    
+    // 如果是搜索进度更新
+    if (data.type === 'search_progress' && data.title) {
+        // 收到真实的搜索进度后，停止模拟标题
+        if (window.searchUpdateTimer) {
+            clearInterval(window.searchUpdateTimer);
+            window.searchUpdateTimer = null;
+        }
+        updateSearchText(data.title);
+    } 
+    // 如果是模型输出片段
+    else if (data.type === 'token') {
+        if (!state.live) {
+            removeLoadingIndicator(state);
+            state.live = createStreamingMessage();
+        }
+        appendStreamingToken(state.live, data.channel, data.text);
+    }
+    // 如果是最终回复
+    else if (data.type === 'final_response') {
+        // 移除加载指示器和生成中的消息，用完整回复替换
+        removeLoadingIndicator(state);
+        if (state.live) {
+            state.live.element.remove();
+            state.live = null;
+        }
+        
+        // 添加机器人回复
+        addMessage(data.response, 'bot', data.has_search_results);
+        
+        // 更新当前会话ID
+        if (data.conversation_id) {
+            currentConversationId = data.conversation_id;
+            updateHistoryList();
+        }
+    }
+    // 如果是错误
+    else if (data.type === 'error') {
+        removeLoadingIndicator(state);
+        addErrorMessage(data.error || '服务器错误，请稍后再试');
+    }
+}
+
 // 更新搜索文本
 function updateSearchText(title) {
     const searchTextElement = document.getElementById('search-text-content');
@@ -200,8 +387,8 @@ function updateSearchText(title) {
     }
 }
 
-// 添加消息到聊天界面
-function addMessage(content, sender, hasSearchResults = false) {
+// 添加消息到聊天界面（beforeElement 不为空时插入到该元素之前，并且不滚动）
+function addMessage(content, sender, hasSearchResults = false, beforeElement = null) {
     const messageDiv = document.createElement('div');
     messageDiv.className = `message ${sender}-message`;
     
@@ -257,10 +444,16 @@ function addMessage(content, sender, hasSearchResults = false) {
     messageDiv.appendChild(avatarDiv);
     messageDiv.appendChild(contentDiv);
     
+    if (beforeElement) {
+        chatContainer.insertBefore(messageDiv, beforeElement);
+        return messageDiv;
+    }
+    
     chatContainer.appendChild(messageDiv);
     
     // 滚动到最新消息
     chatContainer.scrollTop = chatContainer.scrollHeight;
+    return messageDiv;
 }
 
 // 格式化思考内容
@@ -501,8 +694,25 @@ function autoResizeTextarea() {
     userInput.style.height = (userInput.scrollHeight) + 'px';
 }
 
+// 取消正在进行的对话任务；页面关闭时用 sendBeacon 保证请求能发出
+function cancelCurrentJob(useBeacon) {
+    if (!currentJobId) {
+        return;
+    }
+    const url = `/api/jobs/${currentJobId}/cancel`;
+    if (useBeacon && navigator.sendBeacon) {
+        navigator.sendBeacon(url);
+        return;
+    }
+    fetch(url, { method: 'POST', keepalive: true }).catch(error => {
+        console.error('取消任务时出错:', error);
+    });
+}
+
 // 创建新会话
 async function createNewChat() {
+    // 旧会话中尚未完成的回答不再需要
+    cancelCurrentJob(false);
     try {
         const response = await fetch('/api/new');
         const data = await response.json();
@@ -529,7 +739,85 @@ async function createNewChat() {
     }
 }
 
-// 加载会话历史
+// 获取一页会话记录（从新到旧，不包含搜索结果）
+async function fetchTranscriptPage(conversationId, before) {
+    let url = `/api/history/${conversationId}?limit=${TRANSCRIPT_PAGE_SIZE}&include_search=0`;
+    if (before !== null && before !== undefined) {
+        url += `&before=${before}`;
+    }
+    const response = await fetch(url);
+    return response.json();
+}
+
+// 渲染一页会话记录，插入到 anchor 之前（anchor 为空时追加到末尾）
+function renderTranscriptTurns(conversationId, turns, anchor) {
+    turns.forEach(item => {
+        addMessage(item.user, 'user', false, anchor);
+        const botDiv = addMessage(item.bot, 'bot', item.has_search_results, anchor);
+        if (item.has_search_results) {
+            attachSearchResultsLoader(botDiv, conversationId, item.index);
+        }
+    });
+}
+
+// 点击“联网搜索”标记时再加载该轮的搜索结果
+function attachSearchResultsLoader(messageDiv, conversationId, index) {
+    const badge = messageDiv.querySelector('.search-badge');
+    if (!badge) {
+        return;
+    }
+    badge.style.cursor = 'pointer';
+    badge.title = '查看搜索结果';
+    badge.addEventListener('click', async () => {
+        const existing = messageDiv.querySelector('.search-results-detail');
+        if (existing) {
+            existing.remove();
+            return;
+        }
+        try {
+            const response = await fetch(`/api/history/${conversationId}/turns/${index}/search_results`);
+            const data = await response.json();
+            const detail = document.createElement('pre');
+            detail.className = 'search-results-detail';
+            detail.textContent = typeof data.search_results === 'string'
+                ? data.search_results.trim()
+                : JSON.stringify(data.search_results, null, 2);
+            badge.after(detail);
+        } catch (error) {
+            console.error('加载搜索结果时出错:', error);
+        }
+    });
+}
+
+// 在会话顶部显示“加载更早的消息”按钮
+function addLoadEarlierButton(conversationId, cursor) {
+    const button = document.createElement('button');
+    button.className = 'load-earlier-btn';
+    button.textContent = '加载更早的消息';
+    // 插入到欢迎消息之后
+    chatContainer.insertBefore(button, chatContainer.children[1] || null);
+    
+    button.addEventListener('click', async () => {
+        button.disabled = true;
+        try {
+            const page = await fetchTranscriptPage(conversationId, cursor);
+            const anchor = button.nextSibling;
+            const previousHeight = chatContainer.scrollHeight;
+            button.remove();
+            renderTranscriptTurns(conversationId, page.turns, anchor);
+            // 保持当前阅读位置不跳动
+            chatContainer.scrollTop += chatContainer.scrollHeight - previousHeight;
+            if (page.next_cursor !== null) {
+                addLoadEarlierButton(conversationId, page.next_cursor);
+            }
+        } catch (error) {
+            button.disabled = false;
+            console.error('加载更早的消息时出错:', error);
+        }
+    });
+}
+
+// 加载会话历史（只加载最近一页，更早的消息按需加载）
 async function loadConversation(conversationId) {
     if (isProcessing) {
         return;
@@ -537,20 +825,19 @@ async function loadConversation(conversationId) {
     
     try {
         // 获取会话历史
-        const response = await fetch(`/api/history/${conversationId}`);
-        const history = await response.json();
+        const page = await fetchTranscriptPage(conversationId, null);
         
-        if (history.length > 0) {
+        if (page.turns && page.turns.length > 0) {
             // 清空聊天界面，保留欢迎消息
             while (chatContainer.childElementCount > 1) {
                 chatContainer.removeChild(chatContainer.lastChild);
             }
             
             // 加载历史消息
-            history.forEach(item => {
-                addMessage(item.user, 'user');
-                addMessage(item.bot, 'bot', item.search_results ? true : false);
-            });
+            renderTranscriptTurns(conversationId, page.turns, null);
+            if (page.next_cursor !== null) {
+                addLoadEarlierButton(conversationId, page.next_cursor);
+            }
             
             // 更新当前会话ID
             currentConversationId = conversationId;
@@ -568,42 +855,73 @@ async function loadConversation(conversationId) {
     }
 }
 
-// 更新历史列表
+// 获取一页历史会话
+async function fetchHistoryPage(offset) {
+    const response = await fetch(`/api/history?offset=${offset}&limit=${HISTORY_PAGE_SIZE}`);
+    return response.json();
+}
+
+// 把历史会话添加到列表末尾
+function appendHistoryItems(conversations) {
+    conversations.forEach(conv => {
+        const historyItem = document.createElement('div');
+        historyItem.className = 'history-item';
+        historyItem.dataset.id = conv.id;
+        
+        if (conv.id === currentConversationId) {
+            historyItem.classList.add('active');
+        }
+        
+        historyItem.innerHTML = `
+            <i class="fas fa-comments"></i>
+            <span class="history-title">${conv.title}</span>
+            <span class="history-date">${conv.timestamp ? conv.timestamp.split(' ')[0] : ''}</span>
+        `;
+        
+        historyItem.addEventListener('click', () => {
+            loadConversation(conv.id);
+        });
+        
+        historyList.appendChild(historyItem);
+    });
+    
+    historyOffset += conversations.length;
+    historyExhausted = conversations.length < HISTORY_PAGE_SIZE;
+}
+
+// 更新历史列表（重新加载第一页）
 async function updateHistoryList() {
     try {
-        const response = await fetch('/api/history');
-        const conversations = await response.json();
+        const conversations = await fetchHistoryPage(0);
         
         // 清空历史列表
         historyList.innerHTML = '';
+        historyOffset = 0;
         
         // 添加历史会话
-        conversations.forEach(conv => {
-            const historyItem = document.createElement('div');
-            historyItem.className = 'history-item';
-            historyItem.dataset.id = conv.id;
-            
-            if (conv.id === currentConversationId) {
-                historyItem.classList.add('active');
-            }
-            
-            historyItem.innerHTML = `
-                <i class="fas fa-comments"></i>
-                <span class="history-title">${conv.title}</span>
-                <span class="history-date">${conv.timestamp ? conv.timestamp.split(' ')[0] : ''}</span>
-            `;
-            
-            historyItem.addEventListener('click', () => {
-                loadConversation(conv.id);
-            });
-            
-            historyList.appendChild(historyItem);
-        });
+        appendHistoryItems(conversations);
     } catch (error) {
         console.error('更新历史列表时出错:', error);
     }
 }
 
+// 加载下一页历史会话
+async function loadMoreHistory() {
+    if (historyLoading || historyExhausted) {
+        return;
+    }
+    
+    historyLoading = true;
+    try {
+        const conversations = await fetchHistoryPage(historyOffset);
+        appendHistoryItems(conversations);
+    } catch (error) {
+        console.error('加载更多历史会话时出错:', error);
+    } finally {
+        historyLoading = false;
+    }
+}
+
 // 更新活动历史项
 function updateActiveHistoryItem(conversationId) {
     // 移除所有活动状态
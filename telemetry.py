@@ -0,0 +1,166 @@
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+
+# --- 配置 ---
+# 指标名称前缀
+METRIC_PREFIX = "deepseek"
+# 耗时直方图的分桶上界（秒）
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+# 当前请求的追踪记录；后台任务线程和提取正文的线程池通过 contextvars 传递
+_current_trace = contextvars.ContextVar("trace", default=None)
+
+
+class Histogram:
+    """固定分桶的耗时直方图"""
+
+    def __init__(self, buckets=DURATION_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # 最后一个桶为 +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Trace:
+    """一次请求中各阶段的耗时记录，可随 NDJSON 流返回给客户端"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add(self, stage, started, seconds, error=None):
+        span = {
+            "stage": stage,
+            "start_ms": round((started - self.started) * 1000, 1),
+            "duration_ms": round(seconds * 1000, 1),
+        }
+        if error:
+            span["error"] = error
+        with self._lock:
+            self.spans.append(span)
+
+    def to_list(self):
+        with self._lock:
+            return sorted(self.spans, key=lambda span: span["start_ms"])
+
+
+class Telemetry:
+    """
+    按阶段汇总耗时直方图，并在导出时收集各模块的计数器
+
+    计数器以回调注册，导出时调用，各模块无需改为上报数值。
+    """
+
+    def __init__(self):
+        self._histograms = {}
+        self._collectors = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            histogram = self._histograms.get(stage)
+            if histogram is None:
+                histogram = self._histograms[stage] = Histogram()
+            histogram.observe(seconds)
+
+    def record(self, stage, started, seconds, error=None):
+        """记录一个已结束的阶段：计入直方图，并写入当前请求的追踪记录"""
+        self.observe(stage, seconds)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add(stage, started, seconds, error)
+
+    @contextmanager
+    def span(self, stage):
+        """统计 with 块的耗时"""
+        started = time.perf_counter()
+        error = None
+        try:
+            yield
+        except BaseException as e:
+            error = type(e).__name__
+            raise
+        finally:
+            self.record(stage, started, time.perf_counter() - started, error)
+
+    def register(self, name, collector):
+        """
+        注册计数器回调
+
+        Args:
+            name: 指标名称的一部分，如 driver_pool
+            collector: 无参函数，返回 {字段: 数值}；非数值字段在导出时忽略
+        """
+        self._collectors[name] = collector
+
+    def render_prometheus(self):
+        """以 Prometheus 文本格式导出全部指标"""
+        name = f"{METRIC_PREFIX}_stage_duration_seconds"
+        lines = [
+            f"# HELP {name} 各阶段耗时",
+            f"# TYPE {name} histogram",
+        ]
+        with self._lock:
+            for stage in sorted(self._histograms):
+                histogram = self._histograms[stage]
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                lines.append(f'{name}_bucket{{stage="{stage}",le="+Inf"}} {histogram.count}')
+                lines.append(f'{name}_sum{{stage="{stage}"}} {histogram.sum:.6f}')
+                lines.append(f'{name}_count{{stage="{stage}"}} {histogram.count}')
+
+        for collector_name, collector in sorted(self._collectors.items()):
+            try:
+                values = collector()
+            except Exception as e:
+                print(f"收集指标 {collector_name} 失败: {e}")
+                continue
+            for field, value in sorted(values.items()):
+                if isinstance(value, bool):
+                    value = int(value)
+                if not isinstance(value, (int, float)):
+                    continue
+                metric = f"{METRIC_PREFIX}_{collector_name}_{field}"
+                lines.append(f"# TYPE {metric} gauge")
+                lines.append(f"{metric} {value}")
+        return "\n".join(lines) + "\n"
+
+
+telemetry = Telemetry()
+span = telemetry.span
+record = telemetry.record
+
+
+def start_trace():
+    """
+    为当前请求开始记录追踪
+
+    Returns:
+        tuple: (trace, token)，结束时调用 end_trace(token)
+    """
+    trace = Trace()
+    return trace, _current_trace.set(trace)
+
+
+def end_trace(token):
+    _current_trace.reset(token)
+
+
+def run_in_context(executor, fn, *args):
+    """把任务提交到线程池，并带上当前的追踪上下文"""
+    return executor.submit(contextvars.copy_context().run, fn, *args)
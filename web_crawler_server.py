@@ -1,7 +1,9 @@
 import requests
 import json
 import re
+import os
 import selenium
+import threading
 import time
 # 导入 bs4
 import bs4
@@ -11,19 +13,70 @@ from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.chrome.service import Service as ChromeService
-from selenium.common.exceptions import NoSuchElementException, TimeoutException
+from selenium.common.exceptions import NoSuchElementException, TimeoutException, WebDriverException
 from urllib.parse import urljoin # 用于处理相对 URL
 
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from driver_pool import DriverPool
+from telemetry import span, record, run_in_context
+from requests.compat import chardet
+from cancellation import Cancelled, CancelToken, CANCEL_POLL_INTERVAL, bind, unbind, check_cancelled, current_token
+from crawl_profile import crawl_profiles, TransferCounter, enable_transfer_logging
+import atexit
+
 # --- 配置 ---
 # 设置浏览器驱动路径 (请确保路径正确)
-driver_path = r"D:\ChromeDriver\chromedriver-win64\chromedriver.exe"
+driver_path = os.getenv("CHROMEDRIVER_PATH", r"D:\ChromeDriver\chromedriver-win64\chromedriver.exe")
+# 搜索引擎地址，基准测试时可指向本地的替身服务
+SEARCH_BASE_URL = os.getenv("SEARCH_BASE_URL", "https://www.baidu.com")
 
-# --- 新增：获取搜索标题函数 ---
-def get_search_title(query):
+# --- 页面加载配置 ---
+# 页面加载策略：normal 等待所有资源，eager 在 DOM 就绪后返回，none 立即返回
+PAGE_LOAD_STRATEGY = os.getenv("PAGE_LOAD_STRATEGY", "eager")
+# 单个页面加载的最长时间（秒）
+PAGE_LOAD_TIMEOUT = float(os.getenv("PAGE_LOAD_TIMEOUT", "10"))
+# 搜索结果页、正文页等待就绪的最长时间（秒）
+PAGE_READY_TIMEOUT = float(os.getenv("PAGE_READY_TIMEOUT", "5"))
+# 一次搜索从开始到结束的总时间预算（秒），各阶段都从中扣除
+SEARCH_TIME_BUDGET = float(os.getenv("SEARCH_TIME_BUDGET", "30"))
+# 搜索结果容器，出现即可开始解析
+SERP_RESULT_SELECTOR = "div.result, div.c-container"
+# 页面加载完成时 document.readyState 的取值，与 PAGE_LOAD_STRATEGY 的含义一致
+LOAD_READY_STATES = {
+    "normal": ("complete",),
+    "eager": ("interactive", "complete"),
+    "none": ("loading", "interactive", "complete"),
+}.get(PAGE_LOAD_STRATEGY, ("interactive", "complete"))
+# 有入口限制单页传输量时，浏览器以 none 策略打开页面（driver.get() 立即返回），
+# 由 load_page() 按 PAGE_LOAD_STRATEGY 等待加载，期间持续检查传输量，超过上限时中途停止
+DRIVER_LOAD_STRATEGY = "none" if any(p.max_bytes for p in crawl_profiles.values()) else PAGE_LOAD_STRATEGY
+
+
+class TimeBudget:
     """
-    实时获取搜索过程中的页面标题
-    返回搜索结果页面标题列表
+    一次搜索的端到端时间预算
+
+    各阶段通过 limit() 取得本阶段可用的时间，不会超过剩余预算。
     """
+
+    def __init__(self, seconds=SEARCH_TIME_BUDGET):
+        self.seconds = seconds
+        self.end_time = time.monotonic() + seconds
+
+    def remaining(self):
+        """剩余时间（秒），不小于 0"""
+        return max(0.0, self.end_time - time.monotonic())
+
+    def expired(self):
+        return self.remaining() <= 0
+
+    def limit(self, seconds):
+        """本阶段可用时间：期望时长与剩余预算中的较小者"""
+        return min(seconds, self.remaining())
+
+# --- 浏览器实例池 ---
+def create_driver():
+    """创建一个新的无头 Chrome 实例，供浏览器池调用"""
     options = webdriver.ChromeOptions()
     options.add_argument("--headless")
     options.add_argument("--disable-gpu")
@@ -34,85 +87,408 @@ def get_search_title(query):
     options.add_experimental_option("useAutomationExtension", False)
     options.add_argument("--lang=zh-CN")
     options.add_argument('user-agent="Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"')
+    options.page_load_strategy = DRIVER_LOAD_STRATEGY
+    # 开启性能日志用于统计传输量，按配置关闭图片加载
+    enable_transfer_logging(options)
 
     service = ChromeService(executable_path=driver_path)
-    driver = webdriver.Chrome(service=service, options=options)
-    
+    return webdriver.Chrome(service=service, options=options)
+
+class _TransferCapped(Exception):
+    """页面传输量超过上限，停止等待"""
+
+
+def load_page(driver, url, budget=None, ready_selector=None, profile=None):
+    """
+    打开页面并等待其就绪，代替固定时长的 sleep
+
+    Args:
+        driver: 浏览器实例
+        url: 页面地址
+        budget: TimeBudget，为空时使用默认超时
+        ready_selector: 出现即视为就绪的 CSS 选择器；为空时等待 document.readyState
+        profile: 可选的 CrawlProfile，打开页面前设置请求屏蔽规则，
+                 等待期间传输量超过上限时停止加载，并记录传输量和加载耗时
+
+    Returns:
+        bool: 页面在时限内就绪返回 True；超时或超过传输上限返回 False，此时仍可读取已加载的部分
+
+    Raises:
+        Cancelled: 当前请求已取消，此时已停止页面加载
+    """
+    budget = budget or TimeBudget()
+    load_timeout = budget.limit(PAGE_LOAD_TIMEOUT)
+    if load_timeout <= 0:
+        raise TimeoutException("搜索时间预算已用完")
+    check_cancelled()
+
+    if profile is None:
+        return _load_page(driver, url, budget, load_timeout, ready_selector)
+
+    profile.apply(driver)
+    transfer = TransferCounter(driver)
+    transfer.reset()
+    started = time.perf_counter()
+    capped = False
     try:
-        # 初始化标题列表，先添加查询标题
-        titles = [f"{query}_百度搜索"]
-        
-        # 访问百度搜索页面
-        base_url = "https://www.baidu.com"
-        search_url = f"{base_url}/s?wd={query}"
-        driver.get(search_url)
-        
-        # 等待页面加载
-        time.sleep(2)
-        
-        # 添加当前页面标题
-        page_title = driver.title.strip()
-        if page_title and page_title not in titles:
-            titles.append(page_title)
-        
-        # 从搜索结果中获取链接
-        soup = BeautifulSoup(driver.page_source, 'html.parser')
-        search_results = soup.select('div.result h3 a, div.c-container h3 a')
-        
-        # 限制链接数量，避免处理时间过长
-        max_links = 3
-        links = []
-        
-        for i, result in enumerate(search_results):
-            if i >= max_links:
-                break
-                
-            # 获取链接
-            href = result.get('href')
-            if href and href.startswith('http'):
-                # 排除广告链接
-                if not re.search(r'(广告|推广|baidu\.com/link)', href, re.I):
-                    links.append(href)
-        
-        # 依次访问链接并获取标题
-        for link in links:
-            try:
-                driver.get(link)
-                # 等待页面加载
-                time.sleep(2)
-                
-                # 获取并添加标题
-                link_title = driver.title.strip()
-                if link_title and link_title not in titles:
-                    titles.append(link_title)
-            except Exception as e:
-                print(f"访问链接时出错: {e}")
-                continue
-        
-        return titles
+        return _load_page(driver, url, budget, load_timeout, ready_selector, profile, transfer)
+    except _TransferCapped:
+        capped = True
+        print(f"页面传输量超过 {profile.max_bytes} 字节，停止加载并使用已加载的内容: {url}")
+        driver.execute_script("window.stop();")
+        return False
+    finally:
+        seconds = time.perf_counter() - started
+        transfer.poll()
+        profile.observe(transfer, seconds, capped)
+        record(f"page_load_{profile.name}", started, seconds)
+
+def _load_page(driver, url, budget, load_timeout, ready_selector, profile=None, transfer=None):
+    max_bytes = profile.max_bytes if profile else 0
+
+    def guarded(condition):
+        def check(d):
+            # 每次轮询前检查取消请求和传输量，这两种异常都不在 WebDriverWait 忽略的异常之列，会直接抛出
+            check_cancelled()
+            if max_bytes and transfer.poll() > max_bytes:
+                raise _TransferCapped()
+            return condition(d)
+        return check
+
+    def wait_until(timeout, condition):
+        # 新页面尚未提交时执行脚本可能报错，忽略后继续轮询
+        WebDriverWait(driver, timeout, poll_frequency=CANCEL_POLL_INTERVAL,
+                      ignored_exceptions=(WebDriverException,)).until(guarded(condition))
+
+    # 在当前页面上做标记，新页面的 window 上没有该标记，据此区分新旧页面
+    try:
+        driver.execute_script("window.__crawlPrevious = true;")
+    except WebDriverException:
+        pass
+    driver.set_page_load_timeout(max(1, int(load_timeout)))
+    try:
+        try:
+            # none 策略下立即返回，其他策略下等到页面按策略加载完成
+            driver.get(url)
+        except TimeoutException:
+            # 页面加载超时，停止加载并使用已有内容
+            print(f"页面加载超时，使用已加载的内容: {url}")
+            driver.execute_script("window.stop();")
+            return False
+
+        loaded = lambda d: d.execute_script("return window.__crawlPrevious ? null : document.readyState") in LOAD_READY_STATES
+        try:
+            wait_until(load_timeout, loaded)
+        except TimeoutException:
+            print(f"页面加载超时，使用已加载的内容: {url}")
+            driver.execute_script("window.stop();")
+            return False
+
+        wait_timeout = budget.limit(PAGE_READY_TIMEOUT)
+        if wait_timeout <= 0:
+            return False
+        if ready_selector:
+            condition = EC.presence_of_element_located((By.CSS_SELECTOR, ready_selector))
+        else:
+            condition = lambda d: d.execute_script("return document.readyState") in ("interactive", "complete")
+        try:
+            wait_until(wait_timeout, condition)
+            return True
+        except TimeoutException:
+            return False
+    except Cancelled:
+        # 停止仍在进行的加载，浏览器归还给浏览器池后可以立即复用
+        driver.execute_script("window.stop();")
+        raise
+
+# 所有爬虫入口共享同一个浏览器池，避免每次请求都冷启动 Chrome
+driver_pool = DriverPool(create_driver)
+atexit.register(driver_pool.close)
+
+# --- 正文并发提取配置 ---
+# 同时提取正文的线程数
+CONTENT_FETCH_WORKERS = int(os.getenv("CONTENT_FETCH_WORKERS", "4"))
+# 单个页面提取正文的超时时间（秒）
+CONTENT_FETCH_TIMEOUT = float(os.getenv("CONTENT_FETCH_TIMEOUT", "15"))
+# 整个正文提取阶段的总时限（秒）
+CONTENT_FETCH_DEADLINE = float(os.getenv("CONTENT_FETCH_DEADLINE", "25"))
+# 提取失败时返回的占位文本
+FETCH_FAILED_TEXT = "无法获取文本内容"
+
+# --- 正文分级提取配置 ---
+# 普通 HTTP 请求的超时时间（秒）
+HTTP_FETCH_TIMEOUT = float(os.getenv("HTTP_FETCH_TIMEOUT", "8"))
+# HTTP 方式提取到的正文少于该长度时，认为页面依赖 JS 渲染，改用浏览器
+MIN_HTTP_TEXT_LENGTH = int(os.getenv("MIN_HTTP_TEXT_LENGTH", "200"))
+# 分块读取页面时每块的字节数，每块之间检查一次取消请求
+HTTP_CHUNK_SIZE = 64 * 1024
+HTTP_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+    "Accept-Language": "zh-CN,zh;q=0.9,en;q=0.8",
+}
+
+# 提取正文时优先查找的主要内容区域
+MAIN_CONTENT_SELECTORS = [
+    'article', 'main', 
+    'div.content', 'div.main', 'div.article', 'div.post',
+    '#content', '#main', '#article', '#post',
+    '.article-content', '.post-content', '.entry-content',
+    '.blog-post'
+]
+# 提取正文前需要移除的元素
+NOISE_TAGS = ['script', 'style', 'nav', 'footer', 'header']
+
+# 复用连接的 HTTP 会话，多个线程共享同一个连接池
+http_session = requests.Session()
+http_session.headers.update(HTTP_HEADERS)
+_http_adapter = requests.adapters.HTTPAdapter(pool_connections=16, pool_maxsize=CONTENT_FETCH_WORKERS * 2)
+http_session.mount("http://", _http_adapter)
+http_session.mount("https://", _http_adapter)
+
+# 各级提取方式的命中次数
+fetch_stats = {"http": 0, "selenium": 0, "failed": 0}
+fetch_stats_lock = threading.Lock()
+
+# --- 新增：获取搜索标题函数 ---
+def get_search_title(query, budget=None):
+    """
+    实时获取搜索过程中的页面标题
+    返回搜索结果页面标题列表
+    """
+    budget = budget or TimeBudget()
+    try:
+        with driver_pool.lease(timeout=budget.remaining()) as driver:
+            return _collect_titles(driver, query, budget)
+    except Cancelled:
+        raise
     except Exception as e:
         print(f"获取搜索标题时出错: {e}")
         # 返回默认标题
         return [f"{query}_搜索结果", f"{query} - 百度百科", f"关于{query}的信息"]
-    finally:
-        if driver:
-            driver.quit()
+
+def _collect_titles(driver, query, budget):
+    """在给定浏览器中访问百度搜索页及前几条结果，收集页面标题"""
+    # 初始化标题列表，先添加查询标题
+    titles = [f"{query}_百度搜索"]
+    
+    # 访问百度搜索页面
+    base_url = SEARCH_BASE_URL
+    search_url = f"{base_url}/s?wd={query}"
+    load_page(driver, search_url, budget, SERP_RESULT_SELECTOR, crawl_profiles["titles"])
+    
+    # 添加当前页面标题
+    page_title = driver.title.strip()
+    if page_title and page_title not in titles:
+        titles.append(page_title)
+    
+    # 从搜索结果中获取链接
+    soup = BeautifulSoup(driver.page_source, 'html.parser')
+    search_results = soup.select('div.result h3 a, div.c-container h3 a')
+    
+    # 限制链接数量，避免处理时间过长
+    max_links = 3
+    links = []
+    
+    for i, result in enumerate(search_results):
+        if i >= max_links:
+            break
+            
+        # 获取链接
+        href = result.get('href')
+        if href and href.startswith('http'):
+            # 排除广告链接
+            if not re.search(r'(广告|推广|baidu\.com/link)', href, re.I):
+                links.append(href)
+    
+    # 依次访问链接并获取标题
+    for link in links:
+        check_cancelled()
+        if budget.expired():
+            print("搜索时间预算已用完，停止访问结果页面")
+            break
+        try:
+            load_page(driver, link, budget, profile=crawl_profiles["titles"])
+            
+            # 获取并添加标题
+            link_title = driver.title.strip()
+            if link_title and link_title not in titles:
+                titles.append(link_title)
+        except Cancelled:
+            raise
+        except Exception as e:
+            print(f"访问链接时出错: {e}")
+            continue
+    
+    return titles
 
 # --- 新增：获取页面正文内容的函数 ---
-def get_full_content(url):
+def get_full_content(url, budget=None):
     """
     尝试访问给定 URL 并提取主要文本内容。
 
+    先用普通 HTTP 请求获取页面，只有在页面为空、乱码或依赖 JS 渲染时才改用浏览器。
+
     Args:
         url (str): 要访问的网页 URL。
+        budget (TimeBudget): 可选的时间预算。
 
     Returns:
         str: 提取到的主要文本内容，如果失败则返回 None。
     """
+    check_cancelled()
     print(f"正在尝试获取正文内容: {url}")
-    
-    # 直接使用 Selenium 提取文本内容，以避免编码问题
-    return extract_text_with_selenium(url)
+    budget = budget or TimeBudget()
+
+    with span("fetch_content"):
+        with span("fetch_http"):
+            content = extract_text_with_requests(url, budget)
+        if content:
+            _count_fetch("http")
+            return content
+
+        # HTTP 方式无法得到可用正文，再使用 Selenium 渲染页面
+        check_cancelled()
+        if budget.expired():
+            _count_fetch("failed")
+            return None
+        with span("fetch_selenium"):
+            content = extract_text_with_selenium(url, budget)
+        if content and content != FETCH_FAILED_TEXT:
+            _count_fetch("selenium")
+            return content
+
+        _count_fetch("failed")
+        return None
+
+def _count_fetch(tier):
+    with fetch_stats_lock:
+        fetch_stats[tier] += 1
+
+def get_fetch_stats():
+    """
+    返回各级正文提取方式的命中次数与命中率
+
+    Returns:
+        dict: 例如 {"http": 8, "selenium": 2, "failed": 0, "total": 10, "http_rate": 0.8, ...}
+    """
+    with fetch_stats_lock:
+        stats = dict(fetch_stats)
+    total = sum(stats.values())
+    stats["total"] = total
+    for tier in ("http", "selenium", "failed"):
+        stats[f"{tier}_rate"] = stats[tier] / total if total else 0.0
+    return stats
+
+def _detect_encoding(response, body):
+    """
+    确定页面编码：HTTP 头 > 页面 meta 声明 > 根据内容猜测
+    """
+    content_type = response.headers.get("Content-Type", "")
+    if "charset=" in content_type.lower():
+        return response.encoding
+
+    # requests 对未声明编码的 text/html 默认使用 ISO-8859-1，需要从页面本身判断
+    head = body[:4096].decode("ascii", errors="ignore")
+    match = re.search(r'<meta[^>]+charset=["\']?\s*([\w-]+)', head, re.I)
+    if match:
+        encoding = match.group(1).lower()
+        # gb2312 声明的页面常常包含 gbk 字符
+        return "gb18030" if encoding in ("gb2312", "gbk") else encoding
+
+    return chardet.detect(body)["encoding"] or "utf-8"
+
+def _read_body(response):
+    """
+    分块读取响应内容，每块之间检查取消请求；被取消时关闭连接
+
+    Raises:
+        Cancelled: 当前请求（或本页面的提取任务）已取消
+    """
+    chunks = []
+    try:
+        for chunk in response.iter_content(chunk_size=HTTP_CHUNK_SIZE):
+            check_cancelled()
+            chunks.append(chunk)
+    except Cancelled:
+        response.close()
+        raise
+    return b"".join(chunks)
+
+def extract_main_text(html):
+    """
+    从 HTML 源码中提取主要文本内容
+
+    Args:
+        html: 页面 HTML 源码
+
+    Returns:
+        str: 主要内容区域的文本，找不到时返回整个 body 的文本
+    """
+    soup = BeautifulSoup(html, 'html.parser')
+    for element in soup(NOISE_TAGS):
+        element.decompose()
+
+    for selector in MAIN_CONTENT_SELECTORS:
+        main_element = soup.select_one(selector)
+        if main_element:
+            content = main_element.get_text(separator="\n", strip=True)
+            if content and len(content) > 100:  # 确保有足够内容
+                return content
+
+    body = soup.body or soup
+    return body.get_text(separator="\n", strip=True)
+
+# 使用普通 HTTP 请求提取文本（不需要浏览器）
+def extract_text_with_requests(url, budget=None):
+    """
+    使用 HTTP 请求获取页面并提取正文，适用于服务端渲染的页面
+
+    Returns:
+        str: 可读的正文内容；页面为空、乱码或需要 JS 渲染时返回 None
+    """
+    try:
+        timeout = budget.limit(HTTP_FETCH_TIMEOUT) if budget else HTTP_FETCH_TIMEOUT
+        if timeout <= 0:
+            return None
+        # 分块读取正文，提取任务被取消时可以中途关闭连接
+        response = http_session.get(url, timeout=timeout, stream=True)
+        response.raise_for_status()
+    except Exception as e:
+        print(f"HTTP 请求页面失败: {e}")
+        return None
+
+    content_type = response.headers.get("Content-Type", "")
+    if content_type and "html" not in content_type.lower():
+        response.close()
+        return None
+
+    try:
+        body = _read_body(response)
+    except Cancelled:
+        raise
+    except Exception as e:
+        print(f"HTTP 读取页面失败: {e}")
+        return None
+
+    try:
+        encoding = _detect_encoding(response, body)
+        try:
+            html = body.decode(encoding, errors="replace")
+        except LookupError:
+            html = body.decode("utf-8", errors="replace")
+        content = extract_main_text(html)
+    except Exception as e:
+        print(f"解析页面内容时出错: {e}")
+        return None
+
+    if len(content) < MIN_HTTP_TEXT_LENGTH:
+        print("HTTP 方式获取的正文过短，页面可能依赖 JS 渲染")
+        return None
+    if not is_readable_text(content):
+        print("HTTP 方式获取的正文疑似乱码")
+        return None
+    return content
 
 # 检查文本是否可读（非乱码）
 def is_readable_text(text, threshold=0.3):
@@ -133,105 +509,243 @@ def is_readable_text(text, threshold=0.3):
     if 'ï¿½' in text or 'â€' in text or 'ã€' in text:
         return False
     
-    # 计算不可打印字符比例
-    special_chars = sum(1 for c in text if not c.isprintable() or ord(c) > 127)
+    # 替换字符说明解码失败
+    if text.count('\ufffd') > len(text) * 0.01:
+        return False
+    
+    # 计算不可打印字符比例（中日韩文字和全角标点视为正常字符）
+    special_chars = sum(1 for c in text if not (c.isprintable() or c.isspace()) or (ord(c) > 127 and not _is_cjk(c)))
     if len(text) > 0 and special_chars / len(text) > threshold:
         return False
     
     return True
 
+def _is_cjk(char):
+    """判断字符是否为中日韩文字（含日文假名、韩文音节）或全角标点"""
+    code = ord(char)
+    return (0x4E00 <= code <= 0x9FFF or 0x3400 <= code <= 0x4DBF
+            or 0x3040 <= code <= 0x30FF or 0xAC00 <= code <= 0xD7AF
+            or 0x3000 <= code <= 0x303F or 0xFF00 <= code <= 0xFFEF
+            or 0x2000 <= code <= 0x206F)
+
 # 使用Selenium直接提取文本(处理乱码情况)
-def extract_text_with_selenium(url):
+def extract_text_with_selenium(url, budget=None):
     """
     使用Selenium直接访问页面并提取文本，避免编码问题
     """
     print("使用Selenium直接提取文本内容...")
-    options = webdriver.ChromeOptions()
-    options.add_argument("--headless")
-    options.add_argument("--disable-gpu")
-    options.add_argument("--log-level=3")
-    options.add_argument('user-agent="Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"')
-
+    budget = budget or TimeBudget()
     try:
-        service = ChromeService(executable_path=driver_path)
-        driver = webdriver.Chrome(service=service, options=options)
-        driver.get(url)
-        time.sleep(3)  # 等待页面加载
-        
-        # 移除不需要的元素
-        for element_type in ['script', 'style', 'nav', 'footer', 'header']:
-            elements = driver.find_elements(By.TAG_NAME, element_type)
-            for element in elements:
-                driver.execute_script("arguments[0].remove()", element)
-        
-        # 尝试查找主要内容区域
-        main_selectors = [
-            'article', 'main', 
-            'div.content', 'div.main', 'div.article', 'div.post',
-            '#content', '#main', '#article', '#post',
-            '.article-content', '.post-content', '.entry-content',
-            '.blog-post'
-        ]
-        
-        for selector in main_selectors:
-            try:
-                main_element = driver.find_element(By.CSS_SELECTOR, selector)
-                content = main_element.text
-                if content and len(content) > 100:  # 确保有足够内容
-                    driver.quit()
-                    return content
-            except:
-                continue
-        
-        # 如果找不到特定容器，获取body文本
-        body = driver.find_element(By.TAG_NAME, 'body')
-        content = body.text
-        driver.quit()
-        return content
+        with driver_pool.lease(timeout=budget.remaining()) as driver:
+            load_page(driver, url, budget, profile=crawl_profiles["extract"])
+            
+            # 移除不需要的元素
+            for element_type in NOISE_TAGS:
+                elements = driver.find_elements(By.TAG_NAME, element_type)
+                for element in elements:
+                    driver.execute_script("arguments[0].remove()", element)
+            
+            # 尝试查找主要内容区域
+            for selector in MAIN_CONTENT_SELECTORS:
+                try:
+                    main_element = driver.find_element(By.CSS_SELECTOR, selector)
+                    content = main_element.text
+                    if content and len(content) > 100:  # 确保有足够内容
+                        return content
+                except:
+                    continue
+            
+            # 如果找不到特定容器，获取body文本
+            body = driver.find_element(By.TAG_NAME, 'body')
+            return body.text
         
+    except Cancelled:
+        raise
     except Exception as e:
         print(f"使用Selenium提取文本时出错: {e}")
-        if 'driver' in locals():
-            driver.quit()
-        return "无法获取文本内容"
+        return FETCH_FAILED_TEXT
+
+
+# --- 并发提取多个页面的正文 ---
+def fetch_contents(urls, max_content, timeout=CONTENT_FETCH_TIMEOUT, deadline=CONTENT_FETCH_DEADLINE, budget=None):
+    """
+    并发提取多个页面的正文，按搜索结果顺序保留前 max_content 篇成功的正文
+
+    参数与返回值同 iter_fetch_contents()，但不产生中间进度。
+    """
+    fetcher = iter_fetch_contents(urls, max_content, timeout, deadline, budget)
+    while True:
+        try:
+            next(fetcher)
+        except StopIteration as stop:
+            return stop.value
+
+def iter_fetch_contents(urls, max_content, timeout=CONTENT_FETCH_TIMEOUT, deadline=CONTENT_FETCH_DEADLINE, budget=None):
+    """
+    并发提取多个页面的正文，每完成一个页面就产出一次进度
+
+    按搜索结果顺序保留前 max_content 篇成功的正文
+
+    Args:
+        urls: 按搜索结果顺序排列的 URL 列表
+        max_content: 最多保留的正文数量
+        timeout: 单个页面的超时时间（秒）
+        deadline: 整个阶段的总时限（秒）
+        budget: 可选的 TimeBudget，阶段时限不会超过剩余预算
+
+    Yields:
+        tuple: (URL 在列表中的下标, 正文内容)，失败或超时时正文为 None
+
+    Raises:
+        Cancelled: 当前请求已取消，尚未开始的页面不再提取
+
+    Returns:
+        dict: {URL 在列表中的下标: 正文内容}，作为生成器的返回值
+    """
+    if not urls or max_content <= 0:
+        return {}
+
+    budget = budget or TimeBudget(deadline)
+    end_time = time.monotonic() + budget.limit(deadline)
+    started = {}  # 下标 -> 开始执行的时间
+    outcome = {}  # 下标 -> 正文内容，失败时为 None
+    # 每个页面一个取消令牌：单个页面超时或已有足够的正文时取消，正在执行的提取立即停止并归还浏览器；
+    # 父令牌为当前请求的令牌，请求被取消时所有页面一起停止
+    tokens = [CancelToken(parent=current_token()) for _ in urls]
+
+    def fetch(index, url):
+        started[index] = time.monotonic()
+        marker = bind(tokens[index])
+        try:
+            return get_full_content(url, budget)
+        finally:
+            unbind(marker)
+
+    executor = ThreadPoolExecutor(max_workers=max(1, CONTENT_FETCH_WORKERS))
+    # 带上当前请求的追踪上下文，每个页面的耗时都能记入追踪记录
+    futures = {run_in_context(executor, fetch, i, url): i for i, url in enumerate(urls)}
+    pending = set(futures)
+
+    def decided():
+        """按顺序检查是否已能确定前 max_content 篇成功的正文"""
+        found = 0
+        for i in range(len(urls)):
+            if i not in outcome:
+                return False
+            if outcome[i]:
+                found += 1
+                if found >= max_content:
+                    return True
+        return True
+
+    try:
+        while pending and not decided():
+            check_cancelled()
+            now = time.monotonic()
+            if now >= end_time:
+                print("正文提取阶段超过总时限，放弃剩余页面")
+                break
+
+            done, pending = wait(pending, timeout=min(CANCEL_POLL_INTERVAL, end_time - now), return_when=FIRST_COMPLETED)
+            for future in done:
+                index = futures[future]
+                try:
+                    content = future.result()
+                except Cancelled:
+                    raise
+                except Exception as e:
+                    print(f"提取正文时出错: {e}")
+                    content = None
+                if content == FETCH_FAILED_TEXT:
+                    content = None
+                outcome[index] = content
+                yield index, content
+
+            # 单个页面超时：视为失败，不再等待
+            now = time.monotonic()
+            for future in list(pending):
+                index = futures[future]
+                if index in started and now - started[index] > timeout:
+                    print(f"提取正文超时: {urls[index]}")
+                    outcome[index] = None
+                    pending.discard(future)
+                    tokens[index].cancel("提取正文超时")
+                    yield index, None
+    finally:
+        # 已有足够的正文、阶段超时或请求被取消时，停止所有仍在执行的提取，尚未开始的任务直接取消
+        for token in tokens:
+            token.cancel("不再需要该页面的正文")
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    contents = {}
+    for i in range(len(urls)):
+        if len(contents) >= max_content:
+            break
+        if outcome.get(i):
+            contents[i] = outcome[i]
+    return contents
 
 
 # --- 修改后的 search 函数 ---
-def search(query):
+def search(query, budget=None):
     """
     搜索策略：
     查找多条结果的标题和摘要，并为前三条有效结果提取正文内容。
+
+    Args:
+        query: 搜索关键词
+        budget: 可选的 TimeBudget，默认使用 SEARCH_TIME_BUDGET 秒
     """
-    options=webdriver.ChromeOptions()
-    options.add_argument("--headless") # 使用无头模式，不显示浏览器窗口
-    options.add_argument("--disable-gpu")
-    options.add_argument("--log-level=3")
-    options.add_argument("--no-sandbox")
-    options.add_argument("--disable-blink-features=AutomationControlled")
-    options.add_experimental_option("excludeSwitches", ["enable-automation"])
-    options.add_experimental_option("useAutomationExtension", False)
-    options.add_argument("--lang=zh-CN")
-    options.add_argument('user-agent="Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"')
+    results = []
+    for event in search_events(query, budget):
+        if event["type"] == "done":
+            results = event["results"]
+    return results
+
+def search_events(query, budget=None):
+    """
+    与 search() 相同的搜索流程，但以生成器的形式边搜索边产出进度事件
 
-    service=ChromeService(executable_path=driver_path)
-    driver=webdriver.Chrome(service=service,options=options)
-    driver.implicitly_wait(5)
+    事件均为 dict，type 字段取值：
+        serp_loaded: 搜索结果页已加载，含 title（页面标题）和 count（结果容器数量）
+        result: 解析到一条结果，含 index、title 和 snippet
+        content: 一条结果的正文提取结束，含 index、title 和 ok（是否成功）
+        done: 搜索结束，含 results（与 search() 返回值相同）、sources 和 partial：
+              sources 为每条结果正文的获取情况 [{"index", "title", "body"}, ...]，
+              body 取值 fetched（已获取）、failed（失败）、late（时间预算用完时仍未完成，已丢弃）、
+              skipped（已有足够的正文，未提取）、none（没有链接）；
+              partial 为 True 表示有正文因时间预算用完被丢弃，结果不完整
 
+    当前请求被取消时停止页面加载、不再提取剩余正文，并抛出 Cancelled（不产出 done 事件）。
+
+    Args:
+        query: 搜索关键词
+        budget: 可选的 TimeBudget，默认使用 SEARCH_TIME_BUDGET 秒
+    """
+    budget = budget or TimeBudget()
+    search_started = time.perf_counter()
     # 使用百度搜索
-    base_url = "https://www.baidu.com" # 用于拼接相对 URL
+    base_url = SEARCH_BASE_URL # 用于拼接相对 URL
     search_url=f"{base_url}/s?wd={query}"
     extract_data = [] # 存储最终结果
-    content_count = 0  # 已经提取的正文数量
+    result_urls = []   # 与 extract_data 一一对应的结果链接
+    body_status = {}   # 结果下标 -> 正文获取情况
     max_content = 3    # 最多提取3篇正文
 
     try:
-        driver.get(search_url)
-        print(f"页面标题: {driver.title}")
-        time.sleep(3) # 等待页面初步渲染
+        # 只在加载搜索结果页时占用浏览器，提取正文前先归还给浏览器池
+        with span("serp_load"):
+            with driver_pool.lease(timeout=budget.remaining()) as driver:
+                load_page(driver, search_url, budget, SERP_RESULT_SELECTOR, crawl_profiles["search"])
+                page_title = driver.title
+                print(f"页面标题: {page_title}")
+                page_source = driver.page_source
 
-        soup = BeautifulSoup(driver.page_source, 'html.parser')
-        search_results = soup.select('div.result, div.c-container') # 查找结果容器
+        check_cancelled()
+        soup = BeautifulSoup(page_source, 'html.parser')
+        search_results = soup.select(SERP_RESULT_SELECTOR) # 查找结果容器
         print(f"找到 {len(search_results)} 个可能的搜索结果容器")
+        yield {"type": "serp_loaded", "title": page_title, "count": len(search_results)}
 
         count = 0
         max_results = 9 # 限制总结果数
@@ -311,33 +825,54 @@ def search(query):
                         "snippet": snippet
                     }
 
-                    # --- 尝试提取正文 (最多提取3篇) ---
-                    if url and content_count < max_content:
-                        full_content = get_full_content(url)
-                        if full_content:
-                            result_data["content"] = full_content
-                            content_count += 1 # 成功提取一篇正文
-                            print(f"已提取 {content_count}/{max_content} 篇正文")
-                        else:
-                            print(f"未能获取 '{title}' 的正文内容。")
-
                     extract_data.append(result_data)
+                    result_urls.append(url)
                     count += 1 # 只有成功提取标题和摘要才计数
+                    yield {"type": "result", "index": len(extract_data) - 1, "title": title, "snippet": snippet}
 
             except Exception as e:
                 print(f"处理单个结果时出错: {e}")
                 continue
 
+        # --- 并发提取正文 (最多提取3篇) ---
+        candidates = [i for i, url in enumerate(result_urls) if url]
+        fetch_started = time.perf_counter()
+        fetcher = iter_fetch_contents([result_urls[i] for i in candidates], max_content, budget=budget)
+        while True:
+            try:
+                pos, content = next(fetcher)
+            except StopIteration as stop:
+                contents = stop.value
+                break
+            index = candidates[pos]
+            body_status[index] = "fetched" if content else "failed"
+            yield {"type": "content", "index": index, "title": extract_data[index]["title"], "ok": bool(content)}
+        record("fetch_contents", fetch_started, time.perf_counter() - fetch_started)
+        for pos, content in contents.items():
+            extract_data[candidates[pos]]["content"] = content
+        # 正文不够时仍未完成的页面是因时限用完被放弃的（迟到），否则是已有足够正文而跳过的
+        late = len(contents) < max_content
+        included = {candidates[pos] for pos in contents}
+        for index in candidates:
+            if index not in body_status:
+                body_status[index] = "late" if late else "skipped"
+            elif body_status[index] == "fetched" and index not in included:
+                body_status[index] = "skipped"
+        print(f"已提取 {len(contents)}/{max_content} 篇正文")
+
     except TimeoutException:
         print("页面加载超时")
+    except Cancelled:
+        print(f"搜索已取消: {query}")
+        raise
     except Exception as e:
         print(f"搜索过程中出错: {e}")
-    finally:
-        if 'driver' in locals() and driver:
-            driver.quit()
-            print("浏览器已关闭。")
 
-    return extract_data
+    record("search", search_started, time.perf_counter() - search_started)
+    sources = [{"index": i, "title": item["title"], "body": body_status.get(i, "none")}
+               for i, item in enumerate(extract_data)]
+    yield {"type": "done", "results": extract_data, "sources": sources,
+           "partial": any(source["body"] == "late" for source in sources)}
 
 # --- 主程序入口 ---
 if __name__=="__main__":